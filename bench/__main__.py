@@ -0,0 +1,116 @@
+"""Times the renderer on generated scenes and writes the results as JSON
+
+Every combination of the values given for the scene parameters is run. For
+example, to see how the triangle size changes the time spent rasterizing:
+
+    python -m bench --triangle-size 4 16 64 --output results.json
+"""
+import argparse
+import dataclasses
+import itertools
+import json
+import platform
+import sys
+import tempfile
+
+import numpy as np
+import PIL
+
+import bench.pipeline as pipeline
+import bench.scenes as scenes
+
+
+def parse_args(args: "list[str]") -> argparse.Namespace:
+    defaults = scenes.SceneConfig()
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--triangles", type=int, nargs="+", default=[defaults.triangles], help="triangles drawn in each frame")
+    parser.add_argument("--triangle-size", type=float, nargs="+", default=[defaults.triangle_size], help="size of each triangle in pixels")
+    parser.add_argument("--overdraw", type=int, nargs="+", default=[defaults.overdraw], help="triangles stacked on top of each covered pixel")
+    parser.add_argument("--resolution", nargs="+", default=[f"{defaults.width}x{defaults.height}"], help="WIDTHxHEIGHT of the images")
+    parser.add_argument("--frames", type=int, nargs="+", default=[defaults.frames], help="images in the animation")
+    parser.add_argument("--shading", choices=("trif", "trig"), nargs="+", default=["trif"], help="draw with trif or trig")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each scene, the fastest one is reported")
+    parser.add_argument("--output", "-o", help="file to write the JSON results to, stdout if not given")
+    options = parser.parse_args(args)
+    if options.repeat < 1:
+        parser.error("--repeat must be at least 1")
+    try:
+        options.resolution = [tuple(map(int, size.split("x"))) for size in options.resolution]
+    except ValueError:
+        parser.error("--resolution must look like WIDTHxHEIGHT")
+    return options
+
+def scene_configs(options: argparse.Namespace) -> "list[scenes.SceneConfig]":
+    return [
+        scenes.SceneConfig(
+            triangles=triangles,
+            triangle_size=size,
+            overdraw=overdraw,
+            width=width,
+            height=height,
+            frames=frames,
+            gouraud=shading == "trig",
+        )
+        for triangles, size, overdraw, (width, height), frames, shading in itertools.product(
+            options.triangles, options.triangle_size, options.overdraw,
+            options.resolution, options.frames, options.shading,
+        )
+    ]
+
+def run_scene(config: scenes.SceneConfig, repeat: int) -> dict:
+    """Runs a scene repeat times with and without the stage timers and keeps the
+    fastest time of each stage
+    """
+    file_lines = scenes.generate_scene(config)
+    best: "pipeline.StageResult | None" = None
+    end_to_end = float("inf")
+    with tempfile.TemporaryDirectory() as output_dir:
+        for _ in range(repeat):
+            result = pipeline.run_stages(file_lines, output_dir)
+            if best is None:
+                best = result
+            else:
+                for field in dataclasses.fields(best.times):
+                    setattr(best.times, field.name, min(getattr(best.times, field.name), getattr(result.times, field.name)))
+            end_to_end = min(end_to_end, pipeline.run_end_to_end(file_lines, output_dir))
+    drawn = config.triangles * config.frames
+    return {
+        "name": config.name,
+        "config": dataclasses.asdict(config),
+        "lines": len(file_lines),
+        "stages": dataclasses.asdict(best.times),
+        "staged_total": best.times.total,
+        "end_to_end": end_to_end,
+        "triangles_per_second": drawn / end_to_end if end_to_end > 0 else 0.0,
+        "triangles": best.triangles,
+        "culled": best.culled,
+        "fragments": best.fragments,
+        "pixels_written": best.pixels_written,
+    }
+
+def main(args: "list[str]") -> None:
+    options = parse_args(args)
+    results = []
+    for config in scene_configs(options):
+        print(f"running {config.name}", file=sys.stderr)
+        results.append(run_scene(config, options.repeat))
+    report = {
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "pillow": PIL.__version__,
+            "machine": platform.machine(),
+            "system": platform.system(),
+        },
+        "repeat": options.repeat,
+        "results": results,
+    }
+    if options.output:
+        with open(options.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,155 @@
+import dataclasses
+import os
+import time
+from typing import Iterable
+
+import numpy as np
+
+import src.file_parse as file_parse
+import src.framebuffer as framebuffer
+import src.frames as frames
+import src.lines as lines
+import src.three_d as three_d
+import src.utils as utils
+import src.vertex as vertex
+
+
+# The drawing keywords, and whether they use gouraud shading
+DRAW_COMMANDS = {"trif": False, "trig": True}
+# Keywords that only add to the vertex list, so triangles waiting to be drawn
+# are not affected by them
+VERTEX_COMMANDS = {"xyz", "color"}
+
+@dataclasses.dataclass
+class StageTimes():
+    """The seconds spent in each stage of the pipeline
+    \b parse: reading lines and running every command except drawing
+    \b transform: transforming and culling the vertexes of the triangles
+    \b rasterize: turning triangles into fragments and the near/far test
+    \b depth_test: the depth test and writing to the color and depth buffers
+    \b save: encoding and writing the png files
+    """
+    parse: float = 0.0
+    transform: float = 0.0
+    rasterize: float = 0.0
+    depth_test: float = 0.0
+    save: float = 0.0
+
+    @property
+    def total(self) -> float:
+        return sum(dataclasses.astuple(self))
+
+@dataclasses.dataclass
+class StageResult():
+    """What happened while running a file one stage at a time
+    \b times: the seconds spent in each stage
+    \b triangles: the number of triangles submitted
+    \b culled: the number of triangles thrown away before rasterizing
+    \b fragments: the number of fragments that passed the near/far test
+    \b pixels_written: the number of fragments that passed the depth test
+    """
+    times: StageTimes = dataclasses.field(default_factory=StageTimes)
+    triangles: int = 0
+    culled: int = 0
+    fragments: int = 0
+    pixels_written: int = 0
+
+def _draw_triangles(image: np.ndarray, draw_data: utils.DrawData, triangles: list, result: StageResult) -> None:
+    """Draws triangles that were parsed but not drawn yet, timing each stage
+    """
+    times = result.times
+    start = time.perf_counter()
+    screen_triangles = []
+    for i1, i2, i3, color in triangles:
+        p1 = three_d.screen_vertex(draw_data, i1)
+        p2 = three_d.screen_vertex(draw_data, i2)
+        p3 = three_d.screen_vertex(draw_data, i3)
+        if three_d.cull_triangle(draw_data, p1, p2, p3):
+            result.culled += 1
+        else:
+            screen_triangles.append((p1, p2, p3, color))
+    times.transform += time.perf_counter() - start
+
+    height, width = draw_data.depth_buffer.shape
+    for p1, p2, p3, color in screen_triangles:
+        start = time.perf_counter()
+        fragments = lines.rasterize_triangle(p1, p2, p3, width=width, height=height, perspective_correct=color is None)
+        fragments = fragments.select((draw_data.near <= fragments.z) & (fragments.z <= draw_data.far))
+        middle = time.perf_counter()
+        result.pixels_written += framebuffer.write_fragments(image, draw_data.depth_buffer, fragments, color)
+        times.rasterize += middle - start
+        times.depth_test += time.perf_counter() - middle
+        result.fragments += len(fragments)
+    triangles.clear()
+
+def run_stages(file_lines: "Iterable[str]", output_dir: str) -> StageResult:
+    """Renders a pngs file with each stage of the pipeline timed on its own. The
+    triangles are collected while the lines are parsed and drawn once a command
+    that could change how they are drawn comes up, or at the end of the block.
+    The images are the same as the ones main.py makes.
+
+    Args:
+        file_lines (Iterable[str]): every line of the file, including the first
+        output_dir (str): the directory the png files are saved in
+
+    Returns:
+        StageResult: the time spent in each stage and what was drawn
+    """
+    file_lines = iter(file_lines)
+    image_info = file_parse.get_image_info(next(file_lines))
+    images = utils.make_images(image_info)
+    filenames = [os.path.join(output_dir, name) for name in utils.make_filename_list(image_info)]
+    draw_data = utils.DrawData(
+        vertex_list=vertex.VertexBuffer(),
+        height=image_info.height,
+        width=image_info.width
+    )
+    result = StageResult()
+    for index, blocks in frames.split_frames(file_lines).items():
+        image = images[index]
+        for block in blocks:
+            draw_data.clear()
+            triangles = []
+            start = time.perf_counter()
+            for text in block:
+                line = utils.line_to_list(text)
+                if not line:
+                    continue
+                if line[0] in DRAW_COMMANDS:
+                    i1, i2, i3 = map(draw_data.vertex_list.index_of, line[1:4])
+                    color = None if DRAW_COMMANDS[line[0]] else draw_data.color.as_rgb(rounded=True)
+                    triangles.append((i1, i2, i3, color))
+                    result.triangles += 1
+                    continue
+                if triangles and line[0] not in VERTEX_COMMANDS:
+                    result.times.parse += time.perf_counter() - start
+                    _draw_triangles(image, draw_data, triangles, result)
+                    start = time.perf_counter()
+                file_parse.parse_line(line, image, draw_data)
+            result.times.parse += time.perf_counter() - start
+            _draw_triangles(image, draw_data, triangles, result)
+    start = time.perf_counter()
+    for image, filename in zip(images, filenames):
+        framebuffer.to_image(image).save(filename)
+    result.times.save += time.perf_counter() - start
+    return result
+
+def run_end_to_end(file_lines: "Iterable[str]", output_dir: str) -> float:
+    """Renders a file the way main.py does without any options
+
+    Returns:
+        float: the seconds it took to parse, draw and save the file
+    """
+    start = time.perf_counter()
+    file_lines = iter(file_lines)
+    image_info = file_parse.get_image_info(next(file_lines))
+    images = utils.make_images(image_info)
+    draw_data = utils.DrawData(
+        vertex_list=vertex.VertexBuffer(),
+        height=image_info.height,
+        width=image_info.width
+    )
+    file_parse.parse_lines(file_lines, images, draw_data)
+    for image, name in zip(images, utils.make_filename_list(image_info)):
+        framebuffer.to_image(image).save(os.path.join(output_dir, name))
+    return time.perf_counter() - start
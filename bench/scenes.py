@@ -0,0 +1,83 @@
+import dataclasses
+import random
+
+
+@dataclasses.dataclass
+class SceneConfig():
+    """The parameters of a generated scene
+    \b triangles: the number of triangles drawn in each frame
+    \b triangle_size: the length in pixels of the two short sides of each triangle
+    \b overdraw: how many triangles are stacked on top of each covered pixel
+    \b width: the width of the images
+    \b height: the height of the images
+    \b frames: the number of images in the animation
+    \b gouraud: use trig with a color per vertex instead of trif
+    \b seed: the seed of the random triangle positions
+    """
+    triangles: int = 1000
+    triangle_size: float = 16
+    overdraw: int = 1
+    width: int = 256
+    height: int = 256
+    frames: int = 1
+    gouraud: bool = False
+    seed: int = 0
+
+    @property
+    def name(self) -> str:
+        shading = "trig" if self.gouraud else "trif"
+        return (
+            f"{self.triangles}tri_{self.triangle_size:g}px_x{self.overdraw}_"
+            f"{self.width}x{self.height}_{self.frames}f_{shading}"
+        )
+
+def _to_ndc(pixel: float, size: int) -> float:
+    """Inverts the viewport transform, (x + 1) * size / 2
+    """
+    return pixel * 2 / size - 1
+
+def generate_scene(config: SceneConfig, filename: str = "bench") -> "list[str]":
+    """Makes the lines of a pngs file for a scene. The triangles are split into
+    config.overdraw layers that share the same positions, and the layers are drawn
+    from back to front so every layer passes the depth test. Each frame moves the
+    triangles a little to the right.
+
+    Args:
+        config (SceneConfig): the parameters of the scene
+        filename (str): the prefix of the png files the scene saves
+
+    Returns:
+        list[str]: the lines of the file, each ending in a newline
+    """
+    rng = random.Random(config.seed)
+    overdraw = max(1, config.overdraw)
+    per_layer = -(-config.triangles // overdraw)
+    size = config.triangle_size
+    corners = [
+        (rng.uniform(-size, config.width), rng.uniform(-size, config.height))
+        for _ in range(per_layer)
+    ]
+    colors = [(rng.random(), rng.random(), rng.random()) for _ in range(per_layer)]
+    lines = [f"pngs {config.width} {config.height} {filename} {config.frames}\n"]
+    for frame in range(config.frames):
+        lines.append(f"frame {frame}\n")
+        shift = frame * size / 4
+        drawn = 0
+        for layer in range(overdraw):
+            # the first layer is the furthest away
+            z = 1 - (layer + 1) / (overdraw + 1)
+            for (x, y), (r, g, b) in zip(corners, colors):
+                if drawn == config.triangles:
+                    break
+                points = ((x + shift, y), (x + shift + size, y), (x + shift, y + size))
+                for i, (px, py) in enumerate(points):
+                    if config.gouraud:
+                        # darken each corner so the colors are interpolated
+                        shade = 1 - i / 3
+                        lines.append(f"color {r * shade:.4f} {g * shade:.4f} {b * shade:.4f}\n")
+                    elif i == 0:
+                        lines.append(f"color {r:.4f} {g:.4f} {b:.4f}\n")
+                    lines.append(f"xyz {_to_ndc(px, config.width):.6f} {_to_ndc(py, config.height):.6f} {z:.6f}\n")
+                lines.append(f"{'trig' if config.gouraud else 'trif'} -3 -2 -1\n")
+                drawn += 1
+    return lines
@@ -1,8 +1,18 @@
-from src.vertex import Vertex
 import sys
 
 import src.file_parse as file_parse
+import src.frame_cache as frame_cache
+import src.framebuffer as framebuffer
+import src.frames as frames
+import src.hiz as hiz
+import src.image_writer as image_writer
+import src.incremental as incremental
+import src.scene_cache as scene_cache
+import src.stats as stats
+import src.streams as streams
+import src.tiles as tiles
 import src.utils as utils
+import src.vertex as vertex
 
 
 # Main method
@@ -13,40 +23,164 @@ if __name__ == "__main__":
 
     # open the file
     with open(cmnd_line_args.file, "r") as file:
-        lines = file.readlines()
         # Read the first line to determine meta info about the file
-        first_line: str
-        if lines:
-            first_line = lines[0]
-        else:
-            print("not enough lines")
+        first_line: str = file.readline()
+        if not first_line:
+            print("not enough lines", file=sys.stderr)
             raise
         
         # Get the image info from the first line
         image_info = file_parse.get_image_info(first_line)
-        # Make array of images
-        images = utils.make_images(image_info)
-        image_filenames = utils.make_filename_list(image_info)
-        currently_eddited_image_index = 0
-        draw_data = utils.DrawData(
-            vertex_list=[],
-            height=image_info.height,
-            width=image_info.width
-        )
-        if len(lines) > 1:
-            for i in range(1, len(lines)):
-                line = utils.line_to_list(lines[i])
-                # If the line is empty, do nothing
-                if not line:
-                    pass
-                # If the keywword is "frame", we move to edit the frame specified
-                elif line[0] == "frame":
-                    currently_eddited_image_index = int(line[1])
-                    draw_data.clear()
+        use_stats = cmnd_line_args.stats or cmnd_line_args.stats_file is not None
+        render_stats = None
+        if cmnd_line_args.frame_cache is not None:
+            # Only draw the frames that were not rendered before
+            render_stats = frame_cache.render_cached(
+                file, image_info,
+                frame_cache.FrameCache(cmnd_line_args.frame_cache, cmnd_line_args.frame_cache_size << 20),
+                jobs=cmnd_line_args.jobs,
+                use_hiz=cmnd_line_args.hiz,
+                use_stats=use_stats,
+                image_format=cmnd_line_args.format,
+                compress_level=cmnd_line_args.compression,
+                depth_format=cmnd_line_args.depth,
+                blend=cmnd_line_args.blend,
+            )
+        # Frames of an animation can be rendered on several processes at once
+        elif cmnd_line_args.jobs > 1 and image_info.number_of_images > 1:
+            render_stats = frames.render_in_parallel(
+                file, image_info, cmnd_line_args.jobs,
+                use_hiz=cmnd_line_args.hiz,
+                use_stats=use_stats,
+                image_format=cmnd_line_args.format,
+                compress_level=cmnd_line_args.compression,
+                depth_format=cmnd_line_args.depth,
+                blend=cmnd_line_args.blend,
+            )
+        else:
+            draw_data = utils.DrawData(
+                vertex_list=vertex.VertexBuffer(),
+                height=image_info.height,
+                width=image_info.width,
+                depth_format=cmnd_line_args.depth,
+                blend=cmnd_line_args.blend,
+            )
+            if use_stats:
+                draw_data.stats = stats.RenderStats()
+                render_stats = draw_data.stats
+            hiz_stats = None
+            # The rest of the file is read and drawn one line at a time, unless it
+            # was compiled before and can be drawn without parsing it
+            scene = None
+            if cmnd_line_args.scene_cache is not None:
+                scene = scene_cache.load_or_compile(cmnd_line_args.file, cmnd_line_args.scene_cache)
+            if cmnd_line_args.format in streams.STREAM_FORMATS:
+                # Only the frame being drawn is kept, and it is streamed into the
+                # output once drawing moves past it
+                images = writer = streams.FrameStream(
+                    cmnd_line_args.output or streams.output_filename(image_info, cmnd_line_args.format),
+                    cmnd_line_args.format,
+                    image_info,
+                    fps=cmnd_line_args.fps,
+                    compress_level=cmnd_line_args.compression,
+                    premultiplied=cmnd_line_args.blend == "premultiplied",
+                )
+            else:
+                # Find the image each block draws into, so each image can be
+                # made when drawing reaches it and saved after its last block
+                if scene is not None:
+                    blocks = scene_cache.block_images(scene)
                 else:
-                    file_parse.parse_line(line, images[currently_eddited_image_index], draw_data)
-
-        assert(len(image_filenames) == len(images))
-        # Save each of the files
-        for i in range(len(image_filenames)):
-            images[i].save(image_filenames[i])
+                    start = file.tell()
+                    blocks = frames.block_images(file)
+                    file.seek(start)
+                image_filenames = [
+                    framebuffer.image_filename(filename, cmnd_line_args.format)
+                    for filename in utils.make_filename_list(image_info)
+                ]
+                # Each image is encoded and saved in the background as soon as
+                # the last block that draws into it ends
+                images = writer = image_writer.FrameWriter(
+                    image_filenames,
+                    image_info.width,
+                    image_info.height,
+                    blocks,
+                    image_format=cmnd_line_args.format,
+                    compress_level=cmnd_line_args.compression,
+                    workers=cmnd_line_args.encode_threads,
+                    premultiplied=cmnd_line_args.blend == "premultiplied",
+                )
+            with streams.exit_on_broken_pipe(), writer:
+                if cmnd_line_args.tile_workers > 1:
+                    # Collect the triangles of each frame and draw them tile by tile
+                    draw_data.display_list = []
+                    with tiles.TileRenderer(
+                        width=image_info.width,
+                        height=image_info.height,
+                        depth_dtype=draw_data.depth_buffer.dtype,
+                        workers=cmnd_line_args.tile_workers,
+                        tile_size=cmnd_line_args.tile_size,
+                        use_hiz=cmnd_line_args.hiz,
+                    ) as renderer:
+                        end_frame = writer.after(renderer.render)
+                        if scene is not None:
+                            parse_stats = scene_cache.replay(scene, images, draw_data, end_frame=end_frame)
+                        else:
+                            parse_stats = file_parse.parse_lines(file, images, draw_data, end_frame=end_frame)
+                    if cmnd_line_args.hiz:
+                        hiz_stats = renderer.hiz_stats
+                elif cmnd_line_args.incremental:
+                    # Collect the triangles of each frame and only redraw what changed
+                    draw_data.display_list = []
+                    renderer = incremental.IncrementalRenderer(
+                        width=image_info.width,
+                        height=image_info.height,
+                        use_hiz=cmnd_line_args.hiz,
+                    )
+                    end_frame = writer.after(renderer.render)
+                    if scene is not None:
+                        parse_stats = scene_cache.replay(scene, images, draw_data, end_frame=end_frame)
+                    else:
+                        parse_stats = file_parse.parse_lines(file, images, draw_data, end_frame=end_frame)
+                    if cmnd_line_args.hiz:
+                        hiz_stats = renderer.hiz_stats
+                else:
+                    if cmnd_line_args.hiz:
+                        draw_data.hiz = hiz.HierarchicalZ(draw_data.depth_buffer)
+                        hiz_stats = draw_data.hiz.stats
+                    if scene is not None:
+                        parse_stats = scene_cache.replay(scene, images, draw_data, end_frame=writer.end_frame)
+                    else:
+                        parse_stats = file_parse.parse_lines(file, images, draw_data, end_frame=writer.end_frame)
+            # only the time drawing waited for the writer, the rest was hidden behind drawing
+            if render_stats is not None:
+                render_stats.save_seconds += writer.wait_seconds
+            if cmnd_line_args.verbose:
+                print(
+                    f"parsed {parse_stats.lines} lines in {parse_stats.seconds:.3f}s "
+                    f"({parse_stats.lines_per_second:.0f} lines/second)",
+                    file=sys.stderr
+                )
+                print(
+                    f"encoded images for {writer.encode_seconds:.3f}s in the background, "
+                    f"waiting {writer.wait_seconds:.3f}s for them",
+                    file=sys.stderr
+                )
+                if cmnd_line_args.incremental:
+                    print(
+                        f"reused {renderer.reused_frames} frames, "
+                        f"redrawing {renderer.redrawn_pixels} pixels of them",
+                        file=sys.stderr
+                    )
+                if hiz_stats is not None:
+                    print(
+                        f"hi-z rejected {hiz_stats.triangles_rejected} of {hiz_stats.triangles_tested} triangles "
+                        f"and {hiz_stats.blocks_rejected} of {hiz_stats.blocks_tested} blocks, "
+                        f"skipping {hiz_stats.pixels_skipped} pixels",
+                        file=sys.stderr
+                    )
+    if render_stats is not None:
+        if cmnd_line_args.stats:
+            render_stats.report(sys.stderr)
+        if cmnd_line_args.stats_file is not None:
+            render_stats.write_json(cmnd_line_args.stats_file)
@@ -1,3 +1,6 @@
+import math
+
+import numpy as np
 
 from src.utils import RGB
 from src.vertex import Vertex
@@ -17,43 +20,144 @@ def make_permutations(x_initial, x, y_initial, y, color: RGB):
     v8 = Vertex(x_initial - y, y_initial - x, color.r, color.g, color.b, color.a)
     
     return [v1, v2, v3, v4, v5, v6, v7, v8]
+def circle_octant(radius: int) -> "tuple[np.ndarray, np.ndarray]":
+    """Finds the points of one octant of the midpoint circle all at once. They are
+    the same points draw_circle's loop steps through: y goes from 0 up while
+    y <= -x, and x is the smallest integer with 4(x^2 - x + y^2) <= 4r^2 + 5r + 1,
+    which is the decision variable of the loop written out.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray]: the x (never positive) and y of each point
+    """
+    limit = 4 * radius * radius + 5 * radius + 1
+    y = np.arange(radius + 1, dtype=np.int64)
+    x = np.ceil((1 - np.sqrt(np.maximum(1 + limit - 4 * y * y, 0))) / 2).astype(np.int64)
+    # move x by one where the square root rounded the wrong way
+    x = np.where(4 * (x * x - x + y * y) > limit, x + 1, x)
+    x = np.where(4 * ((x - 1) * (x - 1) - (x - 1) + y * y) <= limit, x - 1, x)
+    in_octant = y <= -x
+    return x[in_octant], y[in_octant]
+
+def circle_points(x_initial: int, y_initial: int, radius: int) -> "tuple[np.ndarray, np.ndarray]":
+    """Mirrors the octant into the whole circle, in the same order as draw_circle
+    """
+    x, y = circle_octant(radius)
+    xs = np.stack((x, x, -x, -x, y, y, -y, -y), axis=1).ravel() + x_initial
+    ys = np.stack((y, -y, y, -y, x, -x, x, -x), axis=1).ravel() + y_initial
+    return xs, ys
+
 def draw_circle(x_initial: int, y_initial: int, radius: int, color: RGB) -> "list[vertex.Vertex]":
-    x = -1 * radius
-    y = 0
-    p = -1 * radius - 1
-    px = -8 * radius
-    py = 4
-    pxx = 8
-    pyy = 8
-    output = []
-    while y <= -x:
-        output += make_permutations(x_initial, x, y_initial, y, color)
-        y += 1
-        p += py
-        py += pyy
-        if p > 0:
-            x += 1
-            p += px
-            px += pxx
-    return output
-
-def draw_bezier_point(points: "list[Vertex]", u: float):
-    copy_points = list(map(lambda c: lines.vertex_to_ndarray(c), points))
-    for k in range(1, len(points)):
-        for i in range(0, len(points) - k):
-            copy_points[i] = (1-u) * copy_points[i] + u * copy_points[i+1]
-    bezier_point = lines.ndarray_to_vertex(copy_points[0], is_rounded=False)
-    return bezier_point
-
-def draw_bezier_curve(points: "list[Vertex]", divisions: int = 1000) -> "list[Vertex]":
-    curve_points = []
-    for i in range(divisions):
-        u = i/float(divisions-1)
-        curve_points.append(draw_bezier_point(points, u))
+    xs, ys = circle_points(x_initial, y_initial, radius)
+    return [
+        Vertex(x, y, color.r, color.g, color.b, color.a)
+        for x, y in zip(xs.tolist(), ys.tolist())
+    ]
+
+def circle_fragments(x_initial: int, y_initial: int, radius: int, color: RGB, width: float = math.inf, height: float = math.inf) -> vertex.Fragments:
+    """Rasterizes the outline of a circle into fragments with a z of 0. Pixels the
+    octants share are only produced once and only pixels on the screen are kept.
+    """
+    xs, ys = circle_points(x_initial, y_initial, radius)
+    on_screen = (0 <= xs) & (xs < width) & (0 <= ys) & (ys < height)
+    points = np.unique(np.stack((xs[on_screen], ys[on_screen]), axis=1), axis=0)
+    n = len(points)
+    return vertex.Fragments(
+        points[:, 0], points[:, 1], np.zeros(n),
+        np.full(n, color.r / 255), np.full(n, color.g / 255), np.full(n, color.b / 255),
+    )
+
+def disk_spans(x_initial: int, y_initial: int, radius: int, width: int, height: int) -> "tuple[np.ndarray, np.ndarray, np.ndarray]":
+    """Finds the horizontal spans that fill a circle. Each octant point (x, y) gives
+    the half width -x of the rows y_initial +- y and the half width y of the rows
+    y_initial +- x, and every row keeps the widest one.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, np.ndarray]: the row of each span and the
+        first and one past the last x in it, clipped to the screen. Rows that are
+        off of the screen are left out.
+    """
+    x, y = circle_octant(radius)
+    half_widths = np.zeros(2 * radius + 1, dtype=np.int64)
+    # index radius + dy holds the half width of the row y_initial + dy
+    np.maximum.at(half_widths, radius + np.concatenate((y, -y, x, -x)), np.concatenate((-x, -x, y, y)))
+    rows = np.arange(y_initial - radius, y_initial + radius + 1)
+    starts = np.maximum(x_initial - half_widths, 0)
+    ends = np.minimum(x_initial + half_widths + 1, width)
+    visible = (0 <= rows) & (rows < height) & (starts < ends)
+    return rows[visible], starts[visible], ends[visible]
+
+def fill_circle(color_buffer: np.ndarray, x_initial: int, y_initial: int, radius: int, color: RGB) -> None:
+    """Draws a filled circle into an RGBA color buffer, one row at a time
+    """
+    height, width = color_buffer.shape[:2]
+    value = (color.r, color.g, color.b, color.a)
+    for row, start, end in zip(*(a.tolist() for a in disk_spans(x_initial, y_initial, radius, width, height))):
+        color_buffer[row, start:end] = value
+
+def bernstein_matrix(degree: int, u: np.ndarray) -> np.ndarray:
+    """Makes the (len(u), degree + 1) matrix of Bernstein polynomials, so that
+    bernstein_matrix(degree, u) @ control_points evaluates a curve at every u
+    """
+    i = np.arange(degree + 1)
+    binomials = np.array([math.comb(degree, k) for k in i], dtype=float)
+    u = np.asarray(u, dtype=float)[:, np.newaxis]
+    return binomials * u ** i * (1 - u) ** (degree - i)
+
+def bezier_points(control_points: np.ndarray, u: np.ndarray) -> np.ndarray:
+    """Evaluates a Bezier curve at every parameter in u at once
+
+    Args:
+        control_points (np.ndarray): (m, k) control points with k attributes each
+        u (np.ndarray): (n,) parameters from 0 to 1
+
+    Returns:
+        np.ndarray: (n, k) points on the curve
+    """
+    return bernstein_matrix(len(control_points) - 1, u) @ control_points
+
+def flattening_divisions(control_points: np.ndarray, tolerance: float = 0.5) -> int:
+    """Finds how many equal steps in u are needed for the line segments between
+    them to stay within tolerance pixels of the curve. A curve of degree d split
+    into n steps is never further than d * (d - 1) / 8 * max|P[i] - 2P[i+1] + P[i+2]| / n^2
+    from its segments, so straight curves only need a single segment.
+    """
+    degree = len(control_points) - 1
+    if degree < 2:
+        return 1
+    xy = control_points[:, :2]
+    second_differences = xy[:-2] - 2 * xy[1:-1] + xy[2:]
+    bound = degree * (degree - 1) / 8 * np.sqrt((second_differences ** 2).sum(axis=1)).max()
+    return max(1, math.ceil(math.sqrt(bound / tolerance)))
+
+def draw_bezier_point(points: "list[Vertex]", u: float) -> Vertex:
+    control_points = np.stack([point.as_ndarray() for point in points])
+    bezier_point = bezier_points(control_points, np.array([u]))[0]
+    return vertex.ndarray_to_vertex(bezier_point, is_rounded=False)
+
+def draw_bezier_curve(points: "list[Vertex]", tolerance: float = 0.5, divisions: "int | None" = None, width: float = math.inf, height: float = math.inf) -> vertex.Fragments:
+    """Rasterizes the Bezier curve with points as its control points. The curve is
+    flattened into as few line segments as keep it within tolerance pixels, which
+    are evaluated and drawn together.
+
+    Args:
+        tolerance (float): the largest distance in pixels between the curve and
+            the line segments that are drawn
+        divisions (int, optional): split the curve into this many points instead
+        width, height (float): only fragments on a screen this size are produced
+
+    Returns:
+        vertex.Fragments: the pixels of the curve, in order along it, with the z
+        and colors of the points interpolated. A pixel is not repeated right after
+        itself, but a curve that crosses itself can cover a pixel twice.
+    """
+    control_points = np.stack([point.as_ndarray() for point in points])
+    if divisions is None:
+        divisions = flattening_divisions(control_points, tolerance) + 1
+    u = np.linspace(0, 1, max(divisions, 2))
+    curve_points = bezier_points(control_points, u)
     # draw lines between each of points on the curve
-    verts = []
-    for i in range(len(curve_points)-1):
-        v1 = curve_points[i]
-        v2 = curve_points[i+1]
-        verts += lines.dda_on_vertex(v1, v2)
-    return verts
\ No newline at end of file
+    fragments = lines.dda_batch(curve_points[:-1], curve_points[1:], width, height)
+    # neighboring segments can round to the same pixel where they meet
+    repeated = np.zeros(len(fragments), dtype=bool)
+    repeated[1:] = (fragments.x[1:] == fragments.x[:-1]) & (fragments.y[1:] == fragments.y[:-1])
+    return fragments.select(~repeated)
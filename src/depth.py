@@ -0,0 +1,49 @@
+import numpy as np
+
+
+# The formats a depth buffer can be stored in. Floating point buffers hold z as
+# it is, unorm buffers hold z from 0 to 1 rounded to 2 ** bits - 1 steps. Like the
+# D24 format of GPUs, 24 bit depth is kept in 32 bit words.
+FORMATS = {
+    "float64": np.dtype(np.float64),
+    "float32": np.dtype(np.float32),
+    "unorm24": np.dtype(np.uint32),
+    "unorm16": np.dtype(np.uint16),
+}
+
+def _unorm_max(dtype: np.dtype) -> int:
+    return (1 << 24) - 1 if dtype == np.uint32 else np.iinfo(dtype).max
+
+def far_value(dtype: np.dtype) -> "float | int":
+    """The value a depth buffer is cleared to, a z of 1
+    """
+    dtype = np.dtype(dtype)
+    if dtype.kind == "f":
+        return 1.0
+    return _unorm_max(dtype)
+
+def to_depth(z: "np.ndarray | float", dtype: np.dtype) -> "np.ndarray | float":
+    """Converts z values from 0 to 1 into the values stored in a depth buffer of
+    dtype. The conversion never changes the order of two z values, so testing the
+    converted values gives the same result as testing z at the precision of the
+    buffer. Float64 z is returned as it is.
+    """
+    dtype = np.dtype(dtype)
+    if dtype == np.float64:
+        return z
+    if dtype.kind == "f":
+        return np.asarray(z, dtype=dtype)
+    return np.rint(np.clip(z, 0, 1) * _unorm_max(dtype)).astype(dtype)
+
+def make_depth_buffer(width: int, height: int, depth_format: str = "float64") -> np.ndarray:
+    """Makes a cleared (height, width) depth buffer in one of FORMATS
+    """
+    if depth_format not in FORMATS:
+        raise Exception("unknown depth format", depth_format)
+    dtype = FORMATS[depth_format]
+    return np.full((height, width), far_value(dtype), dtype=dtype)
+
+def clear(depth_buffer: np.ndarray) -> None:
+    """Sets every value of a depth buffer back to the far value
+    """
+    depth_buffer.fill(far_value(depth_buffer.dtype))
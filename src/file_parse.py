@@ -1,10 +1,13 @@
 
 import copy
+import dataclasses
 import math
+import time
+from typing import Callable, Iterable
 
 import numpy as np
-from PIL import Image
 
+import src.meshes as meshes
 import src.three_d as three_d
 import src.utils as utils
 import src.vertex as vertex
@@ -28,174 +31,361 @@ def get_image_info(line: str) -> utils.ImageInfo:
     )
     # Set the values for the case in which we are making multiple png files
     if line_as_list[0] == "pngs":
+        image_info.is_single_file = False
         image_info.number_of_images = int(line_as_list[-1])
 
     return image_info
 
-def get_vertex_by_index(verts, index: str) -> vertex.Vertex:
-    if (index.strip("-")).isnumeric():
-        index = int(index)
-    else:
-        raise Exception("The index of a vertex must be a number", index)
-    # if its a negative index just use that idex
-    if index < 0:
-        return verts[index]
-    return verts[index - 1]
-
-def parse_line(line: "list[str]", image: Image, draw_data: utils.DrawData) -> None:
-    """
-    parse keywords:
-    \b xyz x y z:
-    \b trif i1 i2 i3
-    \b color r g b:
-    \b loadmv a11 a12 ... a44
-    \b loadp a11 a12 ... a44
-    """
-    keyword: str = line[0]
-    ### DRAW DATA UPDATES ###
-    if keyword == "xyz":
-        new_vertex: vertex.Vertex = vertex.Vertex(
-            x=float(line[1]),
-            y=float(line[2]),
-            z=float(line[3]),
-            r=draw_data.color.r,
-            g=draw_data.color.g,
-            b=draw_data.color.b,
-            a=draw_data.color.a,
-        )
-        draw_data.vertex_list.append(new_vertex)
-
-    elif keyword == "color":
-        r = float(line[1])
-        g = float(line[2])
-        b = float(line[3])
-        draw_data.color = utils.RGBFloat(r, g, b)
-    
-    elif keyword == "loadmv":
-        # Take the 1x16 list and turn it into a 4x4 ndarray
-        draw_data.model_view = np.asarray(line[1:], float).reshape(4,4)
-
-    elif keyword == "loadp":
-        # Take the 1x16 list and turn it into a 4x4 ndarray
-        draw_data.projection = np.asarray(line[1:], float).reshape(4,4)
-    
-    ### DRAWING TRIANGLES ###
-    elif keyword == "trif":
-        i1, i2, i3 = line[1:4]
-        p1 = get_vertex_by_index(draw_data.vertex_list, i1)
-        p2 = get_vertex_by_index(draw_data.vertex_list, i2)
-        p3 = get_vertex_by_index(draw_data.vertex_list, i3)
-        three_d.draw_3d_triangle(image, draw_data, p1, p2, p3)
-    
-    elif keyword == "trig":
-        i1, i2, i3 = line[1:4]
-        p1 = get_vertex_by_index(draw_data.vertex_list, i1)
-        p2 = get_vertex_by_index(draw_data.vertex_list, i2)
-        p3 = get_vertex_by_index(draw_data.vertex_list, i3)
-        three_d.draw_3d_triangle(image, draw_data, p1, p2, p3, gouraud=True)
-    
-    ### MATRIX MANIPULATION ###
-    elif keyword == "translate":
-        assert len(line) == 4
-        dx: float = float(line[1])
-        dy: float = float(line[2])
-        dz: float = float(line[3])
-        translate_matrix = np.identity(4)
-        translate_matrix[0,3] = dx
-        translate_matrix[1,3] = dy
-        translate_matrix[2,3] = dz
-        draw_data.model_view = np.matmul(draw_data.model_view, translate_matrix)
-
-    elif keyword == "rotatex":
-        assert len(line) == 2
-        theta = math.radians(float(line[1]))
-
-        sin_theta = math.sin(theta)
-        cos_theta = math.cos(theta)
-
-        rotation_matrix = np.identity(4)
-        rotation_matrix[1,1] = cos_theta
-        rotation_matrix[2,2] = cos_theta
-        rotation_matrix[2,1] = sin_theta
-        rotation_matrix[1,2] = -sin_theta
-        draw_data.model_view = np.matmul(draw_data.model_view, rotation_matrix)
-    
-    elif keyword == "rotatey":
-        assert len(line) == 2
-        theta = math.radians(float(line[1]))
-
-        sin_theta = math.sin(theta)
-        cos_theta = math.cos(theta)
-
-        rotation_matrix = np.identity(4)
-        rotation_matrix[0,0] = cos_theta
-        rotation_matrix[2,2] = cos_theta
-        rotation_matrix[0,2] = sin_theta
-        rotation_matrix[2,0] = -sin_theta
-        draw_data.model_view = np.matmul(draw_data.model_view, rotation_matrix)
-    
-    elif keyword == "rotatez":
-        assert len(line) == 2
-        theta = math.radians(float(line[1]))
-
-        sin_theta = math.sin(theta)
-        cos_theta = math.cos(theta)
-
-        rotation_matrix = np.identity(4)
-        rotation_matrix[0,0] = cos_theta
-        rotation_matrix[1,1] = cos_theta
-        rotation_matrix[1,0] = sin_theta
-        rotation_matrix[0,1] = -sin_theta
-        draw_data.model_view = np.matmul(draw_data.model_view, rotation_matrix)
-    
-    elif keyword == "scale":
-        assert len(line) == 4
-        sx = float(line[1])
-        sy = float(line[2])
-        sz = float(line[3])
-
-        scale_matrix = np.identity(4)
-        scale_matrix[0,0] = sx
-        scale_matrix[1,1] = sy
-        scale_matrix[2,2] = sz
-        draw_data.model_view = np.matmul(draw_data.model_view, scale_matrix)
-    
-    elif keyword == "multmv":
-        # Take the 1x16 list and turn it into a 4x4 ndarray
-        assert len(line) == 17
-        draw_data.model_view = np.matmul(draw_data.model_view, np.asarray(line[1:], float).reshape(4,4))
-
-    elif keyword == "rotate":
-        # Info about the rotation matrix taken from 
-        # http://www.songho.ca/opengl/gl_matrix.html and 
-        # https://www.khronos.org/registry/OpenGL-Refpages/gl2.1/xhtml/glRotate.xml
-        assert len(line) == 5
-        # radians we will rotate counter-clockwise
-        theta = math.radians(float(line[1]))
-        # x, y, and z components of our rotation vector
-        x = float(line[2])
-        y = float(line[3])
-        z = float(line[4])
-        ## The first step is to normalize the vector
-        length = math.sqrt(x*x + y*y + z*z)
-        x = x/length
-        y = y/length
-        z = z/length
-        print(f"normal = {x * y * z}. Length = {length}")
-        # Now that we have a normalized vector, we will compute the sin and cos of our angle
-        c = math.cos(theta)
-        s = math.sin(theta)
-        rotation_matrix = np.identity(4)
-        rotation_matrix[0,0] = (1-c)*(x*x) + c
-        rotation_matrix[0,1] = (1-c)*(x*y) - (s*z)
-        rotation_matrix[0,2] = (1-c)*(x*z) + (s*y)
-
-        rotation_matrix[1,0] = (1-c)*(x*y) + (s*z)
-        rotation_matrix[1,1] = (1-c)*(y*y) + c
-        rotation_matrix[1,2] = (1-c)*(y*z) - (s*x)
-
-        rotation_matrix[2,0] = (1-c)*(x*z) - (s*y)
-        rotation_matrix[2,1] = (1-c)*(y*z) + (s*x)
-        rotation_matrix[2,2] = (1-c)*(z*z) + c
-
-        draw_data.model_view = np.matmul(draw_data.model_view, rotation_matrix)
+def get_vertex_by_index(verts: vertex.VertexBuffer, index: str) -> vertex.Vertex:
+    return verts[verts.index_of(index)]
+
+# Maps each keyword of the input format to the function that handles it. Every
+# handler is called with the line split into words, the image being drawn and the
+# draw data. New keywords can be added with the command decorator.
+COMMANDS: "dict[str, Callable[[list[str], np.ndarray, utils.DrawData], None]]" = {}
+
+def command(*keywords: str):
+    """Registers the decorated function as the handler of keywords
+
+    Example:
+        @file_parse.command("point")
+        def parse_point(line, image, draw_data):
+            ...
+    """
+    def register(handler):
+        for keyword in keywords:
+            COMMANDS[keyword] = handler
+        return handler
+    return register
+
+def parse_line(line: "list[str]", image: np.ndarray, draw_data: utils.DrawData) -> None:
+    """Sends a line to the handler registered for its keyword. Lines with a keyword
+    that has no handler are ignored.
+    """
+    handler = COMMANDS.get(line[0])
+    if handler is not None:
+        handler(line, image, draw_data)
+
+@dataclasses.dataclass
+class ParseStats():
+    """
+    \b lines: the number of lines read
+    \b seconds: the time it took to parse and draw them
+    """
+    lines: int = 0
+    seconds: float = 0.0
+
+    @property
+    def lines_per_second(self) -> float:
+        return self.lines / self.seconds if self.seconds > 0 else 0.0
+
+def parse_lines(lines: "Iterable[str]", images: "list[np.ndarray]", draw_data: utils.DrawData, end_frame: "Callable[[np.ndarray, utils.DrawData], None] | None" = None) -> ParseStats:
+    """Parses and draws lines one at a time as they are read, so a file object can
+    be passed in without reading the whole file into memory. Drawing starts on the
+    first image and the "frame" keyword moves to the image it names.
+
+    Args:
+        end_frame (Callable, optional): called with the image and the draw data
+            whenever drawing into an image ends, before the "frame" keyword clears
+            the draw data and after the last line
+
+    Returns:
+        ParseStats: how many lines were parsed and how long it took
+    """
+    return run_commands(map(utils.line_to_list, lines), images, draw_data, end_frame)
+
+def run_commands(commands: "Iterable[list[str] | Callable[[np.ndarray, utils.DrawData], None]]", images: "list[np.ndarray]", draw_data: utils.DrawData, end_frame: "Callable[[np.ndarray, utils.DrawData], None] | None" = None) -> ParseStats:
+    """Runs commands the same way parse_lines runs lines. Each command is either a
+    line split into words, or a function that is called with the image being
+    drawn and the draw data in place of a line that was already parsed.
+
+    Returns:
+        ParseStats: how many commands were run and how long it took
+    """
+    stats = ParseStats()
+    stage_start = draw_data.stats.stage_seconds if draw_data.stats is not None else 0.0
+    # end_frame can draw on other threads and wait for images to be saved, so all
+    # of the time it takes is left out of the parse time instead of its stages
+    end_frame_seconds = 0.0
+    end_frame_stage_seconds = 0.0
+    if end_frame is not None and draw_data.stats is not None:
+        untimed_end_frame = end_frame
+
+        def end_frame(image: np.ndarray, draw_data: utils.DrawData) -> None:
+            nonlocal end_frame_seconds, end_frame_stage_seconds
+            stage_before = draw_data.stats.stage_seconds
+            before = time.perf_counter()
+            untimed_end_frame(image, draw_data)
+            end_frame_seconds += time.perf_counter() - before
+            end_frame_stage_seconds += draw_data.stats.stage_seconds - stage_before
+    start = time.perf_counter()
+    frame_start = start
+    # lines before the first frame keyword are only timed as a block if there are any
+    skip_block = True
+    image = images[0]
+    for line in commands:
+        stats.lines += 1
+        # If the line is empty, do nothing
+        if not line:
+            continue
+        if callable(line):
+            skip_block = False
+            line(image, draw_data)
+        # If the keyword is "frame", we move to edit the frame specified
+        elif line[0] == "frame":
+            if end_frame is not None:
+                end_frame(image, draw_data)
+            if draw_data.stats is not None:
+                frame_end = time.perf_counter()
+                if not skip_block:
+                    draw_data.stats.frame_seconds.append(frame_end - frame_start)
+                frame_start = frame_end
+            skip_block = False
+            image = images[int(line[1])]
+            draw_data.clear()
+        else:
+            skip_block = False
+            parse_line(line, image, draw_data)
+    if end_frame is not None:
+        end_frame(image, draw_data)
+    end = time.perf_counter()
+    stats.seconds = end - start
+    if draw_data.stats is not None:
+        draw_data.stats.frame_seconds.append(end - frame_start)
+        stage_seconds = draw_data.stats.stage_seconds - stage_start - end_frame_stage_seconds
+        draw_data.stats.parse_seconds += stats.seconds - stage_seconds - end_frame_seconds
+    return stats
+
+### DRAW DATA UPDATES ###
+@command("xyz")
+def parse_xyz(line: "list[str]", image: np.ndarray, draw_data: utils.DrawData) -> None:
+    draw_data.vertex_list.append(
+        x=float(line[1]),
+        y=float(line[2]),
+        z=float(line[3]),
+        color=draw_data.color,
+    )
+
+@command("color")
+def parse_color(line: "list[str]", image: np.ndarray, draw_data: utils.DrawData) -> None:
+    r = float(line[1])
+    g = float(line[2])
+    b = float(line[3])
+    # alpha is optional, colors are opaque unless it is given
+    a = float(line[4]) if len(line) > 4 else 1.0
+    draw_data.color = utils.RGBFloat(r, g, b, a)
+
+@command("loadmv")
+def parse_loadmv(line: "list[str]", image: np.ndarray, draw_data: utils.DrawData) -> None:
+    # Take the 1x16 list and turn it into a 4x4 ndarray
+    draw_data.set_model_view(np.asarray(line[1:], float).reshape(4,4))
+
+@command("loadp")
+def parse_loadp(line: "list[str]", image: np.ndarray, draw_data: utils.DrawData) -> None:
+    # Take the 1x16 list and turn it into a 4x4 ndarray
+    draw_data.set_projection(np.asarray(line[1:], float).reshape(4,4))
+
+@command("cull")
+def parse_cull(line: "list[str]", image: np.ndarray, draw_data: utils.DrawData) -> None:
+    """
+    \b cull: throw away back faces
+    \b cull back|front|none: choose which faces to throw away
+    """
+    face = line[1] if len(line) > 1 else "back"
+    if face not in ("back", "front", "none"):
+        raise Exception("cull must be followed by back, front or none", face)
+    draw_data.cull_face = face
+
+### DRAWING TRIANGLES ###
+@command("trif")
+def parse_trif(line: "list[str]", image: np.ndarray, draw_data: utils.DrawData) -> None:
+    i1, i2, i3 = map(draw_data.vertex_list.index_of, line[1:4])
+    three_d.draw_3d_triangle(image, draw_data, i1, i2, i3)
+
+@command("trig")
+def parse_trig(line: "list[str]", image: np.ndarray, draw_data: utils.DrawData) -> None:
+    i1, i2, i3 = map(draw_data.vertex_list.index_of, line[1:4])
+    three_d.draw_3d_triangle(image, draw_data, i1, i2, i3, gouraud=True)
+
+### DRAWING BATCHES OF TRIANGLES ###
+def _triangle_list(indexes: np.ndarray) -> np.ndarray:
+    if len(indexes) % 3:
+        raise Exception("a triangle list needs a multiple of 3 indexes", len(indexes))
+    return indexes.reshape(-1, 3)
+
+def _triangle_strip(indexes: np.ndarray) -> np.ndarray:
+    if len(indexes) < 3:
+        raise Exception("a triangle strip needs at least 3 indexes", len(indexes))
+    return three_d.strip_triangles(indexes)
+
+def _triangle_fan(indexes: np.ndarray) -> np.ndarray:
+    if len(indexes) < 3:
+        raise Exception("a triangle fan needs at least 3 indexes", len(indexes))
+    return three_d.fan_triangles(indexes)
+
+# The triangles of each batch keyword and whether they use gouraud shading
+BATCH_COMMANDS = {
+    "trifs": (_triangle_list, False),
+    "trigs": (_triangle_list, True),
+    "stripf": (_triangle_strip, False),
+    "stripg": (_triangle_strip, True),
+    "fanf": (_triangle_fan, False),
+    "fang": (_triangle_fan, True),
+}
+
+@command(*BATCH_COMMANDS)
+def parse_triangle_batch(line: "list[str]", image: np.ndarray, draw_data: utils.DrawData) -> None:
+    """
+    \b trifs i1 i2 i3 ...: draw a triangle for every 3 indexes
+    \b stripf i1 i2 i3 ...: draw a triangle strip, each index after the first two adds a triangle
+    \b fanf i1 i2 i3 ...: draw a triangle fan around the vertex i1
+    \b trigs, stripg, fang: the same with gouraud shading
+    \b An index can be a range first:last of every vertex from first to last.
+    """
+    triangles, gouraud = BATCH_COMMANDS[line[0]]
+    indexes = triangles(draw_data.vertex_list.indexes_of(line[1:]))
+    three_d.draw_3d_triangles(image, draw_data, indexes, gouraud=gouraud)
+
+### DRAWING MESHES ###
+@command("obj", "ply")
+def parse_mesh(line: "list[str]", image: np.ndarray, draw_data: utils.DrawData) -> None:
+    """
+    \b obj filename [flat|gouraud]: add the vertexes of a Wavefront OBJ file to the vertex list and draw its faces
+    \b ply filename [flat|gouraud]: the same for a PLY file, the colors of its vertexes are used if it has them
+    """
+    shading = line[2] if len(line) > 2 else "flat"
+    if shading not in ("flat", "gouraud"):
+        raise Exception("a mesh must be drawn flat or gouraud", shading)
+    mesh = meshes.load(line[0], line[1])
+    start = len(draw_data.vertex_list)
+    draw_data.vertex_list.extend(mesh.positions, draw_data.color, mesh.colors)
+    three_d.draw_3d_triangles(image, draw_data, mesh.triangles + start, gouraud=shading == "gouraud")
+
+### DRAWING LINES ###
+@command("line")
+def parse_line_command(line: "list[str]", image: np.ndarray, draw_data: utils.DrawData) -> None:
+    """
+    \b line i1 i2: draw a line between two vertexes in the current color
+    """
+    i1, i2 = map(draw_data.vertex_list.index_of, line[1:3])
+    three_d.draw_3d_line(image, draw_data, i1, i2)
+
+@command("lineg")
+def parse_lineg(line: "list[str]", image: np.ndarray, draw_data: utils.DrawData) -> None:
+    """
+    \b lineg i1 i2: draw a line between two vertexes, blending their colors
+    """
+    i1, i2 = map(draw_data.vertex_list.index_of, line[1:3])
+    three_d.draw_3d_line(image, draw_data, i1, i2, gouraud=True)
+
+### MATRIX MANIPULATION ###
+@command("translate")
+def parse_translate(line: "list[str]", image: np.ndarray, draw_data: utils.DrawData) -> None:
+    assert len(line) == 4
+    dx: float = float(line[1])
+    dy: float = float(line[2])
+    dz: float = float(line[3])
+    translate_matrix = np.identity(4)
+    translate_matrix[0,3] = dx
+    translate_matrix[1,3] = dy
+    translate_matrix[2,3] = dz
+    draw_data.multiply_model_view(translate_matrix)
+
+@command("rotatex")
+def parse_rotatex(line: "list[str]", image: np.ndarray, draw_data: utils.DrawData) -> None:
+    assert len(line) == 2
+    theta = math.radians(float(line[1]))
+
+    sin_theta = math.sin(theta)
+    cos_theta = math.cos(theta)
+
+    rotation_matrix = np.identity(4)
+    rotation_matrix[1,1] = cos_theta
+    rotation_matrix[2,2] = cos_theta
+    rotation_matrix[2,1] = sin_theta
+    rotation_matrix[1,2] = -sin_theta
+    draw_data.multiply_model_view(rotation_matrix)
+
+@command("rotatey")
+def parse_rotatey(line: "list[str]", image: np.ndarray, draw_data: utils.DrawData) -> None:
+    assert len(line) == 2
+    theta = math.radians(float(line[1]))
+
+    sin_theta = math.sin(theta)
+    cos_theta = math.cos(theta)
+
+    rotation_matrix = np.identity(4)
+    rotation_matrix[0,0] = cos_theta
+    rotation_matrix[2,2] = cos_theta
+    rotation_matrix[0,2] = sin_theta
+    rotation_matrix[2,0] = -sin_theta
+    draw_data.multiply_model_view(rotation_matrix)
+
+@command("rotatez")
+def parse_rotatez(line: "list[str]", image: np.ndarray, draw_data: utils.DrawData) -> None:
+    assert len(line) == 2
+    theta = math.radians(float(line[1]))
+
+    sin_theta = math.sin(theta)
+    cos_theta = math.cos(theta)
+
+    rotation_matrix = np.identity(4)
+    rotation_matrix[0,0] = cos_theta
+    rotation_matrix[1,1] = cos_theta
+    rotation_matrix[1,0] = sin_theta
+    rotation_matrix[0,1] = -sin_theta
+    draw_data.multiply_model_view(rotation_matrix)
+
+@command("scale")
+def parse_scale(line: "list[str]", image: np.ndarray, draw_data: utils.DrawData) -> None:
+    assert len(line) == 4
+    sx = float(line[1])
+    sy = float(line[2])
+    sz = float(line[3])
+
+    scale_matrix = np.identity(4)
+    scale_matrix[0,0] = sx
+    scale_matrix[1,1] = sy
+    scale_matrix[2,2] = sz
+    draw_data.multiply_model_view(scale_matrix)
+
+@command("multmv")
+def parse_multmv(line: "list[str]", image: np.ndarray, draw_data: utils.DrawData) -> None:
+    # Take the 1x16 list and turn it into a 4x4 ndarray
+    assert len(line) == 17
+    draw_data.multiply_model_view(np.asarray(line[1:], float).reshape(4,4))
+
+@command("rotate")
+def parse_rotate(line: "list[str]", image: np.ndarray, draw_data: utils.DrawData) -> None:
+    # Info about the rotation matrix taken from 
+    # http://www.songho.ca/opengl/gl_matrix.html and 
+    # https://www.khronos.org/registry/OpenGL-Refpages/gl2.1/xhtml/glRotate.xml
+    assert len(line) == 5
+    # radians we will rotate counter-clockwise
+    theta = math.radians(float(line[1]))
+    # x, y, and z components of our rotation vector
+    x = float(line[2])
+    y = float(line[3])
+    z = float(line[4])
+    ## The first step is to normalize the vector
+    length = math.sqrt(x*x + y*y + z*z)
+    x = x/length
+    y = y/length
+    z = z/length
+    # Now that we have a normalized vector, we will compute the sin and cos of our angle
+    c = math.cos(theta)
+    s = math.sin(theta)
+    rotation_matrix = np.identity(4)
+    rotation_matrix[0,0] = (1-c)*(x*x) + c
+    rotation_matrix[0,1] = (1-c)*(x*y) - (s*z)
+    rotation_matrix[0,2] = (1-c)*(x*z) + (s*y)
+
+    rotation_matrix[1,0] = (1-c)*(x*y) + (s*z)
+    rotation_matrix[1,1] = (1-c)*(y*y) + c
+    rotation_matrix[1,2] = (1-c)*(y*z) - (s*x)
+
+    rotation_matrix[2,0] = (1-c)*(x*z) - (s*y)
+    rotation_matrix[2,1] = (1-c)*(y*z) + (s*x)
+    rotation_matrix[2,2] = (1-c)*(z*z) + c
+
+    draw_data.multiply_model_view(rotation_matrix)
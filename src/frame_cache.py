@@ -0,0 +1,157 @@
+import functools
+import hashlib
+import os
+import shutil
+import tempfile
+from typing import Iterable
+
+import src.frames as frames
+import src.meshes as meshes
+import src.stats as stats
+import src.utils as utils
+
+
+# Changing how frames are drawn or saved has to change this, so that frames
+# saved by an older version are not reused
+CACHE_VERSION = 2
+
+@functools.lru_cache(maxsize=None)
+def _file_digest(filename: str, mtime_ns: int, size: int) -> str:
+    digest = hashlib.sha256()
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def file_digest(filename: str) -> str:
+    """Hashes the contents of a file, only reading it again when it has changed
+    """
+    info = os.stat(filename)
+    return _file_digest(os.path.abspath(filename), info.st_mtime_ns, info.st_size)
+
+def frame_key(job: frames.FrameJob) -> str:
+    """Hashes everything the image of a frame job depends on: its size, the format
+    it is saved in, the precision of its depth buffer, its blend mode and the words
+    of every line of its blocks, along with the contents of the mesh files they
+    load. Every block starts from the state
+    DrawData.clear() leaves, with an empty vertex list, so nothing else from the
+    lines before it can change the image. Spacing, empty lines and empty blocks
+    are ignored.
+    """
+    digest = hashlib.sha256(
+        f"frame cache {CACHE_VERSION}\n{job.width} {job.height} {job.image_format} {job.compress_level} {job.depth_format} {job.blend}\n".encode()
+    )
+    for block in job.blocks:
+        lines = [words for words in map(utils.line_to_list, block) if words]
+        # a block without any lines draws nothing
+        if not lines:
+            continue
+        digest.update(b"frame\n")
+        for words in lines:
+            digest.update(" ".join(words).encode() + b"\n")
+            if words[0] in meshes.LOADERS and len(words) > 1:
+                digest.update(file_digest(words[1]).encode() + b"\n")
+    return digest.hexdigest()
+
+class FrameCache():
+    """A directory of saved frames named by the hash of what they were drawn from.
+    Frames that are used are touched, and the least recently used ones are
+    removed when the frames take up more than max_bytes.
+
+    Args:
+        directory (str): where the frames are kept, it is made if it does not exist
+        max_bytes (int): the most bytes the frames can take up
+    """
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.size = sum(
+            entry.stat().st_size for entry in os.scandir(directory)
+            if entry.is_file() and not entry.name.startswith(".")
+        )
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def get(self, key: str, filename: str) -> bool:
+        """Copies the frame saved under key to filename
+
+        Returns:
+            bool: false if there is no frame saved under key
+        """
+        path = self.path(key)
+        try:
+            shutil.copyfile(path, filename)
+        except FileNotFoundError:
+            return False
+        # the modified time is the last time a frame was used
+        os.utime(path)
+        return True
+
+    def put(self, key: str, filename: str) -> None:
+        """Saves a copy of the file of a frame under key. The copy is written next
+        to the cache first and moved into place at once, so a half written frame
+        is never read.
+        """
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, prefix=".")
+        os.close(descriptor)
+        try:
+            shutil.copyfile(filename, temporary)
+            path = self.path(key)
+            replaced = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(temporary, path)
+        except BaseException:
+            os.remove(temporary)
+            raise
+        self.size += os.path.getsize(path) - replaced
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self) -> None:
+        """Removes the least recently used frames until the rest fit in max_bytes
+        """
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.is_file() and not entry.name.startswith("."):
+                info = entry.stat()
+                entries.append((info.st_mtime_ns, info.st_size, entry.path))
+        entries.sort()
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                # another run removed it first
+                pass
+            self.size -= size
+
+def render_cached(lines: "Iterable[str]", image_info: utils.ImageInfo, cache: FrameCache, jobs: int = 1, use_hiz: bool = False, use_stats: bool = False, image_format: str = "png", compress_level: "int | None" = None, depth_format: str = "float64", blend: str = "replace") -> "stats.RenderStats | None":
+    """Renders the frames of a file like frames.render_in_parallel, but copies
+    the frames that were rendered before from cache instead of drawing them
+    again, and saves the ones that are drawn into it
+
+    Returns:
+        stats.RenderStats | None: the render statistics of the frames that were
+        drawn, if used, with frames_cached set to the number that were copied
+    """
+    frame_jobs = frames.make_jobs(lines, image_info, use_hiz, use_stats, image_format, compress_level, depth_format, blend)
+    # frames that are the same as an earlier frame of the file are only drawn once
+    drawn: "dict[str, frames.FrameJob]" = {}
+    copies: "list[tuple[str, frames.FrameJob]]" = []
+    for job in frame_jobs:
+        key = frame_key(job)
+        if key in drawn:
+            copies.append((key, job))
+        elif not cache.get(key, job.filename):
+            drawn[key] = job
+    render_stats = frames.render_jobs(list(drawn.values()), jobs, use_stats)
+    for key, job in drawn.items():
+        cache.put(key, job.filename)
+    for key, job in copies:
+        shutil.copyfile(drawn[key].filename, job.filename)
+    if render_stats is not None:
+        render_stats.frames_cached += len(frame_jobs) - len(drawn)
+    return render_stats
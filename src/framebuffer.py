@@ -0,0 +1,247 @@
+import io
+import os
+import threading
+from typing import Optional
+
+import numpy as np
+from PIL import Image
+
+import src.depth as depth
+import src.utils as utils
+import src.vertex as vertex
+
+
+def make_color_buffer(width: int, height: int) -> np.ndarray:
+    """Makes a fully transparent (height, width, 4) RGBA color buffer
+    """
+    return np.zeros((height, width, 4), dtype=np.uint8)
+
+class BufferPool():
+    """Keeps color and depth buffers that are no longer used, so a new buffer of
+    the same shape and dtype reuses one instead of having new memory allocated
+    and faulted in by the operating system. Taken buffers are not cleared. It
+    can be used from many threads.
+
+    Args:
+        max_free (int): the most unused buffers of each shape and dtype that are kept
+    """
+    def __init__(self, max_free: int = 4):
+        self.max_free = max_free
+        self._free: "dict[tuple[tuple[int, ...], np.dtype], list[np.ndarray]]" = {}
+        self._lock = threading.Lock()
+
+    def take(self, shape: "tuple[int, ...]", dtype: np.dtype = np.uint8) -> np.ndarray:
+        """Returns an unused buffer, with whatever was left in it
+        """
+        key = (tuple(shape), np.dtype(dtype))
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                return free.pop()
+        return np.empty(shape, dtype=dtype)
+
+    def copy(self, array: np.ndarray) -> np.ndarray:
+        """Copies an array into a buffer from the pool
+        """
+        buffer = self.take(array.shape, array.dtype)
+        np.copyto(buffer, array)
+        return buffer
+
+    def give(self, buffer: np.ndarray) -> None:
+        """Puts a buffer that will not be used again back into the pool
+        """
+        with self._lock:
+            free = self._free.setdefault((buffer.shape, buffer.dtype), [])
+            if len(free) < self.max_free:
+                free.append(buffer)
+
+def to_image(color_buffer: np.ndarray) -> Image:
+    """Converts a color buffer into a PIL image so that it can be saved
+    """
+    return Image.fromarray(color_buffer, "RGBA")
+
+# The file formats images can be saved in
+IMAGE_FORMATS = ("png", "ppm")
+
+def encode_image(color_buffer: np.ndarray, image_format: str = "png", compress_level: Optional[int] = None) -> bytes:
+    """Encodes a color buffer into the bytes of an image file
+
+    Args:
+        image_format (str): "png", or "ppm" for a binary PPM that is written
+            without any compression. PPM has no alpha channel, so it is dropped.
+        compress_level (int, optional): the zlib level of a png from 0 (no
+            compression, the fastest) to 9 (the smallest). PIL's default is used
+            when it is not given.
+    """
+    if image_format == "ppm":
+        height, width = color_buffer.shape[:2]
+        return f"P6\n{width} {height}\n255\n".encode() + color_buffer[:, :, :3].tobytes()
+    if image_format != "png":
+        raise Exception("unknown image format", image_format)
+    options = {} if compress_level is None else {"compress_level": compress_level}
+    output = io.BytesIO()
+    to_image(color_buffer).save(output, format="PNG", **options)
+    return output.getvalue()
+
+def image_filename(filename: str, image_format: str) -> str:
+    """Changes the extension of a png filename to match image_format
+    """
+    if image_format == "png":
+        return filename
+    root, extension = os.path.splitext(filename)
+    return (root if extension.lower() == ".png" else filename) + "." + image_format
+
+def save_image(color_buffer: np.ndarray, filename: str, image_format: str = "png", compress_level: Optional[int] = None) -> None:
+    """Encodes a color buffer with encode_image and writes it to filename
+    """
+    data = encode_image(color_buffer, image_format, compress_level)
+    with open(filename, "wb") as file:
+        file.write(data)
+
+def fragment_colors(fragments: vertex.Fragments) -> np.ndarray:
+    """Converts the 0-1 colors of the fragments into an (n, 4) array of RGBA values
+    """
+    colors = np.full((len(fragments), 4), 255, dtype=np.uint8)
+    rgb = np.stack((fragments.r, fragments.g, fragments.b), axis=1)
+    colors[:, :3] = np.clip(np.round(255 * rgb), 0, 255)
+    if fragments.a is not None:
+        colors[:, 3] = np.clip(np.round(255 * fragments.a), 0, 255)
+    return colors
+
+# How the fragments that pass the depth test are combined with the color buffer.
+# replace writes their colors as they are, over draws them over what is already
+# there like utils.add_pixel_colors, and premultiplied does the same on a color
+# buffer that holds colors multiplied by their alpha, see unpremultiply.
+BLEND_MODES = ("replace", "over", "premultiplied")
+
+def blend_over(color_buffer: np.ndarray, ys: np.ndarray, xs: np.ndarray, colors: "np.ndarray | tuple", premultiplied: bool = False) -> None:
+    """Draws RGBA colors over the pixels at ys, xs of a color buffer with the over
+    operator, all at once. The pixels must not repeat.
+
+    Args:
+        colors (np.ndarray | tuple): (n, 4) RGBA color of each pixel with alpha
+            that is not premultiplied, or one RGBA color for all of them
+        premultiplied (bool): the color buffer holds premultiplied colors, which
+            saves the divide by the new alpha. Otherwise the result is the same as
+            utils.add_pixel_colors.
+    """
+    source = np.asarray(colors, dtype=np.float64)
+    target = color_buffer[ys, xs].astype(np.float64)
+    aa = source[..., 3:] / 255
+    if premultiplied:
+        result = target * (1 - aa)
+        result[:, :3] += source[..., :3] * aa
+        # the alpha channel is not multiplied by itself
+        result[:, 3:] += source[..., 3:]
+    else:
+        ab = target[:, 3:] / 255
+        a0 = aa + ab * (1 - aa)
+        # nothing is left where both colors are fully transparent
+        result = np.zeros_like(target)
+        np.divide(source[..., :3] * aa + target[:, :3] * ab * (1 - aa), a0, out=result[:, :3], where=a0 != 0)
+        result[:, 3:] = a0 * 255
+    color_buffer[ys, xs] = np.round(result, out=result)
+
+def unpremultiply(color_buffer: np.ndarray) -> None:
+    """Divides the colors of a premultiplied color buffer by their alpha in place,
+    which turns it into the straight alpha images are saved with
+    """
+    alpha = color_buffer[:, :, 3]
+    translucent = (alpha != 0) & (alpha != 255)
+    pixels = color_buffer[translucent].astype(np.float64)
+    pixels[:, :3] = np.round(pixels[:, :3] * 255 / pixels[:, 3:])
+    color_buffer[translucent] = np.minimum(pixels, 255)
+
+def _is_opaque(fragments: vertex.Fragments, color: Optional[utils.RGB]) -> bool:
+    if color is None:
+        return fragments.a is None
+    return color.a == 255
+
+def write_fragments(color_buffer: np.ndarray, depth_buffer: np.ndarray, fragments: vertex.Fragments, color: Optional[utils.RGB] = None, blend: str = "replace") -> int:
+    """Depth tests the fragments and writes the ones that pass into the color and
+    depth buffers. A fragment passes when its z is not larger than the value already
+    in the depth buffer, at the precision of the depth buffer. The fragments must
+    not contain the same pixel twice.
+
+    Args:
+        color_buffer (np.ndarray): (height, width, 4) RGBA buffer
+        depth_buffer (np.ndarray): (height, width) depth buffer in one of depth.FORMATS
+        fragments (vertex.Fragments): fragments that are on the screen
+        color (utils.RGB, optional): flat color for every fragment. The colors of
+            the fragments are used when this is not given.
+        blend (str): one of BLEND_MODES. Opaque fragments are always written as
+            they are, since drawing them over anything gives their own color.
+            Translucent fragments still write their depth.
+
+    Returns:
+        int: the number of fragments that were written
+    """
+    z = depth.to_depth(fragments.z, depth_buffer.dtype)
+    passed = z <= depth_buffer[fragments.y, fragments.x]
+    fragments = fragments.select(passed)
+    depth_buffer[fragments.y, fragments.x] = z[passed]
+    if color is None:
+        colors = fragment_colors(fragments)
+    else:
+        colors = (color.r, color.g, color.b, color.a)
+    if blend == "replace" or _is_opaque(fragments, color):
+        color_buffer[fragments.y, fragments.x] = colors
+    elif blend in BLEND_MODES:
+        blend_over(color_buffer, fragments.y, fragments.x, colors, premultiplied=blend == "premultiplied")
+    else:
+        raise Exception("unknown blend mode", blend)
+    return len(fragments)
+
+def write_fragments_in_order(color_buffer: np.ndarray, depth_buffer: np.ndarray, fragments: vertex.Fragments, color: Optional[utils.RGB] = None, blend: str = "replace") -> int:
+    """Depth tests and writes fragments that may contain the same pixel many
+    times, with the same result as calling write_fragments on each of them in
+    order. A fragment passes when its z is not larger than the depth buffer or any
+    earlier fragment of its pixel, so the last fragment that passes is the one
+    that is kept. When translucent fragments are blended, every fragment that
+    passes is drawn over the ones that passed before it instead.
+
+    Returns:
+        int: the number of fragments that passed, like the sum of what
+        write_fragments would return
+    """
+    width = depth_buffer.shape[1]
+    pixel = fragments.y * width + fragments.x
+    order = np.argsort(pixel, kind="stable")
+    pixel = pixel[order]
+    z = depth.to_depth(fragments.z, depth_buffer.dtype)[order]
+    first = np.ones(len(pixel), dtype=bool)
+    first[1:] = pixel[1:] != pixel[:-1]
+    group = np.cumsum(first) - 1
+    # Put the depth buffer value of each pixel in front of its fragments. z values
+    # are replaced by their ranks so the groups can be offset with exact integers,
+    # then a running minimum tells each fragment the smallest depth before it.
+    starts = np.flatnonzero(first)
+    values, ranks = np.unique(np.concatenate((depth_buffer.ravel()[pixel[starts]], z)), return_inverse=True)
+    # earlier groups get larger keys, so they never lower the minimum of later ones
+    keys = np.empty(len(ranks), dtype=np.int64)
+    positions = np.arange(len(z)) + group + 1
+    keys[starts + np.arange(len(starts))] = ranks[:len(starts)]
+    keys[positions] = ranks[len(starts):]
+    keys += np.repeat(len(starts) - 1 - np.arange(len(starts)), np.diff(np.append(starts, len(z))) + 1) * len(values)
+    smallest_before = np.minimum.accumulate(keys)[positions - 1]
+    passed = keys[positions] <= smallest_before
+    written = int(passed.sum())
+    # the last fragment of each pixel that passed has the smallest depth
+    indexes = order[passed]
+    pixel = pixel[passed]
+    if blend != "replace" and not _is_opaque(fragments, color):
+        # The n-th fragment that passed of every pixel is drawn in the n-th
+        # layer, so each layer has every pixel once and is blended at once.
+        first = np.ones(len(pixel), dtype=bool)
+        first[1:] = pixel[1:] != pixel[:-1]
+        starts = np.flatnonzero(first)
+        layer = np.arange(len(pixel)) - np.repeat(starts, np.diff(np.append(starts, len(pixel))))
+        for n in range(layer.max() + 1 if len(layer) else 0):
+            # they still pass, the layers before them wrote a z no smaller than theirs
+            write_fragments(color_buffer, depth_buffer, fragments.select(indexes[layer == n]), color, blend)
+        return written
+    last = np.ones(len(pixel), dtype=bool)
+    last[:-1] = pixel[:-1] != pixel[1:]
+    fragments = fragments.select(indexes[last])
+    write_fragments(color_buffer, depth_buffer, fragments, color, blend)
+    return written
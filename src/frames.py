@@ -0,0 +1,185 @@
+import concurrent.futures
+import dataclasses
+import time
+from typing import Iterable
+
+import src.depth as depth
+import src.file_parse as file_parse
+import src.framebuffer as framebuffer
+import src.hiz as hiz
+import src.stats as stats
+import src.utils as utils
+import src.vertex as vertex
+
+
+@dataclasses.dataclass
+class FrameJob():
+    """Everything needed to render one image of a pngs file on its own
+    \b filename: the name of the output file
+    \b width: the width of the output file
+    \b height: the height of the output file
+    \b blocks: the lines of each block that draws into this image, in file order
+    \b use_hiz: skip hidden triangles with a hierarchical z buffer
+    \b use_stats: count the work done and time the stages of the frame
+    \b image_format: the format the image is saved in, see framebuffer.encode_image
+    \b compress_level: the zlib level of png files, or None for the default
+    \b depth_format: the precision of the depth buffer, one of depth.FORMATS
+    \b blend: how translucent fragments are combined with the image, one of framebuffer.BLEND_MODES
+    """
+    filename: str
+    width: int
+    height: int
+    blocks: "list[list[str]]"
+    use_hiz: bool = False
+    use_stats: bool = False
+    image_format: str = "png"
+    compress_level: "int | None" = None
+    depth_format: str = "float64"
+    blend: str = "replace"
+
+def split_frames(lines: "Iterable[str]") -> "dict[int, list[list[str]]]":
+    """Splits the lines that follow the first line of a file into blocks that each
+    start with a "frame" keyword. Lines before the first "frame" keyword draw into
+    the first image. Every block starts from DrawData.clear() state, so blocks can
+    be rendered independently of each other.
+
+    Returns:
+        dict[int, list[list[str]]]: the blocks drawing into each image index, in
+        the order they appear in the file
+    """
+    frames: "dict[int, list[list[str]]]" = {0: [[]]}
+    block: "list[str]" = frames[0][0]
+    for line in lines:
+        tokens = utils.line_to_list(line)
+        if tokens and tokens[0] == "frame":
+            block = []
+            frames.setdefault(int(tokens[1]), []).append(block)
+        else:
+            block.append(line)
+    return frames
+
+def block_images(lines: "Iterable[str]") -> "list[int]":
+    """Finds the image each block of lines draws into, in the order the blocks are
+    drawn, without keeping the lines. The first block is the lines before the
+    first "frame" keyword, which draw into the first image.
+    """
+    images = [0]
+    for line in lines:
+        # most lines can be skipped without splitting them
+        if "frame" not in line:
+            continue
+        tokens = utils.line_to_list(line)
+        if tokens and tokens[0] == "frame":
+            images.append(int(tokens[1]))
+    return images
+
+# The buffers of the frames that were rendered by this process, reused by the
+# next frames it renders
+_pool = framebuffer.BufferPool(max_free=1)
+
+def render_frame(job: FrameJob) -> "stats.RenderStats | None":
+    """Renders every block of a frame into a cleared image and saves it
+
+    Returns:
+        stats.RenderStats | None: the render statistics of the frame, if used
+    """
+    image = _pool.take((job.height, job.width, 4))
+    image.fill(0)
+    draw_data = utils.DrawData(
+        vertex_list=vertex.VertexBuffer(),
+        height=job.height,
+        width=job.width,
+        depth_format=job.depth_format,
+        depth_buffer=_pool.take((job.height, job.width), depth.FORMATS[job.depth_format]),
+        blend=job.blend,
+    )
+    if job.use_hiz:
+        draw_data.hiz = hiz.HierarchicalZ(draw_data.depth_buffer)
+    if job.use_stats:
+        draw_data.stats = stats.RenderStats()
+    for block in job.blocks:
+        draw_data.clear()
+        file_parse.parse_lines(block, [image], draw_data)
+    start = time.perf_counter()
+    if job.blend == "premultiplied":
+        framebuffer.unpremultiply(image)
+    framebuffer.save_image(image, job.filename, job.image_format, job.compress_level)
+    if draw_data.stats is not None:
+        draw_data.stats.save_seconds += time.perf_counter() - start
+    _pool.give(image)
+    _pool.give(draw_data.depth_buffer)
+    return draw_data.stats
+
+def make_jobs(lines: "Iterable[str]", image_info: utils.ImageInfo, use_hiz: bool = False, use_stats: bool = False, image_format: str = "png", compress_level: "int | None" = None, depth_format: str = "float64", blend: str = "replace") -> "list[FrameJob]":
+    """Splits the lines that follow the first line of a pngs file into a job for
+    each of its images, see render_in_parallel for the arguments
+    """
+    image_filenames = [framebuffer.image_filename(filename, image_format) for filename in utils.make_filename_list(image_info)]
+    frames = split_frames(lines)
+    for index in frames:
+        if not 0 <= index < len(image_filenames):
+            raise IndexError("frame index out of range", index)
+    return [
+        FrameJob(
+            filename=image_filenames[i],
+            width=image_info.width,
+            height=image_info.height,
+            blocks=frames.get(i, []),
+            use_hiz=use_hiz,
+            use_stats=use_stats,
+            image_format=image_format,
+            compress_level=compress_level,
+            depth_format=depth_format,
+            blend=blend,
+        )
+        for i in range(len(image_filenames))
+    ]
+
+def render_jobs(frame_jobs: "list[FrameJob]", jobs: int, use_stats: bool = False) -> "stats.RenderStats | None":
+    """Renders frame jobs on a pool of jobs processes, or in this process when
+    jobs is 1
+
+    Returns:
+        stats.RenderStats | None: the render statistics of the jobs added together,
+        if used
+    """
+    render_stats = stats.RenderStats() if use_stats else None
+    if jobs > 1 and len(frame_jobs) > 1:
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+        results = executor.map(render_frame, frame_jobs)
+    else:
+        executor = None
+        results = map(render_frame, frame_jobs)
+    try:
+        # consume the results so that errors in the workers are raised here
+        for frame_stats in results:
+            if frame_stats is not None:
+                render_stats.add(frame_stats)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return render_stats
+
+def render_in_parallel(lines: "Iterable[str]", image_info: utils.ImageInfo, jobs: int, use_hiz: bool = False, use_stats: bool = False, image_format: str = "png", compress_level: "int | None" = None, depth_format: str = "float64", blend: str = "replace") -> "stats.RenderStats | None":
+    """Renders the frames of a pngs file on a pool of processes. Each process
+    renders whole frames and saves its own image files, which are identical to the
+    ones made by rendering the file in a single process.
+
+    Args:
+        lines (Iterable[str]): the lines that follow the first line of the file
+        image_info (utils.ImageInfo): the metadata from the first line of the file
+        jobs (int): the number of processes to use
+        use_hiz (bool): skip hidden triangles with a hierarchical z buffer
+        use_stats (bool): count the work done and time the stages of every frame
+        image_format (str): the format images are saved in, "png" or "ppm"
+        compress_level (int, optional): the zlib level of png files
+        depth_format (str): the precision of the depth buffers, one of depth.FORMATS
+        blend (str): how translucent fragments are combined with the images, one
+            of framebuffer.BLEND_MODES
+
+    Returns:
+        stats.RenderStats | None: the render statistics of all of the frames added
+        together, if used. The times are summed over the processes.
+    """
+    frame_jobs = make_jobs(lines, image_info, use_hiz, use_stats, image_format, compress_level, depth_format, blend)
+    return render_jobs(frame_jobs, jobs, use_stats)
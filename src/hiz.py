@@ -0,0 +1,152 @@
+import dataclasses
+import math
+
+import numpy as np
+
+import src.depth as depth
+
+
+@dataclasses.dataclass
+class HiZStats():
+    """Counts how much work the hierarchical z buffer saved
+    \b triangles_tested: triangles checked against the pyramid
+    \b triangles_rejected: triangles skipped because they were completely hidden
+    \b blocks_tested: blocks of partly visible triangles that were checked
+    \b blocks_rejected: blocks skipped because the triangle was hidden in them
+    \b pixels_skipped: pixels of the skipped triangles and blocks that did not need to be rasterized
+    """
+    triangles_tested: int = 0
+    triangles_rejected: int = 0
+    blocks_tested: int = 0
+    blocks_rejected: int = 0
+    pixels_skipped: int = 0
+
+    def add(self, other: "HiZStats") -> None:
+        for field in dataclasses.fields(self):
+            setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+
+def _reduce(level: np.ndarray, factor: int) -> np.ndarray:
+    """Takes the max over factor x factor cells of level. Cells past the edge of
+    level are treated as the smallest value of its dtype.
+    """
+    height, width = level.shape
+    padded_height = math.ceil(height / factor) * factor
+    padded_width = math.ceil(width / factor) * factor
+    if (padded_height, padded_width) != (height, width):
+        lowest = -np.inf if level.dtype.kind == "f" else np.iinfo(level.dtype).min
+        padded = np.full((padded_height, padded_width), lowest, dtype=level.dtype)
+        padded[:height, :width] = level
+        level = padded
+    return level.reshape(padded_height // factor, factor, padded_width // factor, factor).max(axis=(1, 3))
+
+class HierarchicalZ():
+    """A pyramid of the largest depth in square blocks of a depth buffer. Level 0
+    holds the max of each block_size x block_size block and every level above holds
+    the max of 2 x 2 cells of the level below it, up to a single cell.
+
+    A fragment only passes the depth test when its z is not larger than the depth
+    buffer, so a triangle whose smallest z is larger than the max depth of a block
+    can not change any pixel in that block.
+
+    Args:
+        depth_buffer (np.ndarray): the depth buffer, or a view of part of it
+        block_size (int): the width and height of a level 0 block in pixels
+        origin (tuple[int, int]): the pixel coordinates of depth_buffer[0, 0]
+    """
+    def __init__(self, depth_buffer: np.ndarray, block_size: int = 8, origin: "tuple[int, int]" = (0, 0)):
+        self.depth_buffer = depth_buffer
+        self.block_size = block_size
+        self.origin = origin
+        self.stats = HiZStats()
+        self.rebuild()
+
+    def rebuild(self) -> None:
+        """Recomputes the whole pyramid, used after the depth buffer is cleared
+        """
+        self.levels: "list[np.ndarray]" = [_reduce(self.depth_buffer, self.block_size)]
+        while self.levels[-1].shape != (1, 1):
+            self.levels.append(_reduce(self.levels[-1], 2))
+
+    def _block_range(self, region: "tuple[int, int, int, int]") -> "tuple[int, int, int, int]":
+        """Converts a pixel region into the range of level 0 blocks that cover it
+        """
+        x_min, y_min, x_max, y_max = region
+        x_min -= self.origin[0]
+        x_max -= self.origin[0]
+        y_min -= self.origin[1]
+        y_max -= self.origin[1]
+        size = self.block_size
+        return (x_min // size, y_min // size, -(-x_max // size), -(-y_max // size))
+
+    def update(self, region: "tuple[int, int, int, int]") -> None:
+        """Recomputes the cells covering a region of the depth buffer that was
+        written to
+
+        Args:
+            region (tuple[int, int, int, int]): (x_min, y_min, x_max, y_max) in pixels
+        """
+        bx_min, by_min, bx_max, by_max = self._block_range(region)
+        size = self.block_size
+        pixels = self.depth_buffer[by_min * size:by_max * size, bx_min * size:bx_max * size]
+        self.levels[0][by_min:by_max, bx_min:bx_max] = _reduce(pixels, size)
+        for below, level in zip(self.levels, self.levels[1:]):
+            bx_min, by_min = bx_min // 2, by_min // 2
+            bx_max, by_max = -(-bx_max // 2), -(-by_max // 2)
+            cells = below[by_min * 2:by_max * 2, bx_min * 2:bx_max * 2]
+            level[by_min:by_max, bx_min:bx_max] = _reduce(cells, 2)
+
+    def max_depth(self, region: "tuple[int, int, int, int]") -> float:
+        """Returns an upper bound of the depth buffer inside a region, found from
+        the finest level where the region covers at most 4 x 4 cells
+        """
+        bx_min, by_min, bx_max, by_max = self._block_range(region)
+        for level in self.levels:
+            if (bx_max - bx_min) * (by_max - by_min) <= 16:
+                return float(level[by_min:by_max, bx_min:bx_max].max())
+            bx_min, by_min = bx_min // 2, by_min // 2
+            bx_max, by_max = -(-bx_max // 2), -(-by_max // 2)
+        return float(self.levels[-1].max())
+
+    def visible_regions(self, z_min: float, region: "tuple[int, int, int, int]") -> "list[tuple[int, int, int, int]]":
+        """Splits the pixel region of a triangle into the parts where it may still
+        be visible. The whole triangle is tested against a coarse level first, then
+        each level 0 block is tested and runs of visible blocks in a row of blocks
+        are merged into one region.
+
+        Args:
+            z_min (float): the smallest z of the triangle
+            region (tuple[int, int, int, int]): (x_min, y_min, x_max, y_max) in pixels
+
+        Returns:
+            list[tuple[int, int, int, int]]: regions that need to be rasterized,
+            empty when the triangle is hidden
+        """
+        x_min, y_min, x_max, y_max = region
+        self.stats.triangles_tested += 1
+        # compare at the precision of the depth buffer
+        z_min = depth.to_depth(z_min, self.depth_buffer.dtype)
+        if z_min > self.max_depth(region):
+            self.stats.triangles_rejected += 1
+            self.stats.pixels_skipped += (x_max - x_min) * (y_max - y_min)
+            return []
+        bx_min, by_min, bx_max, by_max = self._block_range(region)
+        visible = self.levels[0][by_min:by_max, bx_min:bx_max] >= z_min
+        self.stats.blocks_tested += visible.size
+        if visible.all():
+            return [region]
+        self.stats.blocks_rejected += visible.size - int(visible.sum())
+        size = self.block_size
+        origin_x, origin_y = self.origin
+        regions = []
+        for row, row_visible in enumerate(visible):
+            top = max(origin_y + (by_min + row) * size, y_min)
+            bottom = min(origin_y + (by_min + row + 1) * size, y_max)
+            # find the runs of visible blocks in this row
+            changes = np.flatnonzero(np.diff(np.concatenate(([0], row_visible.astype(np.int8), [0]))))
+            for start, end in zip(changes[::2], changes[1::2]):
+                left = max(origin_x + (bx_min + start) * size, x_min)
+                right = min(origin_x + (bx_min + end) * size, x_max)
+                regions.append((left, top, right, bottom))
+        visible_pixels = sum((right - left) * (bottom - top) for left, top, right, bottom in regions)
+        self.stats.pixels_skipped += (x_max - x_min) * (y_max - y_min) - visible_pixels
+        return regions
@@ -0,0 +1,162 @@
+import collections
+import concurrent.futures
+import threading
+import time
+from typing import Callable
+
+import numpy as np
+
+import src.framebuffer as framebuffer
+import src.utils as utils
+
+
+class FrameWriter():
+    """Makes the images of a file when drawing reaches them, and saves each one on
+    a pool of threads as soon as the last block that draws into it ends. Only the
+    images that are still being drawn into are kept in memory, instead of every
+    image of the file, and encoding happens outside of the GIL, so it overlaps
+    with drawing instead of being a long serial tail after the last frame.
+
+    It stands in for the list of images of file_parse.run_commands, and an image
+    is made transparent the first time it is used. blocks tells the writer which
+    image each block draws into, see frames.block_images, so it knows when an
+    image is finished. Images that no block draws into are saved blank. At most
+    2 images per thread wait to be encoded, drawing waits for the oldest one when
+    there are more, so memory stays bounded when drawing is faster than encoding.
+
+    Use end_frame as the end_frame callback of file_parse.parse_lines, and call
+    close, or use the writer as a context manager, to save the blank images and
+    wait for every file to be written.
+
+    Args:
+        filenames (list[str]): the file each image is saved in
+        width (int): the width of the images
+        height (int): the height of the images
+        blocks (list[int]): the index of the image each block draws into, in the
+            order the blocks are drawn
+        image_format (str): "png" or "ppm", see framebuffer.encode_image
+        compress_level (int, optional): the zlib level of png files
+        workers (int): the number of threads that encode images
+        premultiplied (bool): the images hold premultiplied colors, which are
+            turned back into straight alpha before they are encoded
+    """
+    def __init__(self, filenames: "list[str]", width: int, height: int, blocks: "list[int]", image_format: str = "png", compress_level: "int | None" = None, workers: int = 2, premultiplied: bool = False):
+        for index in blocks:
+            if not 0 <= index < len(filenames):
+                raise IndexError("frame index out of range", index)
+        self.filenames = filenames
+        self.shape = (height, width, 4)
+        self.blocks = blocks
+        self.image_format = image_format
+        self.compress_level = compress_level
+        self.premultiplied = premultiplied
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+        # the seconds spent encoding and writing, summed over the threads
+        self.encode_seconds = 0.0
+        # the seconds drawing spent waiting for images to be written
+        self.wait_seconds = 0.0
+        # the images that are being drawn into, by index
+        self.images: "dict[int, np.ndarray]" = {}
+        # the number of blocks left to draw into each image
+        self._remaining = collections.Counter(blocks)
+        # the number of blocks that have ended
+        self._ended = 0
+        self._lock = threading.Lock()
+        self._pending: "collections.deque[concurrent.futures.Future]" = collections.deque()
+        self._max_pending = 2 * workers
+        # the images being saved are reused once their files are written
+        self.pool = framebuffer.BufferPool(max_free=self._max_pending + 1)
+
+    def __len__(self) -> int:
+        return len(self.filenames)
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        if not 0 <= index < len(self.filenames):
+            raise IndexError("frame index out of range", index)
+        image = self.images.get(index)
+        if image is None:
+            if self._remaining[index] == 0:
+                raise Exception("no more blocks were counted for image", index)
+            image = self.pool.take(self.shape)
+            image.fill(0)
+            self.images[index] = image
+        return image
+
+    def _write(self, image: "np.ndarray | None", filename: str, data: "bytes | None" = None) -> None:
+        start = time.perf_counter()
+        if image is not None:
+            if self.premultiplied:
+                framebuffer.unpremultiply(image)
+            data = framebuffer.encode_image(image, self.image_format, self.compress_level)
+            self.pool.give(image)
+        with open(filename, "wb") as file:
+            file.write(data)
+        with self._lock:
+            self.encode_seconds += time.perf_counter() - start
+
+    def _submit(self, *args) -> None:
+        while len(self._pending) >= self._max_pending:
+            start = time.perf_counter()
+            self._pending.popleft().result()
+            self.wait_seconds += time.perf_counter() - start
+        self._pending.append(self.executor.submit(self._write, *args))
+
+    def submit(self, index: int) -> None:
+        """Starts saving the image at index and lets go of it
+        """
+        self._submit(self.images.pop(index), self.filenames[index])
+
+    def end_frame(self, image: np.ndarray, draw_data: utils.DrawData) -> None:
+        """Counts the end of a block, and saves its image if it was the last block
+        that draws into it
+        """
+        if self._ended >= len(self.blocks):
+            raise Exception("more blocks ended than were counted", self._ended)
+        index = self.blocks[self._ended]
+        self._ended += 1
+        self._remaining[index] -= 1
+        if self._remaining[index] == 0 and index in self.images:
+            self.submit(index)
+
+    def after(self, render: "Callable[[np.ndarray, utils.DrawData], None]") -> "Callable[[np.ndarray, utils.DrawData], None]":
+        """Makes an end_frame callback that calls render, like TileRenderer.render,
+        and then saves the image
+        """
+        def end_frame(image: np.ndarray, draw_data: utils.DrawData) -> None:
+            render(image, draw_data)
+            self.end_frame(image, draw_data)
+        return end_frame
+
+    def close(self) -> None:
+        """Saves the images that were never drawn into, and any that are still
+        being drawn into, and waits until every file is written, raising the first
+        error any of the writes had
+        """
+        start = time.perf_counter()
+        try:
+            for index in list(self.images):
+                self.submit(index)
+            blank = [index for index in range(len(self.filenames)) if index not in self._remaining]
+            if blank:
+                # every blank image is the same file
+                data = framebuffer.encode_image(framebuffer.make_color_buffer(self.shape[1], self.shape[0]), self.image_format, self.compress_level)
+                for index in blank:
+                    self._submit(None, self.filenames[index], data)
+            while self._pending:
+                self._pending.popleft().result()
+        finally:
+            self.executor.shutdown()
+            self.wait_seconds += time.perf_counter() - start
+
+    def __enter__(self) -> "FrameWriter":
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            # stop saving images that were not started, and do not hide the
+            # error with errors from the writes
+            for future in self._pending:
+                future.cancel()
+            self.executor.shutdown()
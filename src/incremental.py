@@ -0,0 +1,173 @@
+import collections
+
+import numpy as np
+
+import src.depth as depth
+import src.hiz as hiz
+import src.lines as lines
+import src.three_d as three_d
+import src.utils as utils
+
+
+class IncrementalRenderer():
+    """Renders the display list of each frame by only redrawing the parts of the
+    screen that changed since the frame before it. Triangles and lines are
+    compared after they are transformed, so a triangle is unchanged when its
+    vertices, matrices and color are. The blocks covered by triangles that were added or removed are
+    cleared and redrawn, and the rest of the color and depth buffers are copied
+    from the frame before. Every pixel is drawn by the same triangles in the same
+    order as a full redraw, so the images are identical.
+
+    Only frames drawn into images that are still empty can be reused, since a
+    frame drawn on top of an earlier frame of the same image depends on it. An
+    image is empty when all of its pixels are, so an image that is cleared and
+    drawn into again, like the one frame of a streams.FrameStream, is too.
+
+    Use it as the end_frame callback of file_parse.parse_lines on a DrawData that
+    has a display list.
+
+    Args:
+        width (int): the width of the images
+        height (int): the height of the images
+        block_size (int): the size in pixels of the blocks the screen is split
+            into to track the parts that changed
+        use_hiz (bool): skip hidden triangles with a hierarchical z buffer
+    """
+    def __init__(self, width: int, height: int, block_size: int = 16, use_hiz: bool = False):
+        self.width = width
+        self.height = height
+        self.block_size = block_size
+        self.use_hiz = use_hiz
+        self.hiz: "hiz.HierarchicalZ | None" = None
+        # the work saved by the hierarchical z buffer
+        self.hiz_stats = hiz.HiZStats()
+        # frames that were drawn by copying the frame before them
+        self.reused_frames = 0
+        # pixels that were redrawn in those frames
+        self.redrawn_pixels = 0
+        # the triangles, color buffer and depth buffer of the last frame drawn
+        # into an empty image
+        self._previous: "tuple[list[bytes], np.ndarray, np.ndarray, np.ndarray] | None" = None
+
+    def _triangle_keys(self, display_list: list) -> "list[bytes]":
+        keys = []
+        for points, color in display_list:
+            color_bytes = b"" if color is None else bytes((color.r, color.g, color.b, color.a))
+            keys.append(points.tobytes() + color_bytes)
+        return keys
+
+    def _dirty_blocks(self, keys: "list[bytes]", bounds: np.ndarray, previous_keys: "list[bytes]", previous_bounds: np.ndarray) -> "np.ndarray | None":
+        """Finds the blocks that are covered by triangles that are only in one of
+        the two frames
+
+        Returns:
+            np.ndarray | None: a (rows, columns) array that is true for the blocks
+            that need to be redrawn, or None when the whole frame has to be
+            redrawn because the unchanged triangles were drawn in a new order
+        """
+        # match each triangle with the first unmatched copy of it in the frame before
+        previous_indexes = collections.defaultdict(collections.deque)
+        for index, key in enumerate(previous_keys):
+            previous_indexes[key].append(index)
+        matched_new = np.zeros(len(keys), dtype=bool)
+        matched_previous = np.zeros(len(previous_keys), dtype=bool)
+        last_index = -1
+        for index, key in enumerate(keys):
+            candidates = previous_indexes.get(key)
+            if candidates:
+                previous_index = candidates.popleft()
+                if previous_index < last_index:
+                    return None
+                last_index = previous_index
+                matched_new[index] = True
+                matched_previous[previous_index] = True
+        size = self.block_size
+        dirty = np.zeros((-(-self.height // size), -(-self.width // size)), dtype=bool)
+        for x_min, y_min, x_max, y_max in np.concatenate((bounds[~matched_new], previous_bounds[~matched_previous])).tolist():
+            dirty[y_min // size:-(-y_max // size), x_min // size:-(-x_max // size)] = True
+        return dirty
+
+    def _dirty_regions(self, dirty: np.ndarray) -> "list[tuple[int, int, int, int]]":
+        """Merges runs of dirty blocks in each row of blocks into regions
+        """
+        size = self.block_size
+        regions = []
+        for row, row_dirty in enumerate(dirty):
+            changes = np.flatnonzero(np.diff(np.concatenate(([0], row_dirty.astype(np.int8), [0]))))
+            for start, end in zip(changes[::2], changes[1::2]):
+                regions.append((
+                    int(start) * size, row * size,
+                    min(int(end) * size, self.width), min((row + 1) * size, self.height)
+                ))
+        return regions
+
+    def _bounds(self, points: np.ndarray) -> "tuple[int, int, int, int]":
+        if len(points) == 2:
+            return lines.line_bounds(points[0], points[1], self.width, self.height)
+        return lines.triangle_bounds(points[0], points[1], points[2], self.width, self.height)
+
+    def _draw(self, image: np.ndarray, draw_data: utils.DrawData, display_list: list, indexes, region=None) -> None:
+        for index in indexes:
+            points, color = display_list[index]
+            if len(points) == 2:
+                three_d.draw_screen_line(
+                    image, draw_data.depth_buffer,
+                    points[0], points[1],
+                    color, draw_data.near, draw_data.far,
+                    region=region, stats=draw_data.stats, blend=draw_data.blend
+                )
+                continue
+            three_d.draw_screen_triangle(
+                image, draw_data.depth_buffer,
+                points[0], points[1], points[2],
+                color, draw_data.near, draw_data.far,
+                region=region, hiz=self.hiz, stats=draw_data.stats, blend=draw_data.blend
+            )
+
+    def render(self, image: np.ndarray, draw_data: utils.DrawData) -> None:
+        """Draws and empties the display list of draw_data
+        """
+        display_list = list(draw_data.display_list)
+        draw_data.display_list.clear()
+        if self.use_hiz and self.hiz is None:
+            self.hiz = hiz.HierarchicalZ(draw_data.depth_buffer)
+            self.hiz_stats = self.hiz.stats
+        is_empty = not image.any()
+
+        keys = self._triangle_keys(display_list)
+        bounds = np.array([self._bounds(points) for points, _ in display_list], dtype=np.int64).reshape(-1, 4)
+        dirty = None
+        # a frame with no triangles has nothing worth copying
+        if is_empty and self._previous is not None and self._previous[0]:
+            previous_keys, previous_bounds, previous_image, previous_depth = self._previous
+            dirty = self._dirty_blocks(keys, bounds, previous_keys, previous_bounds)
+            if dirty is not None and dirty.all():
+                dirty = None
+
+        if dirty is None:
+            if self.hiz is not None:
+                self.hiz.rebuild()
+            self._draw(image, draw_data, display_list, range(len(display_list)))
+        else:
+            self.reused_frames += 1
+            image[:] = previous_image
+            draw_data.depth_buffer[:] = previous_depth
+            regions = self._dirty_regions(dirty)
+            for x_min, y_min, x_max, y_max in regions:
+                image[y_min:y_max, x_min:x_max] = 0
+                draw_data.depth_buffer[y_min:y_max, x_min:x_max] = depth.far_value(draw_data.depth_buffer.dtype)
+                self.redrawn_pixels += (x_max - x_min) * (y_max - y_min)
+            if self.hiz is not None:
+                self.hiz.rebuild()
+            for region in regions:
+                x_min, y_min, x_max, y_max = region
+                overlaps = np.flatnonzero(
+                    (bounds[:, 0] < x_max) & (bounds[:, 2] > x_min) &
+                    (bounds[:, 1] < y_max) & (bounds[:, 3] > y_min)
+                )
+                self._draw(image, draw_data, display_list, overlaps, region)
+
+        if is_empty:
+            self._previous = (keys, bounds, image.copy(), draw_data.depth_buffer.copy())
+        else:
+            self._previous = None
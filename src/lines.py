@@ -3,7 +3,6 @@ import math
 import numpy as np
 
 import src.vertex as vertex
-import src.utils as utils
 
 
 
@@ -73,6 +72,98 @@ def dda(p1: np.ndarray, p2: np.ndarray, step_in_y: bool = False) -> "list[np.nda
         q = q + dp
     return output_list
 
+def dda_steps(p1: np.ndarray, p2: np.ndarray, step_in_y: "bool | np.ndarray" = False) -> np.ndarray:
+    """Finds every point dda would step through for many segments at once, with
+    np.arange style indexing in place of a loop. p1 and p2 are (n, k) arrays of the
+    end points of each segment, with x and y as the first two values.
+
+    Args:
+        step_in_y (bool | np.ndarray): always step in y, for every segment or for
+            the segments where it is true. Otherwise each segment steps in the
+            direction it changes the most in.
+
+    Returns:
+        np.ndarray: (m, k) points of every segment in order, starting at the first
+        integer at or after the lower end of each segment in its step direction
+        and stopping before its upper end
+    """
+    p1 = np.atleast_2d(np.asarray(p1, dtype=float))
+    p2 = np.atleast_2d(np.asarray(p2, dtype=float))
+    delta_p = p2 - p1
+    step_in_y = step_in_y | (np.abs(delta_p[:, 0]) < np.abs(delta_p[:, 1]))
+    step_index = np.broadcast_to(step_in_y, (len(p1),)).astype(np.int64)
+    rows = np.arange(len(p1))
+    # make every segment go from a lower point to a higher point in its step direction
+    flip = delta_p[rows, step_index] < 0
+    p1, p2 = np.where(flip[:, np.newaxis], p2, p1), np.where(flip[:, np.newaxis], p1, p2)
+    delta_p = np.where(flip[:, np.newaxis], -delta_p, delta_p)
+    step_delta = delta_p[rows, step_index]
+    moving = step_delta != 0
+    # the change in every attribute for a step of 1 in the step direction
+    dp = np.zeros(delta_p.shape)
+    dp[moving] = delta_p[moving] / step_delta[moving, np.newaxis]
+    first = np.ceil(p1[rows, step_index])
+    q0 = p1 + (first - p1[rows, step_index])[:, np.newaxis] * dp
+    counts = np.maximum(np.ceil(p2[rows, step_index]) - first, 0).astype(np.int64)
+    counts[~moving] = 0
+    # expand every segment into its steps
+    segment = np.repeat(rows, counts)
+    steps = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return q0[segment] + steps[:, np.newaxis] * dp[segment]
+
+def line_bounds(p1: np.ndarray, p2: np.ndarray, width: float = math.inf, height: float = math.inf, region: "tuple[int, int, int, int] | None" = None) -> "tuple[int, int, int, int] | None":
+    """Finds a box that holds every pixel dda_batch can produce for a segment,
+    clipped to the screen and to region. Pixels are rounded, so a pixel can be up
+    to half a pixel outside of the segment.
+
+    Returns:
+        tuple[int, int, int, int] | None: (x_min, y_min, x_max, y_max) where the max
+        values are exclusive, or None when no pixels are left. A segment with an
+        end point that is not finite has no pixels.
+    """
+    if not all(math.isfinite(p[0]) and math.isfinite(p[1]) for p in (p1, p2)):
+        return None
+    if region is None:
+        region = (0, 0, width, height)
+    x_min = max(math.floor(min(p1[0], p2[0])), 0, region[0])
+    x_max = min(math.floor(max(p1[0], p2[0])) + 2, width, region[2])
+    y_min = max(math.floor(min(p1[1], p2[1])), 0, region[1])
+    y_max = min(math.floor(max(p1[1], p2[1])) + 2, height, region[3])
+    if x_min >= x_max or y_min >= y_max:
+        return None
+    return (int(x_min), int(y_min), int(x_max), int(y_max))
+
+def dda_batch(p1: np.ndarray, p2: np.ndarray, width: float = math.inf, height: float = math.inf, region: "tuple[int, int, int, int] | None" = None) -> vertex.Fragments:
+    """Rasterizes many segments at once. p1 and p2 are (n, 8) arrays of the end
+    points of each segment, laid out like Vertex.as_ndarray (x, y, z, w, r, g, b, a).
+    Each segment steps like dda does and the other coordinate is rounded to the
+    nearest pixel.
+
+    Args:
+        region (tuple[int, int, int, int], optional): (x_min, y_min, x_max, y_max)
+            only pixels with x_min <= x < x_max and y_min <= y < y_max are produced
+
+    Returns:
+        vertex.Fragments: one fragment for each step of each segment, in order, with
+        z and color interpolated along the segment. Only fragments with
+        0 <= x < width and 0 <= y < height are produced.
+    """
+    points = dda_steps(p1, p2)
+    x = np.round(points[:, 0]).astype(np.int64)
+    y = np.round(points[:, 1]).astype(np.int64)
+    if region is None:
+        region = (0, 0, width, height)
+    x_min, y_min = max(region[0], 0), max(region[1], 0)
+    x_max, y_max = min(region[2], width), min(region[3], height)
+    inside = (x_min <= x) & (x < x_max) & (y_min <= y) & (y < y_max)
+    # alpha only has to be interpolated when an end point is translucent
+    opaque = (np.asarray(p1)[..., 7] == 1).all() and (np.asarray(p2)[..., 7] == 1).all()
+    return vertex.Fragments(
+        x[inside], y[inside],
+        *(points[inside, i] for i in (2, 4, 5, 6)),
+        None if opaque else points[inside, 7]
+    )
+
 def triangle_fill(p1: vertex.Vertex, p2: vertex.Vertex, p3: vertex.Vertex, width: float = math.inf, height: float = math.inf) -> "list[vertex.Vertex]":
     # The first step is to order to 3 vertexes by their y coordinate.
     a = [p1, p2, p3]
@@ -99,10 +190,181 @@ def triangle_fill(p1: vertex.Vertex, p2: vertex.Vertex, p3: vertex.Vertex, width
     output = list(map(lambda x: vertex.ndarray_to_vertex(x, is_rounded=False), output))
     return output
 
+# The largest number of pixels rasterize_triangle will test in one numpy pass.
+# Bigger bounding boxes are split into bands of rows to keep memory bounded.
+MAX_BAND_PIXELS = 1 << 20
+
+def edge_function(a: np.ndarray, b: np.ndarray, x, y):
+    """Evaluates the edge function of the directed edge a->b at (x, y). The result
+    is positive on one side of the edge, negative on the other and zero on it.
+    """
+    return (b[0] - a[0]) * (y - a[1]) - (b[1] - a[1]) * (x - a[0])
+
+def is_top_left(a: np.ndarray, b: np.ndarray) -> bool:
+    """Returns true if pixels lying exactly on the edge a->b belong to the triangle.
+    Assumes the triangle has a positive area. This matches the rules triangle_fill
+    uses: spans include their left end and the first row, but not their right end
+    or the last row.
+    """
+    # a horizontal edge with the triangle below it
+    if a[1] == b[1]:
+        return b[0] > a[0]
+    # an edge with the triangle to its right
+    return b[1] < a[1]
+
+def triangle_bounds(p1: np.ndarray, p2: np.ndarray, p3: np.ndarray, width: float = math.inf, height: float = math.inf, region: "tuple[int, int, int, int] | None" = None) -> "tuple[int, int, int, int] | None":
+    """Finds the pixels rasterize_triangle has to test for a triangle: its bounding
+    box clipped to the screen and to region.
+
+    Returns:
+        tuple[int, int, int, int] | None: (x_min, y_min, x_max, y_max) where the max
+        values are exclusive, or None when no pixels are left. A triangle with an
+        x or y that is not finite, like a point with a w of 0, has no pixels.
+    """
+    points = (p1, p2, p3)
+    if not all(math.isfinite(p[0]) and math.isfinite(p[1]) for p in points):
+        return None
+    if region is None:
+        region = (0, 0, width, height)
+    x_min = max(math.ceil(min(p[0] for p in points)), 0, region[0])
+    x_max = min(math.ceil(max(p[0] for p in points)), width, region[2])
+    y_min = max(math.ceil(min(p[1] for p in points)), 0, region[1])
+    y_max = min(math.ceil(max(p[1] for p in points)), height, region[3])
+    if x_min >= x_max or y_min >= y_max:
+        return None
+    return (int(x_min), int(y_min), int(x_max), int(y_max))
+
+def rasterize_triangle(p1: np.ndarray, p2: np.ndarray, p3: np.ndarray, width: float = math.inf, height: float = math.inf, region: "tuple[int, int, int, int] | None" = None, perspective_correct: bool = False) -> vertex.Fragments:
+    """Rasterizes a triangle by testing every pixel in its bounding box with edge
+    functions at once. The points are laid out like Vertex.as_ndarray
+    (x, y, z, w, r, g, b, a). Samples are taken at integer pixel coordinates and
+    follow the same top-left rules as triangle_fill, only pixels with
+    0 <= x < width and 0 <= y < height are produced.
+
+    Every pixel is tested on its own, so rasterizing with a region gives exactly
+    the fragments of the whole triangle that fall inside of it.
+
+    Args:
+        region (tuple[int, int, int, int], optional): (x_min, y_min, x_max, y_max)
+            only pixels with x_min <= x < x_max and y_min <= y < y_max are produced
+        perspective_correct (bool): interpolate the colors with barycentric
+            weights divided by w, so they are linear across the triangle in eye
+            space instead of on the screen. z has already been divided by w, which
+            makes it linear on the screen, so it is always interpolated linearly.
+
+    Returns:
+        vertex.Fragments: the fragments covered by the triangle, with z and color
+        interpolated using barycentric coordinates
+    """
+    area = edge_function(p1, p2, p3[0], p3[1])
+    if area == 0:
+        return vertex.empty_fragments()
+    # make sure the triangle winds so that its area is positive
+    if area < 0:
+        p2, p3 = p3, p2
+        area = -area
+    bounds = triangle_bounds(p1, p2, p3, width, height, region)
+    if bounds is None:
+        return vertex.empty_fragments()
+    x_min, y_min, x_max, y_max = bounds
+    # When every w is the same the corrected weights are the screen space weights.
+    # A w of 0 can not be divided by, so those triangles are interpolated linearly.
+    perspective_correct = (
+        perspective_correct
+        and not p1[3] == p2[3] == p3[3]
+        and 0 not in (p1[3], p2[3], p3[3])
+    )
+    # the edge opposite to each point, used to find that point's barycentric weight
+    edges = ((p2, p3), (p3, p1), (p1, p2))
+    top_left = [is_top_left(a, b) for a, b in edges]
+    # alpha only has to be interpolated when a point is translucent
+    opaque = p1[7] == p2[7] == p3[7] == 1
+    xs = np.arange(x_min, x_max)
+    band_height = max(1, MAX_BAND_PIXELS // len(xs))
+    output = []
+    for band_start in range(y_min, y_max, band_height):
+        ys = np.arange(band_start, min(band_start + band_height, y_max))
+        x, y = np.meshgrid(xs, ys)
+        weights = [edge_function(a, b, x, y) for a, b in edges]
+        inside = np.ones(x.shape, dtype=bool)
+        for weight, include_edge in zip(weights, top_left):
+            inside &= (weight >= 0) if include_edge else (weight > 0)
+        if not inside.any():
+            continue
+        l1, l2, l3 = (weight[inside] / area for weight in weights)
+        z = l1 * p1[2] + l2 * p2[2] + l3 * p3[2]
+        if perspective_correct:
+            # weight each point by 1/w and normalize, which undoes the divide by w
+            l1, l2, l3 = l1 / p1[3], l2 / p2[3], l3 / p3[3]
+            total = l1 + l2 + l3
+            l1, l2, l3 = l1 / total, l2 / total, l3 / total
+        r, g, b = (l1 * p1[i] + l2 * p2[i] + l3 * p3[i] for i in (4, 5, 6))
+        a = None if opaque else l1 * p1[7] + l2 * p2[7] + l3 * p3[7]
+        output.append(vertex.Fragments(x[inside], y[inside], z, r, g, b, a))
+    return vertex.concatenate_fragments(output)
+
+def rasterize_triangles(points: np.ndarray, width: float, height: float, perspective_correct: bool = False) -> "tuple[vertex.Fragments, np.ndarray]":
+    """Rasterizes a batch of triangles in one numpy pass. Every pixel in the
+    bounding box of every triangle is tested at once, with the same arithmetic
+    as rasterize_triangle, so each triangle gets exactly the fragments
+    rasterize_triangle would give it. Meant for small triangles, since every
+    bounding box pixel is held in memory at once.
+
+    Args:
+        points (np.ndarray): (n, 3, 8) points of each triangle laid out like
+            Vertex.as_ndarray
+        perspective_correct (bool): see rasterize_triangle
+
+    Returns:
+        tuple[vertex.Fragments, np.ndarray]: the fragments of every triangle in the
+        order of the triangles, and the index of the triangle of each fragment
+    """
+    p1, p2, p3 = points[:, 0].T, points[:, 1].T, points[:, 2].T
+    area = edge_function(p1, p2, p3[0], p3[1])
+    # make sure every triangle winds so that its area is positive
+    flip = area < 0
+    p2, p3 = np.where(flip, p3, p2), np.where(flip, p2, p3)
+    area = np.abs(area)
+    x_min = np.maximum(np.ceil(points[:, :, 0].min(axis=1)), 0)
+    x_max = np.minimum(np.ceil(points[:, :, 0].max(axis=1)), width)
+    y_min = np.maximum(np.ceil(points[:, :, 1].min(axis=1)), 0)
+    y_max = np.minimum(np.ceil(points[:, :, 1].max(axis=1)), height)
+    box_width = np.maximum(x_max - x_min, 0).astype(np.int64)
+    box_height = np.maximum(y_max - y_min, 0).astype(np.int64)
+    counts = np.where(area == 0, 0, box_width * box_height)
+    # every pixel of every bounding box, row by row like rasterize_triangle
+    triangle = np.repeat(np.arange(len(points)), counts)
+    pixel = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    x = x_min.astype(np.int64)[triangle] + pixel % box_width[triangle]
+    y = y_min.astype(np.int64)[triangle] + pixel // box_width[triangle]
+    p1, p2, p3 = p1[:, triangle], p2[:, triangle], p3[:, triangle]
+    # the edge opposite to each point, used to find that point's barycentric weight
+    edges = ((p2, p3), (p3, p1), (p1, p2))
+    weights = [edge_function(a, b, x, y) for a, b in edges]
+    inside = np.ones(len(x), dtype=bool)
+    for weight, (a, b) in zip(weights, edges):
+        # the same rules as is_top_left
+        top_left = np.where(a[1] == b[1], b[0] > a[0], b[1] < a[1])
+        inside &= np.where(top_left, weight >= 0, weight > 0)
+    triangle, x, y = triangle[inside], x[inside], y[inside]
+    p1, p2, p3 = p1[:, inside], p2[:, inside], p3[:, inside]
+    area = area[triangle]
+    l1, l2, l3 = (weight[inside] / area for weight in weights)
+    z = l1 * p1[2] + l2 * p2[2] + l3 * p3[2]
+    if perspective_correct:
+        # the same triangles rasterize_triangle corrects
+        w1, w2, w3 = p1[3], p2[3], p3[3]
+        correct = ~((w1 == w2) & (w2 == w3)) & (w1 != 0) & (w2 != 0) & (w3 != 0)
+        c1, c2, c3 = l1[correct] / w1[correct], l2[correct] / w2[correct], l3[correct] / w3[correct]
+        total = c1 + c2 + c3
+        l1, l2, l3 = l1.copy(), l2.copy(), l3.copy()
+        l1[correct], l2[correct], l3[correct] = c1 / total, c2 / total, c3 / total
+    r, g, b = (l1 * p1[i] + l2 * p2[i] + l3 * p3[i] for i in (4, 5, 6))
+    a = None if (points[:, :, 7] == 1).all() else l1 * p1[7] + l2 * p2[7] + l3 * p3[7]
+    return vertex.Fragments(x, y, z, r, g, b, a), triangle
+
 def dda_on_vertex(p1: vertex.Vertex, p2: vertex.Vertex, step_in_y: bool = False) -> "list[vertex.Vertex]":
-    p1_list: np.ndarray = np.array(utils.object_to_list(p1))
-    p2_list: np.ndarray = np.array(utils.object_to_list(p2))
-    dda_result = dda(p1_list, p2_list, step_in_y)
+    dda_result = dda_steps(p1.as_ndarray(), p2.as_ndarray(), step_in_y)
     output = list(map(vertex.ndarray_to_vertex, dda_result))
     return output
 
@@ -0,0 +1,305 @@
+import dataclasses
+import functools
+import os
+import re
+import warnings
+
+import numpy as np
+
+
+@dataclasses.dataclass
+class Mesh():
+    """A triangle mesh loaded from a file
+    \b positions: (n, 3) float64 x, y, z of every vertex
+    \b triangles: (m, 3) int64 zero based indexes into positions of the points of every triangle
+    \b colors: (n, 3) float64 r, g, b in the range 0-1 of every vertex, or None when the file has no colors
+    """
+    positions: np.ndarray
+    triangles: np.ndarray
+    colors: "np.ndarray | None" = None
+
+def fan_triangulate(faces: np.ndarray) -> np.ndarray:
+    """Splits (m, k) polygons with k points each into triangle fans around their
+    first point
+
+    Returns:
+        np.ndarray: (m * (k - 2), 3) indexes of each triangle, the triangles of
+        each polygon next to each other
+    """
+    k = faces.shape[1]
+    if k < 3:
+        raise Exception("a face needs at least 3 points", k)
+    steps = np.arange(1, k - 1)
+    return np.stack((
+        np.repeat(faces[:, :1], k - 2, axis=1),
+        faces[:, steps],
+        faces[:, steps + 1],
+    ), axis=2).reshape(-1, 3)
+
+def _faces_to_triangles(counts: np.ndarray, indexes: np.ndarray) -> np.ndarray:
+    """Triangulates faces with any number of points, given the number of points
+    of each face and all of their indexes one after another
+    """
+    counts = np.asarray(counts, dtype=np.int64)
+    if len(counts) and counts.min() < 3:
+        raise Exception("a face needs at least 3 points", int(counts.min()))
+    starts = np.cumsum(counts) - counts
+    triangle_counts = counts - 2
+    face = np.repeat(np.arange(len(counts)), triangle_counts)
+    step = np.arange(triangle_counts.sum()) - np.repeat(np.cumsum(triangle_counts) - triangle_counts, triangle_counts) + 1
+    first = starts[face]
+    return np.stack((indexes[first], indexes[first + step], indexes[first + step + 1]), axis=1)
+
+def _check_triangles(triangles: np.ndarray, vertex_count: int) -> np.ndarray:
+    if len(triangles) and (triangles.min() < 0 or triangles.max() >= vertex_count):
+        raise IndexError("mesh face uses a vertex that does not exist")
+    return triangles
+
+### OBJ ###
+# the texture and normal indexes after the vertex index of a face corner
+_OBJ_CORNER_EXTRAS = re.compile(r"/\S*")
+
+def _parse_numbers(text: str, dtype: type) -> np.ndarray:
+    """Converts the numbers in text separated by whitespace all at once. Parsing
+    stops at the first word that is not a number, so callers check the size.
+    """
+    with warnings.catch_warnings():
+        # numpy warns when it stops before the end of the text
+        warnings.simplefilter("ignore", DeprecationWarning)
+        return np.fromstring(text, dtype=dtype, sep=" ")
+
+def read_obj(text: str) -> Mesh:
+    """Reads the v and f lines of a Wavefront OBJ file. Faces with more than 3
+    points are split into triangle fans, and every other kind of line (normals,
+    texture coordinates, groups and materials) is ignored. Vertexes written as
+    x y z r g b give the mesh colors. The numbers of all the lines are converted
+    together by numpy, instead of one line at a time.
+    """
+    vertex_lines = []
+    face_lines = []
+    # the number of vertexes before each face, for negative indexes
+    face_vertex_counts = []
+    for line in text.splitlines():
+        if line.startswith("v "):
+            vertex_lines.append(line[2:])
+        elif line.startswith("f "):
+            face_lines.append(line[2:])
+            face_vertex_counts.append(len(vertex_lines))
+
+    values = _parse_numbers(" ".join(vertex_lines), np.float64)
+    colors = None
+    if len(values) == 3 * len(vertex_lines):
+        positions = values.reshape(-1, 3)
+    elif len(values) == 6 * len(vertex_lines):
+        positions = values.reshape(-1, 6)[:, :3]
+        colors = values.reshape(-1, 6)[:, 3:]
+    else:
+        # the lines have different numbers of values, or something that is not a number
+        positions = np.array([line.split()[:3] for line in vertex_lines], dtype=np.float64).reshape(-1, 3)
+
+    indexes = _parse_numbers(_OBJ_CORNER_EXTRAS.sub("", " ".join(face_lines)), np.int64)
+    if len(indexes) == 3 * len(face_lines):
+        # every face has at least 3 points, so they are all triangles
+        counts = np.full(len(face_lines), 3, dtype=np.int64)
+    else:
+        counts = np.array([len(line.split()) for line in face_lines], dtype=np.int64)
+        if len(indexes) != counts.sum():
+            indexes = np.array(_OBJ_CORNER_EXTRAS.sub("", " ".join(face_lines)).split(), dtype=np.int64)
+    if (indexes == 0).any():
+        raise IndexError("OBJ vertex indexes start at 1")
+    # positive indexes start at 1, negative ones count back from the last vertex before the face
+    before = np.repeat(np.array(face_vertex_counts, dtype=np.int64), counts)
+    indexes = np.where(indexes > 0, indexes - 1, indexes + before)
+    triangles = _faces_to_triangles(counts, indexes)
+    return Mesh(positions, _check_triangles(triangles, len(positions)), colors)
+
+def load_obj(filename: str) -> Mesh:
+    with open(filename, "r") as file:
+        return read_obj(file.read())
+
+### PLY ###
+_PLY_TYPES = {
+    "char": "i1", "int8": "i1", "uchar": "u1", "uint8": "u1",
+    "short": "i2", "int16": "i2", "ushort": "u2", "uint16": "u2",
+    "int": "i4", "int32": "i4", "uint": "u4", "uint32": "u4",
+    "float": "f4", "float32": "f4", "double": "f8", "float64": "f8",
+}
+
+@dataclasses.dataclass
+class PlyElement():
+    """An element declared in the header of a PLY file
+    \b name: the name of the element, like vertex or face
+    \b count: how many of the element there are
+    \b properties: the name and numpy type of each scalar property
+    \b list_property: the name, count type and item type of the list property, if any
+    """
+    name: str
+    count: int
+    properties: "list[tuple[str, str]]" = dataclasses.field(default_factory=list)
+    list_property: "tuple[str, str, str] | None" = None
+
+def read_ply_header(file) -> "tuple[str, list[PlyElement], int]":
+    """Reads the header of a PLY file opened in binary mode
+
+    Returns:
+        tuple[str, list[PlyElement], int]: the format, the elements in the order
+        they are stored and the size of the header in bytes
+    """
+    if file.readline().strip() != b"ply":
+        raise Exception("not a PLY file")
+    data_format = None
+    elements: "list[PlyElement]" = []
+    for raw_line in file:
+        words = raw_line.decode("ascii").split()
+        if not words or words[0] in ("comment", "obj_info"):
+            continue
+        if words[0] == "end_header":
+            break
+        if words[0] == "format":
+            data_format = words[1]
+        elif words[0] == "element":
+            elements.append(PlyElement(words[1], int(words[2])))
+        elif words[0] == "property" and words[1] == "list":
+            elements[-1].list_property = (words[4], _PLY_TYPES[words[2]], _PLY_TYPES[words[3]])
+        elif words[0] == "property":
+            if elements[-1].list_property is not None:
+                raise Exception("PLY elements with properties after a list are not supported", elements[-1].name)
+            elements[-1].properties.append((words[2], _PLY_TYPES[words[1]]))
+    else:
+        raise Exception("the PLY header has no end_header")
+    if data_format not in ("ascii", "binary_little_endian", "binary_big_endian"):
+        raise Exception("unknown PLY format", data_format)
+    return data_format, elements, file.tell()
+
+def _vertex_mesh(vertexes: np.ndarray, triangles: np.ndarray) -> Mesh:
+    """Makes a Mesh from a structured array of PLY vertexes
+    """
+    positions = np.stack([vertexes[axis].astype(np.float64) for axis in ("x", "y", "z")], axis=1)
+    colors = None
+    names = vertexes.dtype.names
+    if all(channel in names for channel in ("red", "green", "blue")):
+        colors = np.stack([vertexes[channel] for channel in ("red", "green", "blue")], axis=1).astype(np.float64)
+        # integer colors go up to 255, float colors up to 1
+        if vertexes.dtype["red"].kind in "ui":
+            colors /= 255
+    return Mesh(positions, _check_triangles(triangles, len(positions)), colors)
+
+def _binary_lists(data: np.ndarray, offset: int, element: PlyElement, byte_order: str) -> "tuple[np.ndarray, np.ndarray, int]":
+    """Reads the list property of an element of a binary PLY file, like the
+    indexes of the faces. When every list has the same length the element is read
+    as one fixed size structured array, otherwise the lists are walked one at a
+    time.
+
+    Returns:
+        tuple[np.ndarray, np.ndarray, int]: the length of each list, the items of
+        all of the lists one after another and the offset after the element
+    """
+    _, count_type, item_type = element.list_property
+    count_type = np.dtype(count_type).newbyteorder(byte_order)
+    item_type = np.dtype(item_type).newbyteorder(byte_order)
+    scalars = [(name, np.dtype(kind).newbyteorder(byte_order)) for name, kind in element.properties]
+    scalar_size = sum(kind.itemsize for _, kind in scalars)
+    if element.count == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), offset
+    first_count = int(np.frombuffer(data, count_type, 1, offset + scalar_size)[0])
+    fixed = np.dtype(scalars + [("count", count_type), ("items", item_type, (first_count,))])
+    if offset + fixed.itemsize * element.count <= len(data):
+        rows = np.frombuffer(data, fixed, element.count, offset)
+        if (rows["count"] == first_count).all():
+            counts = np.full(element.count, first_count, dtype=np.int64)
+            return counts, rows["items"].reshape(-1).astype(np.int64), offset + fixed.itemsize * element.count
+    counts = []
+    items = []
+    for _ in range(element.count):
+        offset += scalar_size
+        count = int(np.frombuffer(data, count_type, 1, offset)[0])
+        offset += count_type.itemsize
+        items.append(np.frombuffer(data, item_type, count, offset))
+        offset += item_type.itemsize * count
+        counts.append(count)
+    return np.array(counts, dtype=np.int64), np.concatenate(items).astype(np.int64), offset
+
+def load_ply(filename: str) -> Mesh:
+    """Loads the vertex and face elements of a PLY file. The data of binary files
+    is memory mapped and read as structured arrays, and the data of ASCII files is
+    converted by numpy all at once. Faces with more than 3 points are split into
+    triangle fans. The red, green and blue properties of the vertexes, if there
+    are any, become the colors of the mesh.
+    """
+    with open(filename, "rb") as file:
+        data_format, elements, header_size = read_ply_header(file)
+        if data_format == "ascii":
+            text = file.read().decode("ascii")
+    names = [element.name for element in elements]
+    if "vertex" not in names:
+        raise Exception("the PLY file has no vertex element")
+
+    if data_format == "ascii":
+        return _read_ascii_ply(text, elements)
+
+    byte_order = "<" if data_format == "binary_little_endian" else ">"
+    data = np.memmap(filename, dtype=np.uint8, mode="r", offset=header_size)
+    offset = 0
+    vertexes = None
+    triangles = np.empty((0, 3), dtype=np.int64)
+    for element in elements:
+        if element.list_property is None:
+            dtype = np.dtype([(name, np.dtype(kind).newbyteorder(byte_order)) for name, kind in element.properties])
+            values = np.frombuffer(data, dtype, element.count, offset)
+            offset += dtype.itemsize * element.count
+            if element.name == "vertex":
+                vertexes = values
+        else:
+            # the lists of other elements are read to find where they end
+            counts, indexes, offset = _binary_lists(data, offset, element, byte_order)
+            if element.name == "face":
+                triangles = _faces_to_triangles(counts, indexes)
+    return _vertex_mesh(vertexes, triangles)
+
+def _read_ascii_ply(text: str, elements: "list[PlyElement]") -> Mesh:
+    lines = text.splitlines()
+    start = 0
+    vertexes = None
+    triangles = np.empty((0, 3), dtype=np.int64)
+    for element in elements:
+        element_lines = lines[start:start + element.count]
+        start += element.count
+        if element.list_property is None:
+            values = _parse_numbers(" ".join(element_lines), np.float64)
+            if len(values) != element.count * len(element.properties):
+                raise Exception("the PLY element does not have the number of values its header says", element.name)
+            values = values.reshape(element.count, len(element.properties))
+            if element.name == "vertex":
+                vertexes = np.empty(element.count, dtype=element.properties)
+                for column, (name, _) in enumerate(element.properties):
+                    vertexes[name] = values[:, column]
+        elif element.name == "face":
+            skip = len(element.properties)
+            values = _parse_numbers(" ".join(element_lines), np.int64)
+            # every face is a triangle with nothing but its indexes
+            if skip == 0 and len(values) == 4 * element.count and (values[::4] == 3).all():
+                triangles = values.reshape(-1, 4)[:, 1:]
+                continue
+            faces = [line.split()[skip:] for line in element_lines]
+            counts = np.array([int(face[0]) for face in faces], dtype=np.int64)
+            indexes = np.array([index for face in faces for index in face[1:]], dtype=np.int64)
+            triangles = _faces_to_triangles(counts, indexes)
+    return _vertex_mesh(vertexes, triangles)
+
+### LOADING ###
+LOADERS = {
+    "obj": load_obj,
+    "ply": load_ply,
+}
+
+@functools.lru_cache(maxsize=8)
+def _load_cached(kind: str, filename: str, modified: int, size: int) -> Mesh:
+    return LOADERS[kind](filename)
+
+def load(kind: str, filename: str) -> Mesh:
+    """Loads a mesh, reusing the mesh from the last time the file was loaded if it
+    has not changed since, so animations that draw the same mesh in every frame
+    only read it once
+    """
+    info = os.stat(filename)
+    return _load_cached(kind, os.path.abspath(filename), info.st_mtime_ns, info.st_size)
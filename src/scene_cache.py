@@ -0,0 +1,266 @@
+import dataclasses
+import functools
+import hashlib
+import json
+import os
+import tempfile
+from typing import Callable, Iterable, Iterator
+
+import numpy as np
+
+import src.file_parse as file_parse
+import src.three_d as three_d
+import src.utils as utils
+import src.vertex as vertex
+
+
+# Bump this whenever the layout of a compiled scene changes, so old caches are
+# not read with the new layout
+FORMAT_VERSION = 4
+
+# The opcodes of the command stream. Every command is a row of 4 ints, the
+# opcode followed by 3 arguments.
+OP_XYZ = 0        # add vertices start to start + count of positions: (start, count, 0)
+OP_COLOR = 1      # set the current color to row index of colors: (index, 0, 0)
+OP_LOADMV = 2     # load matrix index as the model view matrix: (index, 0, 0)
+OP_LOADP = 3      # load matrix index as the projection matrix: (index, 0, 0)
+OP_MULTMV = 4     # multiply the model view matrix by matrix index: (index, 0, 0)
+OP_TRIF = 5       # draw a flat triangle with indexes as they were written in the file: (i1, i2, i3)
+OP_TRIG = 6       # draw a gouraud triangle: (i1, i2, i3)
+OP_CULL = 7       # set the faces to cull to CULL_FACES[index]: (index, 0, 0)
+OP_FRAME = 8      # move to image index: (index, 0, 0)
+OP_TEXT = 9       # run line index of text through file_parse.parse_line: (index, 0, 0)
+OP_LINE = 10      # draw a flat line: (i1, i2, 0)
+OP_LINEG = 11     # draw a gouraud line: (i1, i2, 0)
+OP_BATCH = 12     # draw rows start to start + count of ranges with BATCH_KEYWORDS[index]: (start, count, index)
+
+BATCH_KEYWORDS = tuple(file_parse.BATCH_COMMANDS)
+
+CULL_FACES = ("none", "back", "front")
+
+# Commands that multiply the model view matrix by a matrix that only depends on
+# the words of the line, so that matrix can be computed once when compiling
+MODEL_VIEW_COMMANDS = {"translate", "rotatex", "rotatey", "rotatez", "scale", "multmv", "rotate"}
+
+# The fields of CompiledScene that are saved as .npy files
+ARRAY_FIELDS = ("commands", "positions", "colors", "matrices", "ranges")
+
+@dataclasses.dataclass
+class CompiledScene():
+    """Every line after the first line of a file, parsed into arrays
+    \b commands: (n, 4) int64 command stream, see the OP_ constants
+    \b positions: (n, 3) float64 x, y, z of every xyz line
+    \b colors: (n, 4) float64 r, g, b, a of every color line
+    \b matrices: (n, 4, 4) float64 matrices of the matrix commands
+    \b ranges: (n, 2) int64 first and last vertex index of every word of the batch commands, as they were written in the file
+    \b text: lines that are run as text, split into words
+    """
+    commands: np.ndarray
+    positions: np.ndarray
+    colors: np.ndarray
+    matrices: np.ndarray
+    ranges: np.ndarray
+    text: "list[list[str]]"
+
+def _is_index(word: str) -> bool:
+    # the same test VertexBuffer.index_of uses
+    return word.strip("-").isnumeric()
+
+def _is_range(word: str) -> bool:
+    # the same test vertex.parse_ranges uses
+    first, _, last = word.partition(":")
+    return _is_index(first) and (not last or _is_index(last))
+
+def compile_lines(lines: "Iterable[str]") -> CompiledScene:
+    """Parses the lines that follow the first line of a file into a CompiledScene.
+    Keywords that can not be compiled, and lines that would raise an error when
+    they are run, are kept as text so they behave the same way when the scene is
+    replayed.
+    """
+    commands: "list[tuple[int, int, int, int]]" = []
+    positions: "list[tuple[float, float, float]]" = []
+    colors: "list[tuple[float, float, float, float]]" = []
+    matrices: "list[np.ndarray]" = []
+    ranges: "list[tuple[int, int]]" = []
+    text: "list[list[str]]" = []
+    # computes the matrices of MODEL_VIEW_COMMANDS
+    scratch = utils.DrawData(vertex.VertexBuffer(capacity=1), 1, 1)
+    for text_line in lines:
+        line = utils.line_to_list(text_line)
+        if not line:
+            continue
+        keyword = line[0]
+        try:
+            if keyword == "frame":
+                commands.append((OP_FRAME, int(line[1]), 0, 0))
+            elif keyword == "xyz":
+                position = (float(line[1]), float(line[2]), float(line[3]))
+                # runs of xyz lines are added to the vertex list together
+                if commands and commands[-1][0] == OP_XYZ:
+                    _, start, count, _ = commands[-1]
+                    commands[-1] = (OP_XYZ, start, count + 1, 0)
+                else:
+                    commands.append((OP_XYZ, len(positions), 1, 0))
+                positions.append(position)
+            elif keyword == "color":
+                colors.append((float(line[1]), float(line[2]), float(line[3]), float(line[4]) if len(line) > 4 else 1.0))
+                commands.append((OP_COLOR, len(colors) - 1, 0, 0))
+            elif keyword in ("trif", "trig") and len(line) >= 4 and all(map(_is_index, line[1:4])):
+                opcode = OP_TRIF if keyword == "trif" else OP_TRIG
+                commands.append((opcode, *map(int, line[1:4])))
+            elif keyword in ("line", "lineg") and len(line) >= 3 and all(map(_is_index, line[1:3])):
+                opcode = OP_LINE if keyword == "line" else OP_LINEG
+                commands.append((opcode, *map(int, line[1:3]), 0))
+            elif keyword in BATCH_KEYWORDS and all(map(_is_range, line[1:])):
+                words = list(zip(*vertex.parse_ranges(line[1:])))
+                commands.append((OP_BATCH, len(ranges), len(words), BATCH_KEYWORDS.index(keyword)))
+                ranges += words
+            elif keyword in ("loadmv", "loadp"):
+                matrices.append(np.asarray(line[1:], float).reshape(4,4))
+                commands.append((OP_LOADMV if keyword == "loadmv" else OP_LOADP, len(matrices) - 1, 0, 0))
+            elif keyword in MODEL_VIEW_COMMANDS and keyword in file_parse.COMMANDS:
+                scratch.set_model_view(np.identity(4))
+                file_parse.COMMANDS[keyword](line, None, scratch)
+                matrices.append(scratch.model_view)
+                commands.append((OP_MULTMV, len(matrices) - 1, 0, 0))
+            elif keyword == "cull" and (len(line) == 1 or line[1] in CULL_FACES):
+                commands.append((OP_CULL, CULL_FACES.index(line[1] if len(line) > 1 else "back"), 0, 0))
+            else:
+                raise ValueError("can not be compiled", keyword)
+        except (ValueError, IndexError, AssertionError, ZeroDivisionError):
+            if keyword == "frame":
+                raise
+            text.append(line)
+            commands.append((OP_TEXT, len(text) - 1, 0, 0))
+    return CompiledScene(
+        commands=np.array(commands, dtype=np.int64).reshape(-1, 4),
+        positions=np.array(positions, dtype=np.float64).reshape(-1, 3),
+        colors=np.array(colors, dtype=np.float64).reshape(-1, 4),
+        matrices=np.array(matrices, dtype=np.float64).reshape(-1, 4, 4),
+        ranges=np.array(ranges, dtype=np.int64).reshape(-1, 2),
+        text=text,
+    )
+
+def save(scene: CompiledScene, directory: str) -> None:
+    """Writes a compiled scene into a new directory. The files are written next to
+    it first and moved into place at once, so a half written scene is never read.
+    """
+    parent = os.path.dirname(os.path.abspath(directory))
+    os.makedirs(parent, exist_ok=True)
+    temporary = tempfile.mkdtemp(dir=parent)
+    for field in ARRAY_FIELDS:
+        np.save(os.path.join(temporary, field + ".npy"), getattr(scene, field))
+    with open(os.path.join(temporary, "text.json"), "w") as file:
+        json.dump(scene.text, file)
+    try:
+        os.rename(temporary, directory)
+    except OSError:
+        # another run saved the same scene first
+        for name in os.listdir(temporary):
+            os.remove(os.path.join(temporary, name))
+        os.rmdir(temporary)
+
+def load(directory: str) -> CompiledScene:
+    """Loads a compiled scene with its arrays memory mapped, so only the parts
+    that are used are read from the disk
+    """
+    arrays = {
+        field: np.load(os.path.join(directory, field + ".npy"), mmap_mode="r")
+        for field in ARRAY_FIELDS
+    }
+    with open(os.path.join(directory, "text.json")) as file:
+        text = json.load(file)
+    return CompiledScene(text=text, **arrays)
+
+def file_hash(filename: str) -> str:
+    """Hashes the contents of a file together with FORMAT_VERSION
+    """
+    digest = hashlib.sha256(f"scene cache {FORMAT_VERSION}\n".encode())
+    with open(filename, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def load_or_compile(filename: str, cache_dir: str) -> CompiledScene:
+    """Loads the compiled scene of a file from cache_dir, or compiles and saves it
+    if the file has not been seen before. Scenes are stored under the hash of the
+    file, so editing the file makes a new entry.
+    """
+    directory = os.path.join(cache_dir, file_hash(filename))
+    if not os.path.isdir(directory):
+        with open(filename, "r") as file:
+            # the first line is the image info, which is read from the file every time
+            file.readline()
+            save(compile_lines(file), directory)
+    return load(directory)
+
+def _add_vertices(positions: np.ndarray, image: np.ndarray, draw_data: utils.DrawData) -> None:
+    draw_data.vertex_list.extend(positions, draw_data.color)
+
+def _set_color(r: float, g: float, b: float, a: float, image: np.ndarray, draw_data: utils.DrawData) -> None:
+    draw_data.color = utils.RGBFloat(r, g, b, a)
+
+def _draw_triangle(indexes: "list[int]", gouraud: bool, image: np.ndarray, draw_data: utils.DrawData) -> None:
+    i1, i2, i3 = map(draw_data.vertex_list.resolve_index, indexes)
+    three_d.draw_3d_triangle(image, draw_data, i1, i2, i3, gouraud=gouraud)
+
+def _draw_line(indexes: "list[int]", gouraud: bool, image: np.ndarray, draw_data: utils.DrawData) -> None:
+    i1, i2 = map(draw_data.vertex_list.resolve_index, indexes)
+    three_d.draw_3d_line(image, draw_data, i1, i2, gouraud=gouraud)
+
+def _draw_batch(ranges: np.ndarray, keyword: str, image: np.ndarray, draw_data: utils.DrawData) -> None:
+    triangles, gouraud = file_parse.BATCH_COMMANDS[keyword]
+    indexes = draw_data.vertex_list.resolve_ranges(ranges[:, 0], ranges[:, 1])
+    three_d.draw_3d_triangles(image, draw_data, triangles(indexes), gouraud=gouraud)
+
+def _set_cull_face(face: str, image: np.ndarray, draw_data: utils.DrawData) -> None:
+    draw_data.cull_face = face
+
+def _commands(scene: CompiledScene, chunk_size: int = 4096) -> "Iterator[list[str] | Callable[[np.ndarray, utils.DrawData], None]]":
+    """Turns the command stream back into commands for file_parse.run_commands,
+    reading it a chunk at a time
+    """
+    # Plain arrays over the same memory, slicing a np.memmap is much slower
+    commands = scene.commands.view(np.ndarray)
+    positions = scene.positions.view(np.ndarray)
+    colors = scene.colors.view(np.ndarray)
+    ranges = scene.ranges.view(np.ndarray)
+    for chunk_start in range(0, len(commands), chunk_size):
+        for opcode, a, b, c in commands[chunk_start:chunk_start + chunk_size].tolist():
+            if opcode == OP_XYZ:
+                yield functools.partial(_add_vertices, positions[a:a + b])
+            elif opcode == OP_COLOR:
+                yield functools.partial(_set_color, *colors[a].tolist())
+            elif opcode == OP_TRIF or opcode == OP_TRIG:
+                yield functools.partial(_draw_triangle, [a, b, c], opcode == OP_TRIG)
+            elif opcode == OP_LINE or opcode == OP_LINEG:
+                yield functools.partial(_draw_line, [a, b], opcode == OP_LINEG)
+            elif opcode == OP_BATCH:
+                yield functools.partial(_draw_batch, ranges[a:a + b], BATCH_KEYWORDS[c])
+            elif opcode == OP_LOADMV:
+                yield lambda image, draw_data, matrix=np.array(scene.matrices[a]): draw_data.set_model_view(matrix)
+            elif opcode == OP_LOADP:
+                yield lambda image, draw_data, matrix=np.array(scene.matrices[a]): draw_data.set_projection(matrix)
+            elif opcode == OP_MULTMV:
+                yield lambda image, draw_data, matrix=np.array(scene.matrices[a]): draw_data.multiply_model_view(matrix)
+            elif opcode == OP_CULL:
+                yield functools.partial(_set_cull_face, CULL_FACES[a])
+            elif opcode == OP_FRAME:
+                yield ["frame", str(a)]
+            elif opcode == OP_TEXT:
+                yield scene.text[a]
+            else:
+                raise Exception("unknown opcode in compiled scene", opcode)
+
+def block_images(scene: CompiledScene) -> "list[int]":
+    """Finds the image each block of a compiled scene draws into, like
+    frames.block_images
+    """
+    commands = scene.commands.view(np.ndarray)
+    return [0] + commands[commands[:, 0] == OP_FRAME, 1].tolist()
+
+def replay(scene: CompiledScene, images: "list[np.ndarray]", draw_data: utils.DrawData, end_frame: "Callable[[np.ndarray, utils.DrawData], None] | None" = None) -> file_parse.ParseStats:
+    """Draws a compiled scene exactly like file_parse.parse_lines draws the lines
+    it was compiled from, without parsing any text
+    """
+    return file_parse.run_commands(_commands(scene), images, draw_data, end_frame)
@@ -0,0 +1,76 @@
+import dataclasses
+import json
+from typing import TextIO
+
+
+@dataclasses.dataclass
+class RenderStats():
+    """Counts and times the work done while rendering. Nothing is counted unless a
+    RenderStats is given to the drawing functions, so rendering without one costs
+    nothing extra.
+    \b triangles_submitted: triangles given to trif or trig
+    \b triangles_culled: triangles thrown away before rasterizing, including the ones that are off of the screen
+    \b lines_submitted: lines given to line or lineg
+    \b lines_culled: lines thrown away before rasterizing
+    \b fragments_generated: fragments made by the rasterizer, which only makes fragments that are on the screen
+    \b fragments_rejected_near_far: fragments with a z outside of near and far
+    \b fragments_rejected_depth: fragments that failed the depth test
+    \b pixels_written: fragments written into the color and depth buffers
+    \b transform_seconds: time spent transforming and culling triangles
+    \b rasterize_seconds: time spent making fragments and testing them against near and far
+    \b depth_test_seconds: time spent on the depth test and writing pixels
+    \b save_seconds: time spent encoding and saving images that drawing had to wait for
+    \b parse_seconds: time spent parsing lines and running their commands, without the time of the stages above
+    \b frames_cached: frames copied from the frame cache instead of being drawn
+    \b frame_seconds: the time spent drawing each block of lines between frame keywords, in the order they were drawn
+    """
+    triangles_submitted: int = 0
+    triangles_culled: int = 0
+    lines_submitted: int = 0
+    lines_culled: int = 0
+    fragments_generated: int = 0
+    fragments_rejected_near_far: int = 0
+    fragments_rejected_depth: int = 0
+    pixels_written: int = 0
+    transform_seconds: float = 0.0
+    rasterize_seconds: float = 0.0
+    depth_test_seconds: float = 0.0
+    save_seconds: float = 0.0
+    parse_seconds: float = 0.0
+    frames_cached: int = 0
+    frame_seconds: "list[float]" = dataclasses.field(default_factory=list)
+
+    def add(self, other: "RenderStats") -> None:
+        for field in dataclasses.fields(self):
+            setattr(self, field.name, getattr(self, field.name) + getattr(other, field.name))
+
+    @property
+    def stage_seconds(self) -> float:
+        """The time spent in the transform, rasterize, depth test and save stages
+        """
+        return self.transform_seconds + self.rasterize_seconds + self.depth_test_seconds + self.save_seconds
+
+    def report(self, file: TextIO) -> None:
+        """Writes a human readable summary
+        """
+        frames = len(self.frame_seconds)
+        frame_total = sum(self.frame_seconds)
+        print(
+            f"triangles: {self.triangles_submitted} submitted, {self.triangles_culled} culled\n"
+            + (f"lines: {self.lines_submitted} submitted, {self.lines_culled} culled\n" if self.lines_submitted else "")
+            + f"fragments: {self.fragments_generated} generated, "
+            f"{self.fragments_rejected_near_far} outside near/far, "
+            f"{self.fragments_rejected_depth} failed the depth test, "
+            f"{self.pixels_written} pixels written\n"
+            f"time: transform {self.transform_seconds:.3f}s, rasterize {self.rasterize_seconds:.3f}s, "
+            f"depth test {self.depth_test_seconds:.3f}s, save {self.save_seconds:.3f}s, "
+            f"parse {self.parse_seconds:.3f}s\n"
+            f"frames: {frames} drawn in {frame_total:.3f}s"
+            + (f" ({frame_total / frames * 1000:.1f}ms per frame, slowest {max(self.frame_seconds) * 1000:.1f}ms)" if frames else "")
+            + (f", {self.frames_cached} copied from the frame cache" if self.frames_cached else ""),
+            file=file
+        )
+
+    def write_json(self, filename: str) -> None:
+        with open(filename, "w") as file:
+            json.dump(dataclasses.asdict(self), file, indent=2)
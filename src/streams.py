@@ -0,0 +1,257 @@
+import collections
+import concurrent.futures
+import contextlib
+import os
+import struct
+import sys
+import time
+import zlib
+from typing import BinaryIO, Callable, Iterator
+
+import numpy as np
+
+import src.framebuffer as framebuffer
+import src.utils as utils
+
+
+# The formats that stream every frame into one output instead of a file per image
+STREAM_FORMATS = ("apng", "rgba")
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+def png_chunk(chunk_type: bytes, data: bytes) -> bytes:
+    """Makes a png chunk: the length of the data, the type, the data and the CRC
+    of the type and the data
+    """
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+def filter_rows(color_buffer: np.ndarray) -> bytes:
+    """Prefixes every row of an RGBA color buffer with the png "Up" filter, which
+    stores the difference with the row above. Rows that are the same as the one
+    above, which are common in rendered images, become zeros that compress well.
+    """
+    height, width = color_buffer.shape[:2]
+    rows = color_buffer.reshape(height, width * 4)
+    filtered = np.empty((height, width * 4 + 1), dtype=np.uint8)
+    filtered[:, 0] = 2
+    filtered[0, 1:] = rows[0]
+    np.subtract(rows[1:], rows[:-1], out=filtered[1:, 1:])
+    return filtered.tobytes()
+
+class ApngWriter():
+    """Writes frames into one animated png as they are given. Every frame after
+    the first only stores the rectangle that changed since the frame before it,
+    and the rest of the frame is kept from the one before.
+
+    Args:
+        file (BinaryIO): where the png is written, which does not have to be seekable
+        width (int): the width of the frames
+        height (int): the height of the frames
+        number_of_frames (int): the number of frames that will be written
+        fps (int): the frames per second the animation plays at
+        compress_level (int, optional): the zlib level from 0 to 9, 6 if it is not given
+    """
+    def __init__(self, file: BinaryIO, width: int, height: int, number_of_frames: int, fps: int = 24, compress_level: "int | None" = None):
+        self.file = file
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.compress_level = 6 if compress_level is None else compress_level
+        # fcTL and fdAT chunks share one sequence of numbers
+        self._sequence = 0
+        self._previous: "np.ndarray | None" = None
+        file.write(PNG_SIGNATURE)
+        # 8 bits per channel, RGBA, no interlacing
+        file.write(png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)))
+        # loop forever
+        file.write(png_chunk(b"acTL", struct.pack(">II", number_of_frames, 0)))
+
+    def _changed_rectangle(self, color_buffer: np.ndarray) -> "tuple[int, int, int, int]":
+        if self._previous is None:
+            return 0, 0, self.width, self.height
+        changed = (color_buffer != self._previous).any(axis=2)
+        rows = np.flatnonzero(changed.any(axis=1))
+        if len(rows) == 0:
+            # a frame has to cover at least one pixel
+            return 0, 0, 1, 1
+        columns = np.flatnonzero(changed.any(axis=0))
+        return int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1
+
+    def write_frame(self, color_buffer: np.ndarray) -> None:
+        x_min, y_min, x_max, y_max = self._changed_rectangle(color_buffer)
+        # no dispose and the source blend op, so the rectangle replaces what was there
+        self.file.write(png_chunk(b"fcTL", struct.pack(
+            ">IIIIIHHBB", self._sequence,
+            x_max - x_min, y_max - y_min, x_min, y_min,
+            1, self.fps, 0, 0
+        )))
+        self._sequence += 1
+        data = zlib.compress(filter_rows(color_buffer[y_min:y_max, x_min:x_max]), self.compress_level)
+        # the frame is copied, so the buffer can be reused once this returns
+        if self._previous is None:
+            self.file.write(png_chunk(b"IDAT", data))
+            self._previous = color_buffer.copy()
+        else:
+            self.file.write(png_chunk(b"fdAT", struct.pack(">I", self._sequence) + data))
+            self._sequence += 1
+            np.copyto(self._previous, color_buffer)
+
+    def close(self) -> None:
+        self.file.write(png_chunk(b"IEND", b""))
+        self.file.flush()
+
+class RawWriter():
+    """Writes the bytes of every frame one after another, height rows of width
+    RGBA pixels each, for a video encoder reading from a pipe
+    """
+    def __init__(self, file: BinaryIO):
+        self.file = file
+
+    def write_frame(self, color_buffer: np.ndarray) -> None:
+        self.file.write(color_buffer.data)
+
+    def close(self) -> None:
+        self.file.flush()
+
+def output_filename(image_info: utils.ImageInfo, stream_format: str) -> str:
+    """The default output of a stream: the png file named in the input file for
+    apng, and stdout, named "-", for rgba
+    """
+    if stream_format == "rgba":
+        return "-"
+    return image_info.filename if image_info.is_single_file else image_info.filename + ".png"
+
+@contextlib.contextmanager
+def exit_on_broken_pipe() -> Iterator[None]:
+    """Exits with status 1 instead of printing a traceback when the reader of a
+    stream, like a video encoder that only wanted the first frames, closes it early
+    """
+    try:
+        yield
+    except BrokenPipeError:
+        # Python flushes stdout again when it exits, which would raise once more
+        devnull = os.open(os.devnull, os.O_WRONLY)
+        os.dup2(devnull, sys.stdout.fileno())
+        sys.exit(1)
+
+class FrameStream():
+    """Stands in for the list of images of file_parse.run_commands and streams
+    the frames into a writer as they finish, so only the frame being drawn is
+    kept in memory instead of every image of the file.
+
+    A frame is finished when drawing moves on to a later frame, and frames that
+    are never drawn into are written as transparent frames. Frames have to be
+    drawn in order, going back to a frame that was already written raises an
+    Exception. Frames are written on a background thread while the next one is
+    drawn, with at most 2 waiting.
+
+    It has the end_frame and after methods of image_writer.FrameWriter, so it can
+    be used in its place.
+
+    Args:
+        output (str): the file or named pipe to write to, or "-" for stdout
+        stream_format (str): "apng" or "rgba"
+        image_info (utils.ImageInfo): the size and number of the frames
+        fps (int): the frames per second of an apng
+        compress_level (int, optional): the zlib level of an apng
+        premultiplied (bool): the frames hold premultiplied colors, which are
+            turned back into straight alpha before they are written
+    """
+    def __init__(self, output: str, stream_format: str, image_info: utils.ImageInfo, fps: int = 24, compress_level: "int | None" = None, premultiplied: bool = False):
+        if stream_format not in STREAM_FORMATS:
+            raise Exception("unknown stream format", stream_format)
+        self.number_of_images = image_info.number_of_images
+        self.premultiplied = premultiplied
+        self.file: BinaryIO = sys.stdout.buffer if output == "-" else open(output, "wb")
+        if stream_format == "apng":
+            self.writer = ApngWriter(self.file, image_info.width, image_info.height, self.number_of_images, fps, compress_level)
+        else:
+            self.writer = RawWriter(self.file)
+        self.image = np.zeros((image_info.height, image_info.width, 4), dtype=np.uint8)
+        # the index of the frame in self.image
+        self.index = 0
+        # the seconds spent encoding and writing on the background thread
+        self.encode_seconds = 0.0
+        # the seconds drawing spent waiting for frames to be written
+        self.wait_seconds = 0.0
+        self._blank: "np.ndarray | None" = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._pending: "collections.deque[concurrent.futures.Future]" = collections.deque()
+        # the copies of finished frames are reused once they are written
+        self.pool = framebuffer.BufferPool(max_free=3)
+
+    def __len__(self) -> int:
+        return self.number_of_images
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        if not 0 <= index < self.number_of_images:
+            raise IndexError("frame index out of range", index)
+        if index < self.index:
+            raise Exception("frames have to be drawn in order when they are streamed", index)
+        if index > self.index:
+            self._submit(self.pool.copy(self.image))
+            for _ in range(self.index + 1, index):
+                self._submit(self._blank_frame())
+            self.image[:] = 0
+            self.index = index
+        return self.image
+
+    def _blank_frame(self) -> np.ndarray:
+        if self._blank is None:
+            self._blank = np.zeros_like(self.image)
+        return self._blank
+
+    def _write(self, color_buffer: np.ndarray) -> None:
+        start = time.perf_counter()
+        if self.premultiplied and color_buffer is not self._blank:
+            framebuffer.unpremultiply(color_buffer)
+        self.writer.write_frame(color_buffer)
+        if color_buffer is not self._blank and color_buffer is not self.image:
+            self.pool.give(color_buffer)
+        self.encode_seconds += time.perf_counter() - start
+
+    def _submit(self, color_buffer: np.ndarray) -> None:
+        while len(self._pending) >= 2:
+            start = time.perf_counter()
+            self._pending.popleft().result()
+            self.wait_seconds += time.perf_counter() - start
+        self._pending.append(self._executor.submit(self._write, color_buffer))
+
+    def end_frame(self, image: np.ndarray, draw_data: utils.DrawData) -> None:
+        """Does nothing, the frame is written when drawing moves past it since a
+        later block can still draw into it
+        """
+
+    def after(self, render: "Callable[[np.ndarray, utils.DrawData], None]") -> "Callable[[np.ndarray, utils.DrawData], None]":
+        return render
+
+    def close(self) -> None:
+        """Writes the last frame that was drawn and the blank frames after it, and
+        finishes the output
+        """
+        start = time.perf_counter()
+        try:
+            self._submit(self.image)
+            for _ in range(self.index + 1, self.number_of_images):
+                self._submit(self._blank_frame())
+            for future in self._pending:
+                future.result()
+            self.writer.close()
+        finally:
+            self._executor.shutdown()
+            if self.file is not sys.stdout.buffer:
+                self.file.close()
+            self.wait_seconds += time.perf_counter() - start
+
+    def __enter__(self) -> "FrameStream":
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            for future in self._pending:
+                future.cancel()
+            self._executor.shutdown()
+            if self.file is not sys.stdout.buffer:
+                self.file.close()
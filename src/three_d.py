@@ -1,66 +1,383 @@
-import copy
+import time
 
 import numpy as np
-from PIL import Image
 
+import src.framebuffer as framebuffer
+import src.hiz as hiz
 import src.lines as lines
+import src.stats as stats
 import src.utils as utils
 import src.vertex as vertex
 
 
-def transform_vertex(point: vertex.Vertex, draw_data: utils.DrawData) -> vertex.Vertex:
-    """Ideas for this were taken from http://www.songho.ca/opengl/gl_transform.html
+def transform_vertices(draw_data: utils.DrawData, indexes: "np.ndarray | None" = None) -> np.ndarray:
+    """Transforms vertexes of draw_data.vertex_list into screen space. Ideas for
+    this were taken from http://www.songho.ca/opengl/gl_transform.html
+
+    projection * model_view is only computed once per change to the matrices and
+    the results are kept in draw_data's post-transform cache, so each vertex is
+    transformed once per matrix no matter how many triangles use it. Only the
+    vertexes that are asked for and are not cached under the current matrices are
+    transformed, together in a single batch, so changing a matrix costs nothing
+    until a vertex is used.
 
     Args:
-        image (Image): The image we will add the pixel to
-        point (vertex.Vertex): The point to be added
         draw_data (utils.DrawData): Data needed to draw the image
+        indexes (np.ndarray, optional): zero based indexes of the vertexes, in any
+            shape. Every vertex is transformed when this is not given.
+
+    Returns:
+        np.ndarray: indexes.shape + (4,) array of (x, y, z, w) where x and y are
+        pixel coordinates, z has been divided by w and w is the clip space w
     """
-    copy_point = copy.deepcopy(point)
-    # Apply the model view transformations
-    eye_coordinates: np.ndarray = np.matmul(draw_data.model_view, copy_point.position_data())
-    # Apply the projection matrix
-    clip_coordinates = np.matmul(draw_data.projection, eye_coordinates)
-    # divide each x, y, and z by w
-    copy_point.x = clip_coordinates[0] / clip_coordinates[3]
-    copy_point.y = clip_coordinates[1] / clip_coordinates[3]
-    copy_point.z = clip_coordinates[2] / clip_coordinates[3]
-    copy_point.w = clip_coordinates[3]
-    # apply a viewport transformation
-    copy_point.x = (copy_point.x + 1) * draw_data.width/2
-    copy_point.y = (copy_point.y + 1) * draw_data.height/2
-    return copy_point
-
-def draw_3d_triangle(image: Image, draw_data: utils.DrawData, i1: vertex.Vertex, i2: vertex.Vertex, i3: vertex.Vertex, gouraud: bool = False):
-    # First, transform the vertexes provided
-    p1 = transform_vertex(i1, draw_data)
-    p2 = transform_vertex(i2, draw_data)
-    p3 = transform_vertex(i3, draw_data)
-
-    # Rasterize the triangle into fragments, interpolating a z value 
-    # (and other values as extras require) for each pixel. 
-    verts: list[vertex.Vertex] = lines.triangle_fill(p1, p2, p3, width=draw_data.width, height=draw_data.height)
-    # Only continue with those pixels that are on the screen and 
-    # have z between 0 and 1. 
-    for vert in verts:
-        # check x
-        if not 0 <= vert.x < draw_data.width:
-            continue
-        # check y
-        if not 0 <= vert.y < draw_data.height:
-            continue
-        # check z bounds
-        if not draw_data.near <= vert.z <= draw_data.far:
-            continue
-        # check depth buffer
-        if draw_data.depth_buffer[(int(vert.y), int(vert.x))] < vert.z:
+    verts: vertex.VertexBuffer = draw_data.vertex_list
+    if indexes is None:
+        indexes = np.arange(len(verts))
+    indexes = np.asarray(indexes, dtype=np.int64)
+    if draw_data.mvp is None:
+        draw_data.mvp = np.matmul(draw_data.projection, draw_data.model_view)
+    capacity = len(verts.positions)
+    if len(draw_data.transformed) < capacity:
+        cached = len(draw_data.transformed)
+        transformed = np.empty((capacity, 4))
+        transformed[:cached] = draw_data.transformed
+        transformed_epoch = np.full(capacity, -1, dtype=np.int64)
+        transformed_epoch[:cached] = draw_data.transformed_epoch
+        draw_data.transformed, draw_data.transformed_epoch = transformed, transformed_epoch
+    stale = indexes[draw_data.transformed_epoch[indexes] != draw_data.transform_epoch]
+    if len(stale):
+        stale = np.unique(stale)
+        # Apply the model view and projection matrices to every stale vertex at once
+        clip_coordinates = np.matmul(verts.positions[stale], draw_data.mvp.T)
+        w = clip_coordinates[:, 3]
+        screen = np.empty((len(stale), 4))
+        # divide each x, y, and z by w
+        screen[:, :3] = clip_coordinates[:, :3] / w[:, np.newaxis]
+        screen[:, 3] = w
+        # apply a viewport transformation
+        screen[:, 0] = (screen[:, 0] + 1) * draw_data.width/2
+        screen[:, 1] = (screen[:, 1] + 1) * draw_data.height/2
+        draw_data.transformed[stale] = screen
+        draw_data.transformed_epoch[stale] = draw_data.transform_epoch
+    return draw_data.transformed[indexes]
+
+def screen_vertices(draw_data: utils.DrawData, indexes: "list[int]") -> np.ndarray:
+    """Returns transformed vertexes laid out like Vertex.as_ndarray
+    (x, y, z, w, r, g, b, a), one row per index
+    """
+    return np.concatenate((transform_vertices(draw_data, indexes), draw_data.vertex_list.colors[indexes]), axis=1)
+
+def screen_vertex(draw_data: utils.DrawData, index: int) -> np.ndarray:
+    """Returns a transformed vertex laid out like Vertex.as_ndarray
+    (x, y, z, w, r, g, b, a)
+    """
+    return screen_vertices(draw_data, [index])[0]
+
+def draw_screen_triangle(image: np.ndarray, depth_buffer: np.ndarray, p1: np.ndarray, p2: np.ndarray, p3: np.ndarray, color: "utils.RGB | None", near: float, far: float, region: "tuple[int, int, int, int] | None" = None, hiz: "hiz.HierarchicalZ | None" = None, stats: "stats.RenderStats | None" = None, blend: str = "replace"):
+    """Rasterizes a triangle that is already in screen space and writes the
+    fragments that pass the near/far and depth tests into image and depth_buffer.
+
+    Args:
+        p1, p2, p3 (np.ndarray): points laid out like Vertex.as_ndarray
+        color (utils.RGB | None): the flat color of the triangle, None for gouraud shading
+        region (tuple[int, int, int, int], optional): only draw pixels inside of
+            (x_min, y_min, x_max, y_max)
+        hiz (hiz.HierarchicalZ, optional): a pyramid over depth_buffer used to skip
+            the parts of the triangle that are hidden. It is kept up to date.
+        stats (stats.RenderStats, optional): counts the fragments and times the
+            rasterize and depth test stages
+        blend (str): how the fragments are combined with image, one of
+            framebuffer.BLEND_MODES
+    """
+    height, width = depth_buffer.shape
+    bounds = lines.triangle_bounds(p1, p2, p3, width, height, region)
+    if bounds is None:
+        return
+    regions = [bounds]
+    if hiz is not None:
+        # Skip the whole triangle, or the blocks of it, that are behind what is already drawn
+        regions = hiz.visible_regions(min(p1[2], p2[2], p3[2]), bounds)
+    written = 0
+    for visible_region in regions:
+        # Rasterize the triangle into fragments, interpolating a z value
+        # (and other values as extras require) for each pixel. Only pixels
+        # that are on the screen are produced.
+        if stats is not None:
+            start = time.perf_counter()
+        fragments: vertex.Fragments = lines.rasterize_triangle(
+            p1, p2, p3,
+            width=width, height=height, region=visible_region,
+            # gouraud colors are interpolated perspective correctly
+            perspective_correct=color is None
+        )
+        generated = len(fragments)
+        # Only continue with those pixels that have z between 0 and 1.
+        fragments = fragments.select((near <= fragments.z) & (fragments.z <= far))
+        if stats is not None:
+            middle = time.perf_counter()
+        # Check each pixel's z against the depth buffer, then set the pixel and depth buffer values
+        region_written = framebuffer.write_fragments(image, depth_buffer, fragments, color, blend)
+        written += region_written
+        if stats is not None:
+            stats.rasterize_seconds += middle - start
+            stats.depth_test_seconds += time.perf_counter() - middle
+            stats.fragments_generated += generated
+            stats.fragments_rejected_near_far += generated - len(fragments)
+            stats.fragments_rejected_depth += len(fragments) - region_written
+            stats.pixels_written += region_written
+    if hiz is not None and written:
+        hiz.update(bounds)
+
+# Triangles with a bounding box of at most this many pixels are rasterized
+# together by draw_screen_triangles, bigger ones are rasterized on their own
+SMALL_TRIANGLE_PIXELS = 4096
+# The most bounding box pixels draw_screen_triangles rasterizes in one pass
+MAX_BATCH_PIXELS = 1 << 18
+
+def _draw_small_triangles(image: np.ndarray, depth_buffer: np.ndarray, points: np.ndarray, color: "utils.RGB | None", near: float, far: float, hiz: "hiz.HierarchicalZ | None", stats: "stats.RenderStats | None", blend: str):
+    if stats is not None:
+        start = time.perf_counter()
+    height, width = depth_buffer.shape
+    fragments, _ = lines.rasterize_triangles(points, width, height, perspective_correct=color is None)
+    generated = len(fragments)
+    fragments = fragments.select((near <= fragments.z) & (fragments.z <= far))
+    if stats is not None:
+        middle = time.perf_counter()
+    written = framebuffer.write_fragments_in_order(image, depth_buffer, fragments, color, blend)
+    if stats is not None:
+        stats.rasterize_seconds += middle - start
+        stats.depth_test_seconds += time.perf_counter() - middle
+        stats.fragments_generated += generated
+        stats.fragments_rejected_near_far += generated - len(fragments)
+        stats.fragments_rejected_depth += len(fragments) - written
+        stats.pixels_written += written
+    if hiz is not None and written:
+        hiz.update((int(fragments.x.min()), int(fragments.y.min()), int(fragments.x.max()) + 1, int(fragments.y.max()) + 1))
+
+def draw_screen_triangles(image: np.ndarray, depth_buffer: np.ndarray, points: np.ndarray, color: "utils.RGB | None", near: float, far: float, hiz: "hiz.HierarchicalZ | None" = None, stats: "stats.RenderStats | None" = None, blend: str = "replace"):
+    """Draws a batch of triangles that are already in screen space, with the same
+    result as calling draw_screen_triangle on each of them in order. Runs of small
+    triangles are rasterized and depth tested together, which is much faster
+    than drawing them one at a time.
+
+    Args:
+        points (np.ndarray): (n, 3, 8) screen space points of each triangle
+    """
+    height, width = depth_buffer.shape
+    x, y = points[:, :, 0], points[:, :, 1]
+    pixels = (
+        np.clip(np.ceil(x.max(axis=1)), 0, width) - np.clip(np.ceil(x.min(axis=1)), 0, width)
+    ) * (
+        np.clip(np.ceil(y.max(axis=1)), 0, height) - np.clip(np.ceil(y.min(axis=1)), 0, height)
+    )
+    # triangles with a nan or infinite coordinate are left to draw_screen_triangle
+    small = (pixels <= SMALL_TRIANGLE_PIXELS) & np.isfinite(points[:, :, :4]).all(axis=(1, 2))
+    batch_start = 0
+    batch_pixels = 0
+    for index in range(len(points)):
+        if small[index] and batch_pixels + pixels[index] <= MAX_BATCH_PIXELS:
+            batch_pixels += pixels[index]
             continue
-        # Set the pixel and depth buffer values
-        pixel = vert.as_pixel()
-        draw_data.depth_buffer[(pixel.y, pixel.x)] = vert.z
-        if gouraud:
-            color: utils.RGB = utils.RGB(pixel.r, pixel.g, pixel.b)
+        if batch_start < index:
+            _draw_small_triangles(image, depth_buffer, points[batch_start:index], color, near, far, hiz, stats, blend)
+        if small[index]:
+            batch_start, batch_pixels = index, pixels[index]
         else:
-            color: utils.RGB = draw_data.color.as_rgb(rounded=True)
+            p1, p2, p3 = points[index]
+            draw_screen_triangle(image, depth_buffer, p1, p2, p3, color, near, far, hiz=hiz, stats=stats, blend=blend)
+            batch_start, batch_pixels = index + 1, 0
+    if batch_start < len(points):
+        _draw_small_triangles(image, depth_buffer, points[batch_start:], color, near, far, hiz, stats, blend)
+
+def draw_screen_line(image: np.ndarray, depth_buffer: np.ndarray, p1: np.ndarray, p2: np.ndarray, color: "utils.RGB | None", near: float, far: float, region: "tuple[int, int, int, int] | None" = None, stats: "stats.RenderStats | None" = None, blend: str = "replace"):
+    """Rasterizes a line that is already in screen space and writes the fragments
+    that pass the near/far and depth tests into image and depth_buffer, like
+    draw_screen_triangle does for triangles.
+
+    Args:
+        p1, p2 (np.ndarray): points laid out like Vertex.as_ndarray
+        color (utils.RGB | None): the flat color of the line, None to interpolate
+            the colors of the points
+    """
+    height, width = depth_buffer.shape
+    if stats is not None:
+        start = time.perf_counter()
+    fragments = lines.dda_batch(p1[np.newaxis], p2[np.newaxis], width=width, height=height, region=region)
+    generated = len(fragments)
+    fragments = fragments.select((near <= fragments.z) & (fragments.z <= far))
+    if stats is not None:
+        middle = time.perf_counter()
+    written = framebuffer.write_fragments(image, depth_buffer, fragments, color, blend)
+    if stats is not None:
+        stats.rasterize_seconds += middle - start
+        stats.depth_test_seconds += time.perf_counter() - middle
+        stats.fragments_generated += generated
+        stats.fragments_rejected_near_far += generated - len(fragments)
+        stats.fragments_rejected_depth += len(fragments) - written
+        stats.pixels_written += written
+
+def cull_line(draw_data: utils.DrawData, p1: np.ndarray, p2: np.ndarray) -> bool:
+    """Decides if a transformed line can be thrown away before it is rasterized,
+    because it is in front of near, behind far, off of the screen or has an end
+    point that is not finite because its w is 0
+    """
+    if not np.isfinite((p1[:3], p2[:3])).all():
+        return True
+    if max(p1[2], p2[2]) < draw_data.near or min(p1[2], p2[2]) > draw_data.far:
+        return True
+    return lines.line_bounds(p1, p2, draw_data.width, draw_data.height) is None
 
-        image.im.putpixel((pixel.x, pixel.y), (color.r, color.g, color.b, color.a))
+def draw_3d_line(image: np.ndarray, draw_data: utils.DrawData, i1: int, i2: int, gouraud: bool = False):
+    """Draws the line between the vertexes at the zero based indexes i1 and i2 of
+    draw_data.vertex_list. When draw_data has a display list the transformed line
+    is added to it instead of being drawn.
+    """
+    render_stats = draw_data.stats
+    if render_stats is not None:
+        render_stats.lines_submitted += 1
+        start = time.perf_counter()
+    p1, p2 = screen_vertices(draw_data, [i1, i2])
+    culled = cull_line(draw_data, p1, p2)
+    if render_stats is not None:
+        render_stats.transform_seconds += time.perf_counter() - start
+        render_stats.lines_culled += culled
+    if culled:
+        return
+    color = None if gouraud else draw_data.color.as_rgb(rounded=True)
+    if draw_data.display_list is not None:
+        draw_data.display_list.append((np.stack((p1, p2)), color))
+        return
+    draw_screen_line(image, draw_data.depth_buffer, p1, p2, color, draw_data.near, draw_data.far, stats=render_stats, blend=draw_data.blend)
+
+def cull_triangle(draw_data: utils.DrawData, p1: np.ndarray, p2: np.ndarray, p3: np.ndarray) -> bool:
+    """Decides in constant time if a transformed triangle can be thrown away before
+    it is rasterized because none of its fragments could be drawn. That is the case
+    when it is completely off of the screen, in front of near or behind far, has
+    no area, or has a point that is not finite because its w is 0. Back or front
+    faces are also thrown away when draw_data.cull_face asks for it.
+
+    The sign of w is not used to find triangles behind the camera, since projection
+    matrices like the one in hw2loadp give visible points a negative w. Points
+    behind the camera end up outside of near and far instead.
+
+    Args:
+        p1, p2, p3 (np.ndarray): screen space points laid out like Vertex.as_ndarray
+
+    Returns:
+        bool: true if the triangle should not be drawn
+    """
+    # a w of 0 divides to infinity or nan, and none of those fragments pass the z test
+    if not np.isfinite((p1[:3], p2[:3], p3[:3])).all():
+        return True
+    # outside of the z range, fragment z values are always between the z values of the points
+    z_values = (p1[2], p2[2], p3[2])
+    if max(z_values) < draw_data.near or min(z_values) > draw_data.far:
+        return True
+    # off of the screen
+    if lines.triangle_bounds(p1, p2, p3, draw_data.width, draw_data.height) is None:
+        return True
+    # Front faces wind counter-clockwise in normalized device coordinates, like
+    # OpenGL's default. The viewport transform keeps the sign of the area.
+    area = lines.edge_function(p1, p2, p3[0], p3[1])
+    if area == 0:
+        return True
+    if draw_data.cull_face == "back":
+        return area < 0
+    if draw_data.cull_face == "front":
+        return area > 0
+    return False
+
+def cull_triangles(draw_data: utils.DrawData, points: np.ndarray) -> np.ndarray:
+    """Runs cull_triangle on a batch of triangles at once
+
+    Args:
+        points (np.ndarray): (n, 3, 8) screen space points of each triangle
+
+    Returns:
+        np.ndarray: (n,) true for the triangles that should not be drawn
+    """
+    x, y, z = points[:, :, 0], points[:, :, 1], points[:, :, 2]
+    culled = ~np.isfinite(points[:, :, :3]).all(axis=(1, 2))
+    culled |= (z.max(axis=1) < draw_data.near) | (z.min(axis=1) > draw_data.far)
+    # the same bounds triangle_bounds finds
+    culled |= np.maximum(np.ceil(x.min(axis=1)), 0) >= np.minimum(np.ceil(x.max(axis=1)), draw_data.width)
+    culled |= np.maximum(np.ceil(y.min(axis=1)), 0) >= np.minimum(np.ceil(y.max(axis=1)), draw_data.height)
+    p1, p2, p3 = points[:, 0].T, points[:, 1].T, points[:, 2].T
+    area = lines.edge_function(p1, p2, p3[0], p3[1])
+    culled |= area == 0
+    if draw_data.cull_face == "back":
+        culled |= area < 0
+    elif draw_data.cull_face == "front":
+        culled |= area > 0
+    return culled
+
+def strip_triangles(indexes: np.ndarray) -> np.ndarray:
+    """Splits a triangle strip into triangles. Every other triangle has its first
+    two points swapped, so all of the triangles wind the same way as the first.
+
+    Returns:
+        np.ndarray: (n - 2, 3) indexes of each triangle
+    """
+    steps = np.arange(len(indexes) - 2)
+    odd = steps % 2 == 1
+    return np.stack((
+        np.where(odd, indexes[steps + 1], indexes[steps]),
+        np.where(odd, indexes[steps], indexes[steps + 1]),
+        indexes[steps + 2],
+    ), axis=1)
+
+def fan_triangles(indexes: np.ndarray) -> np.ndarray:
+    """Splits a triangle fan around its first point into triangles
+
+    Returns:
+        np.ndarray: (n - 2, 3) indexes of each triangle
+    """
+    steps = np.arange(1, len(indexes) - 1)
+    return np.stack((np.full(len(steps), indexes[0]), indexes[steps], indexes[steps + 1]), axis=1)
+
+def draw_3d_triangles(image: np.ndarray, draw_data: utils.DrawData, indexes: np.ndarray, gouraud: bool = False):
+    """Draws a batch of triangles that share the current color and matrices. The
+    vertexes are transformed, culled and rasterized together, and the images are
+    the same as drawing each triangle with draw_3d_triangle.
+
+    Args:
+        indexes (np.ndarray): (n, 3) zero based indexes into draw_data.vertex_list
+            of the points of each triangle
+    """
+    render_stats = draw_data.stats
+    if render_stats is not None:
+        render_stats.triangles_submitted += len(indexes)
+        start = time.perf_counter()
+    points = np.concatenate((transform_vertices(draw_data, indexes), draw_data.vertex_list.colors[indexes]), axis=2)
+    culled = cull_triangles(draw_data, points)
+    if render_stats is not None:
+        render_stats.transform_seconds += time.perf_counter() - start
+        render_stats.triangles_culled += int(culled.sum())
+    color = None if gouraud else draw_data.color.as_rgb(rounded=True)
+    if draw_data.display_list is not None:
+        draw_data.display_list.extend((triangle_points, color) for triangle_points in points[~culled])
+        return
+    draw_screen_triangles(image, draw_data.depth_buffer, points[~culled], color, draw_data.near, draw_data.far, hiz=draw_data.hiz, stats=render_stats, blend=draw_data.blend)
+
+def draw_3d_triangle(image: np.ndarray, draw_data: utils.DrawData, i1: int, i2: int, i3: int, gouraud: bool = False):
+    """Draws the triangle made from the vertexes at the zero based indexes i1, i2
+    and i3 of draw_data.vertex_list. When draw_data has a display list the
+    transformed triangle is added to it instead of being drawn.
+    """
+    render_stats = draw_data.stats
+    if render_stats is not None:
+        render_stats.triangles_submitted += 1
+        start = time.perf_counter()
+    # First, transform the vertexes provided
+    p1, p2, p3 = screen_vertices(draw_data, [i1, i2, i3])
+    culled = cull_triangle(draw_data, p1, p2, p3)
+    if render_stats is not None:
+        render_stats.transform_seconds += time.perf_counter() - start
+        render_stats.triangles_culled += culled
+    if culled:
+        return
+    color = None if gouraud else draw_data.color.as_rgb(rounded=True)
+    if draw_data.display_list is not None:
+        draw_data.display_list.append((np.stack((p1, p2, p3)), color))
+        return
+    draw_screen_triangle(image, draw_data.depth_buffer, p1, p2, p3, color, draw_data.near, draw_data.far, hiz=draw_data.hiz, stats=render_stats, blend=draw_data.blend)
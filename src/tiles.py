@@ -0,0 +1,189 @@
+import concurrent.futures
+import dataclasses
+import multiprocessing
+
+import numpy as np
+
+import src.hiz as hiz
+import src.stats as stats
+import src.three_d as three_d
+import src.utils as utils
+
+
+# The color and depth buffers shared with the main process, set up in each
+# worker process by _init_worker
+_shared_image: "np.ndarray | None" = None
+_shared_depth: "np.ndarray | None" = None
+
+def _init_worker(image_array, image_shape, depth_array, depth_shape, depth_dtype):
+    global _shared_image, _shared_depth
+    _shared_image = np.frombuffer(image_array, dtype=np.uint8).reshape(image_shape)
+    _shared_depth = np.frombuffer(depth_array, dtype=depth_dtype).reshape(depth_shape)
+
+@dataclasses.dataclass
+class TileJob():
+    """The triangles and lines that overlap one tile, in the order they were drawn
+    \b region: (x_min, y_min, x_max, y_max) of the tile
+    \b points: (n, 3, 8) screen space points laid out like Vertex.as_ndarray
+    \b colors: (n, 4) flat RGBA color of each triangle
+    \b gouraud: (n,) true for the triangles that use the colors of their points
+    \b is_line: (n,) true for the lines, which only use their first two points
+    \b near: the smallest z that is drawn
+    \b far: the largest z that is drawn
+    \b use_hiz: skip hidden triangles with a hierarchical z buffer over the tile
+    \b use_stats: count the fragments and time the stages of the tile
+    \b blend: how the fragments are combined with the image, one of framebuffer.BLEND_MODES
+    """
+    region: "tuple[int, int, int, int]"
+    points: np.ndarray
+    colors: np.ndarray
+    gouraud: np.ndarray
+    is_line: np.ndarray
+    near: float
+    far: float
+    use_hiz: bool = False
+    use_stats: bool = False
+    blend: str = "replace"
+
+def render_tile(job: TileJob) -> "tuple[hiz.HiZStats | None, stats.RenderStats | None]":
+    """Draws the triangles of a tile into the shared buffers of the worker process
+
+    Returns:
+        tuple[hiz.HiZStats | None, stats.RenderStats | None]: how much work the
+        hierarchical z buffer saved and the render statistics of the tile, if used
+    """
+    tile_stats = stats.RenderStats() if job.use_stats else None
+    tile_hiz = None
+    if job.use_hiz:
+        x_min, y_min, x_max, y_max = job.region
+        tile_hiz = hiz.HierarchicalZ(_shared_depth[y_min:y_max, x_min:x_max], origin=(x_min, y_min))
+    for points, color, gouraud, is_line in zip(job.points, job.colors.tolist(), job.gouraud, job.is_line):
+        if is_line:
+            three_d.draw_screen_line(
+                _shared_image, _shared_depth,
+                points[0], points[1],
+                None if gouraud else utils.RGB(*color),
+                job.near, job.far,
+                region=job.region,
+                stats=tile_stats,
+                blend=job.blend,
+            )
+            continue
+        three_d.draw_screen_triangle(
+            _shared_image, _shared_depth,
+            points[0], points[1], points[2],
+            None if gouraud else utils.RGB(*color),
+            job.near, job.far,
+            region=job.region,
+            hiz=tile_hiz,
+            stats=tile_stats,
+            blend=job.blend,
+        )
+    return (tile_hiz.stats if tile_hiz is not None else None), tile_stats
+
+def bin_triangles(points: np.ndarray, width: int, height: int, tile_size: int, is_line: "np.ndarray | None" = None) -> "list[tuple[tuple[int, int, int, int], np.ndarray]]":
+    """Finds the triangles whose screen space bounding box overlaps each tile
+
+    Args:
+        points (np.ndarray): (n, 3, 8) screen space points of each triangle
+        is_line (np.ndarray, optional): (n,) true for the lines, which are binned
+            with the bounds lines.line_bounds uses
+
+    Returns:
+        list[tuple[tuple[int, int, int, int], np.ndarray]]: the region of each tile
+        that has triangles in it, and the indexes of those triangles in order
+    """
+    # the same pixel bounds rasterize_triangle uses
+    x_min = np.ceil(points[:, :, 0].min(axis=1))
+    x_max = np.ceil(points[:, :, 0].max(axis=1))
+    y_min = np.ceil(points[:, :, 1].min(axis=1))
+    y_max = np.ceil(points[:, :, 1].max(axis=1))
+    if is_line is not None and is_line.any():
+        x_min[is_line] = np.floor(points[is_line, :, 0].min(axis=1))
+        x_max[is_line] = np.floor(points[is_line, :, 0].max(axis=1)) + 2
+        y_min[is_line] = np.floor(points[is_line, :, 1].min(axis=1))
+        y_max[is_line] = np.floor(points[is_line, :, 1].max(axis=1)) + 2
+    bins = []
+    for tile_y in range(0, height, tile_size):
+        tile_y_max = min(tile_y + tile_size, height)
+        in_row = (y_min < tile_y_max) & (y_max > tile_y)
+        for tile_x in range(0, width, tile_size):
+            tile_x_max = min(tile_x + tile_size, width)
+            overlaps = in_row & (x_min < tile_x_max) & (x_max > tile_x)
+            indexes = np.flatnonzero(overlaps)
+            if len(indexes):
+                bins.append(((tile_x, tile_y, tile_x_max, tile_y_max), indexes))
+    return bins
+
+class TileRenderer():
+    """Renders the display list of a frame by splitting the screen into tiles and
+    drawing the tiles on a pool of worker processes. The workers draw straight
+    into color and depth buffers in shared memory, so images are never sent
+    between processes. Each tile draws its triangles in the order they were
+    submitted, so the result is identical to drawing them one at a time. Lines
+    in the display list are drawn in their place between the triangles.
+
+    Use it as the end_frame callback of file_parse.parse_lines on a DrawData that
+    has a display list. When the DrawData has stats, the statistics of every tile
+    are added to them, so the rasterize and depth test times are summed over the
+    workers.
+    """
+    def __init__(self, width: int, height: int, depth_dtype: np.dtype, workers: int, tile_size: int = 64, use_hiz: bool = False):
+        self.width = width
+        self.height = height
+        self.tile_size = tile_size
+        self.use_hiz = use_hiz
+        # the work saved by the hierarchical z buffers of all the tiles
+        self.hiz_stats = hiz.HiZStats()
+        depth_dtype = np.dtype(depth_dtype)
+        image_array = multiprocessing.RawArray("B", height * width * 4)
+        depth_array = multiprocessing.RawArray("B", height * width * depth_dtype.itemsize)
+        self.image = np.frombuffer(image_array, dtype=np.uint8).reshape((height, width, 4))
+        self.depth = np.frombuffer(depth_array, dtype=depth_dtype).reshape((height, width))
+        self.executor = concurrent.futures.ProcessPoolExecutor(
+            max_workers=workers,
+            initializer=_init_worker,
+            initargs=(image_array, self.image.shape, depth_array, self.depth.shape, depth_dtype),
+        )
+
+    def render(self, image: np.ndarray, draw_data: utils.DrawData) -> None:
+        """Draws and empties the display list of draw_data
+        """
+        display_list = draw_data.display_list
+        if not display_list:
+            return
+        # lines are padded to 3 points by repeating their last point
+        points = np.stack([
+            triangle_points if len(triangle_points) == 3 else triangle_points[[0, 1, 1]]
+            for triangle_points, _ in display_list
+        ])
+        is_line = np.array([len(triangle_points) == 2 for triangle_points, _ in display_list])
+        gouraud = np.array([color is None for _, color in display_list])
+        colors = np.array([
+            (0, 0, 0, 0) if color is None else (color.r, color.g, color.b, color.a)
+            for _, color in display_list
+        ], dtype=np.uint8)
+        display_list.clear()
+
+        self.image[:] = image
+        self.depth[:] = draw_data.depth_buffer
+        jobs = [
+            TileJob(region, points[indexes], colors[indexes], gouraud[indexes], is_line[indexes], draw_data.near, draw_data.far, self.use_hiz, draw_data.stats is not None, draw_data.blend)
+            for region, indexes in bin_triangles(points, self.width, self.height, self.tile_size, is_line)
+        ]
+        for hiz_stats, tile_stats in self.executor.map(render_tile, jobs):
+            if hiz_stats is not None:
+                self.hiz_stats.add(hiz_stats)
+            if tile_stats is not None:
+                draw_data.stats.add(tile_stats)
+        image[:] = self.image
+        draw_data.depth_buffer[:] = self.depth
+
+    def close(self) -> None:
+        self.executor.shutdown()
+
+    def __enter__(self) -> "TileRenderer":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
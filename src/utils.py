@@ -1,10 +1,17 @@
+import argparse
 import dataclasses
 import math
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
-from PIL import Image
 import numpy as np
 
+import src.depth as depth
+import src.vertex as vertex
+
+if TYPE_CHECKING:
+    from src.hiz import HierarchicalZ
+    from src.stats import RenderStats
+
 
 @dataclasses.dataclass
 class ImageInfo():
@@ -59,7 +66,7 @@ class RGBFloat():
 class DrawData():
     """contains information that will need to last for the lifecycle of the image
     """
-    vertex_list: list
+    vertex_list: "vertex.VertexBuffer"
     height: int
     width: int
     model_view: np.ndarray = np.identity(4)
@@ -67,9 +74,58 @@ class DrawData():
     color: RGBFloat = RGBFloat(1.0, 1.0, 1.0)
     near = 0
     far = 1
-    depth_buffer: np.ndarray = dataclasses.field(init=False)
+    # which faces to throw away before rasterizing: "none", "back" or "front"
+    cull_face: str = "none"
+    # the precision of the depth buffer, one of depth.FORMATS
+    depth_format: str = "float64"
+    # a depth buffer to reuse, from a buffer pool, instead of making a new one.
+    # It is cleared before it is used.
+    depth_buffer: "np.ndarray | None" = None
+    # how translucent fragments are combined with the image, one of framebuffer.BLEND_MODES
+    blend: str = "replace"
+    # projection * model_view, None until it is needed after the matrices change
+    mvp: "np.ndarray | None" = dataclasses.field(init=False, default=None)
+    # post-transform cache: screen space (x, y, z, w) of each vertex of vertex_list,
+    # which is up to date when its transformed_epoch is transform_epoch
+    transformed: np.ndarray = dataclasses.field(init=False)
+    transformed_epoch: np.ndarray = dataclasses.field(init=False)
+    # bumped whenever mvp changes, which makes every cached vertex stale
+    transform_epoch: int = dataclasses.field(init=False, default=0)
+    # when this is a list, triangles are transformed and added to it as
+    # (points, color) pairs instead of being drawn right away
+    display_list: "list | None" = dataclasses.field(init=False, default=None)
+    # hierarchical z buffer over depth_buffer, used to skip hidden triangles when set
+    hiz: "HierarchicalZ | None" = dataclasses.field(init=False, default=None)
+    # counts and times the work done while drawing when set
+    stats: "RenderStats | None" = dataclasses.field(init=False, default=None)
     def __post_init__(self):
-        self.depth_buffer = np.ones((self.height, self.width))
+        if self.depth_buffer is None:
+            self.depth_buffer = depth.make_depth_buffer(self.width, self.height, self.depth_format)
+        else:
+            depth.clear(self.depth_buffer)
+        self.transformed = np.empty((0, 4))
+        self.transformed_epoch = np.empty(0, dtype=np.int64)
+
+    def set_model_view(self, model_view: np.ndarray):
+        self.model_view = model_view
+        self.invalidate_transform()
+
+    def set_projection(self, projection: np.ndarray):
+        self.projection = projection
+        self.invalidate_transform()
+
+    def multiply_model_view(self, matrix: np.ndarray):
+        """Multiplies the current model view matrix by matrix on the right
+        """
+        self.set_model_view(np.matmul(self.model_view, matrix))
+
+    def invalidate_transform(self):
+        """Throws away the combined matrix and marks every transformed vertex as
+        stale, without touching them. Must be called whenever model_view or
+        projection changes, or vertex_list is cleared.
+        """
+        self.mvp = None
+        self.transform_epoch += 1
 
     def clear(self):
         """Used to wipe info that will not cary over to the next image in the animation
@@ -78,6 +134,11 @@ class DrawData():
         self.model_view = np.identity(4)
         self.projection = np.identity(4)
         self.color = RGBFloat(1.0, 1.0, 1.0)
+        self.cull_face = "none"
+        depth.clear(self.depth_buffer)
+        if self.hiz is not None:
+            self.hiz.rebuild()
+        self.invalidate_transform()
 
 def over_operator(ca: int, cb: int, aa: int, ab, a0: int) -> int:
     return round((ca * aa + cb*ab*(1-aa))/a0)
@@ -140,10 +201,124 @@ def object_to_list(object) -> "list[Any]":
 ### STUFF FOR ARG PARSING ###
 @dataclasses.dataclass
 class CmdLineArgs():
+    """
+    \b file: the input file to render
+    \b jobs: the number of processes used to render the frames of a pngs file
+    \b verbose: print the parse throughput to stderr
+    \b tile_workers: the number of processes used to draw the tiles of each image
+    \b tile_size: the width and height of a tile in pixels
+    \b hiz: skip hidden triangles with a hierarchical z buffer
+    \b stats: print render statistics to stderr
+    \b stats_file: write render statistics to this JSON file
+    \b scene_cache: directory of compiled scenes, used to skip parsing files that were rendered before
+    \b incremental: only redraw the parts of each frame that changed since the frame before it
+    \b format: the format images are saved in, "png" or "ppm", or "apng" or "rgba" to stream every frame into one output
+    \b compression: the zlib level of png and apng files from 0 to 9, or None for the default
+    \b encode_threads: the number of threads that encode and save images while drawing goes on
+    \b output: the file or named pipe an apng or rgba stream is written to, "-" for stdout
+    \b fps: the frames per second of an apng
+    \b frame_cache: directory of saved frames, used to copy frames that were rendered before instead of drawing them
+    \b frame_cache_size: the most megabytes the frame cache can take up before the least recently used frames are removed
+    \b depth: the precision of the depth buffer, one of depth.FORMATS
+    \b blend: how translucent fragments are combined with the image, one of framebuffer.BLEND_MODES
+    """
     file: str
+    jobs: int = 1
+    verbose: bool = False
+    tile_workers: int = 1
+    tile_size: int = 64
+    hiz: bool = False
+    stats: bool = False
+    stats_file: "str | None" = None
+    scene_cache: "str | None" = None
+    incremental: bool = False
+    format: str = "png"
+    compression: "int | None" = None
+    encode_threads: int = 2
+    output: "str | None" = None
+    fps: int = 24
+    frame_cache: "str | None" = None
+    frame_cache_size: int = 1024
+    depth: str = "float64"
+    blend: str = "replace"
 
 def parse_args(args: list) -> CmdLineArgs:
-    return CmdLineArgs(file = args[1])
+    parser = argparse.ArgumentParser(prog=args[0], description="Rasterizes an input file into png images")
+    parser.add_argument("file", help="the input file to render")
+    parser.add_argument("-j", "--jobs", type=int, default=1,
+                        help="render the frames of a pngs file on this many processes")
+    parser.add_argument("-v", "--verbose", action="store_true",
+                        help="print how many lines per second were parsed to stderr")
+    parser.add_argument("-t", "--tile-workers", type=int, default=1,
+                        help="draw the tiles of each image on this many processes")
+    parser.add_argument("--tile-size", type=int, default=64,
+                        help="the width and height of a tile in pixels (default: 64)")
+    parser.add_argument("--hiz", action="store_true",
+                        help="skip hidden triangles and blocks with a hierarchical z buffer")
+    parser.add_argument("--stats", action="store_true",
+                        help="print triangle, fragment and timing statistics to stderr")
+    parser.add_argument("--stats-file",
+                        help="write triangle, fragment and timing statistics to this JSON file")
+    parser.add_argument("--scene-cache", metavar="DIR",
+                        help="compile the file into a binary scene kept in DIR, and load it from there on later runs")
+    parser.add_argument("--incremental", action="store_true",
+                        help="only redraw the parts of each frame that changed since the frame before it")
+    parser.add_argument("--format", choices=("png", "ppm", "apng", "rgba"), default="png",
+                        help="save images as png, or as uncompressed ppm for fast intermediate renders, "
+                        "or stream the frames into one animated png or as raw RGBA bytes (default: png)")
+    parser.add_argument("--compression", type=int, metavar="LEVEL",
+                        help="the zlib level of png and apng files, from 0 (fastest) to 9 (smallest)")
+    parser.add_argument("--encode-threads", type=int, default=2,
+                        help="encode and save images on this many threads while drawing goes on (default: 2)")
+    parser.add_argument("-o", "--output", metavar="PATH",
+                        help="the file or named pipe an apng or rgba stream is written to, - for stdout "
+                        "(default: the filename of the input file for apng, stdout for rgba)")
+    parser.add_argument("--fps", type=int, default=24,
+                        help="the frames per second of an apng (default: 24)")
+    parser.add_argument("--frame-cache", metavar="DIR",
+                        help="keep the rendered frames in DIR under the hash of what they are drawn from, "
+                        "and copy them from there instead of drawing frames that did not change")
+    parser.add_argument("--frame-cache-size", type=int, default=1024, metavar="MB",
+                        help="remove the least recently used frames when the frame cache is larger than this (default: 1024)")
+    parser.add_argument("--depth", choices=tuple(depth.FORMATS), default="float64",
+                        help="the precision of the depth buffer, lower precisions use less memory "
+                        "but can change which of two close triangles is in front (default: float64)")
+    parser.add_argument("--blend", choices=("replace", "over", "premultiplied"), default="replace",
+                        help="how translucent colors are drawn: replace what is under them, or are drawn over it, "
+                        "with premultiplied alpha kept in the image until it is saved (default: replace)")
+    parsed_args = parser.parse_args(args[1:])
+    if parsed_args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if parsed_args.tile_workers < 1:
+        parser.error("--tile-workers must be at least 1")
+    if parsed_args.tile_size < 1:
+        parser.error("--tile-size must be at least 1")
+    if parsed_args.compression is not None and not 0 <= parsed_args.compression <= 9:
+        parser.error("--compression must be from 0 to 9")
+    if parsed_args.compression is not None and parsed_args.format not in ("png", "apng"):
+        parser.error("--compression only applies to png and apng images")
+    if parsed_args.output is not None and parsed_args.format not in ("apng", "rgba"):
+        parser.error("--output only applies to the apng and rgba formats")
+    if parsed_args.format in ("apng", "rgba") and parsed_args.jobs > 1:
+        parser.error("--jobs can not be used with the apng and rgba formats")
+    if parsed_args.frame_cache is not None and (
+        parsed_args.tile_workers > 1 or parsed_args.incremental or parsed_args.scene_cache is not None
+        or parsed_args.format in ("apng", "rgba")
+    ):
+        parser.error("--frame-cache can not be used with --tile-workers, --incremental, --scene-cache or a streamed format")
+    if parsed_args.frame_cache_size < 0:
+        parser.error("--frame-cache-size can not be negative")
+    if not 1 <= parsed_args.fps <= 65535:
+        parser.error("--fps must be from 1 to 65535")
+    if parsed_args.encode_threads < 1:
+        parser.error("--encode-threads must be at least 1")
+    if parsed_args.jobs > 1 and parsed_args.tile_workers > 1:
+        parser.error("--jobs and --tile-workers can not be used together")
+    if parsed_args.incremental and (parsed_args.jobs > 1 or parsed_args.tile_workers > 1):
+        parser.error("--incremental can not be used with --jobs or --tile-workers")
+    if parsed_args.jobs > 1 and parsed_args.scene_cache is not None:
+        parser.error("--jobs and --scene-cache can not be used together")
+    return CmdLineArgs(**vars(parsed_args))
 
 def make_filename_list(image_info: ImageInfo) -> "list[str]":
     # List of names for image files
@@ -158,9 +333,11 @@ def make_filename_list(image_info: ImageInfo) -> "list[str]":
 
 
 ### MAKING IMAGES ###
-def make_images(image_info: ImageInfo) -> list:
+def make_images(image_info: ImageInfo) -> "list[np.ndarray]":
+    """Makes a transparent (height, width, 4) RGBA color buffer for each image
+    """
     images = []
     for _ in range(image_info.number_of_images):
-        image = Image.new("RGBA", (image_info.width, image_info.height), (0,0,0,0))
+        image = np.zeros((image_info.height, image_info.width, 4), dtype=np.uint8)
         images.append(image)
     return images
\ No newline at end of file
@@ -28,7 +28,7 @@ class Vertex():
     def __iter__(self):
         return self
     def as_ndarray(self) -> np.ndarray:
-        return np.array(utils.object_to_list(self))
+        return np.array([self.x, self.y, self.z, self.w, self.r, self.g, self.b, self.a])
     def as_pixel(self) -> Pixel:
         return Pixel(
             x=round(self.x),
@@ -41,6 +41,146 @@ class Vertex():
     def position_data(self) -> np.ndarray:
         return np.array([self.x, self.y, self.z, self.w])
 
+class VertexBuffer():
+    """A growable store of vertices kept in contiguous arrays instead of a list of
+    Vertex objects. Positions are stored as (x, y, z, w) float64 rows and colors
+    as (r, g, b, a) float64 rows. The arrays double in size when they run out of
+    room, so appending is amortized O(1).
+    """
+    def __init__(self, capacity: int = 64):
+        self.positions: np.ndarray = np.empty((capacity, 4))
+        self.colors: np.ndarray = np.empty((capacity, 4))
+        self.count: int = 0
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __getitem__(self, index: int) -> Vertex:
+        """Makes a Vertex from the vertex at a zero based (or negative) index
+        """
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("vertex index out of range", index)
+        return Vertex(*self.positions[index].tolist(), *self.colors[index].tolist())
+
+    def reserve(self, capacity: int) -> None:
+        """Makes sure the buffer can hold at least capacity vertices
+        """
+        old_capacity = len(self.positions)
+        if capacity <= old_capacity:
+            return
+        new_capacity = max(capacity, 2 * old_capacity)
+        positions = np.empty((new_capacity, 4))
+        positions[:self.count] = self.positions[:self.count]
+        colors = np.empty((new_capacity, 4))
+        colors[:self.count] = self.colors[:self.count]
+        self.positions = positions
+        self.colors = colors
+
+    def append(self, x: float, y: float, z: float, color: "utils.RGBFloat") -> None:
+        self.reserve(self.count + 1)
+        self.positions[self.count] = (x, y, z, 1)
+        self.colors[self.count] = (color.r, color.g, color.b, color.a)
+        self.count += 1
+
+    def extend(self, positions: np.ndarray, color: "utils.RGBFloat", colors: "np.ndarray | None" = None) -> None:
+        """Appends an (n, 3) array of x, y, z positions that all share one color
+
+        Args:
+            colors (np.ndarray, optional): (n, 3) r, g, b of each vertex, used in
+                place of the r, g, b of color
+        """
+        n = len(positions)
+        self.reserve(self.count + n)
+        self.positions[self.count:self.count + n, :3] = positions
+        self.positions[self.count:self.count + n, 3] = 1
+        self.colors[self.count:self.count + n] = (color.r, color.g, color.b, color.a)
+        if colors is not None:
+            self.colors[self.count:self.count + n, :3] = colors
+        self.count += n
+
+    def index_of(self, index: str) -> int:
+        """Converts an index from an input file into a zero based index. Positive
+        indexes start counting at 1 and negative indexes count back from the most
+        recently added vertex.
+        """
+        if (index.strip("-")).isnumeric():
+            index = int(index)
+        else:
+            raise Exception("The index of a vertex must be a number", index)
+        return self.resolve_index(index)
+
+    def resolve_index(self, index: int) -> int:
+        """Converts an index that has already been read from a file into a zero
+        based index, see index_of
+        """
+        # if its a negative index just use that index
+        if index >= 0:
+            index -= 1
+        if index < 0:
+            index += self.count
+        if not 0 <= index < self.count:
+            raise IndexError("vertex index out of range", index)
+        return index
+
+    def resolve_ranges(self, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+        """Converts ranges of indexes that have already been read from a file into
+        the zero based indexes they cover, see indexes_of
+
+        Args:
+            starts, ends (np.ndarray): the first and last index of each range, like
+                the ones resolve_index takes
+
+        Returns:
+            np.ndarray: the zero based indexes of every range, in order
+        """
+        starts = np.asarray(starts, dtype=np.int64)
+        ends = np.asarray(ends, dtype=np.int64)
+        resolved = []
+        for indexes in (starts, ends):
+            indexes = np.where(indexes >= 0, indexes - 1, indexes)
+            indexes = np.where(indexes < 0, indexes + self.count, indexes)
+            out_of_range = (indexes < 0) | (indexes >= self.count)
+            if out_of_range.any():
+                raise IndexError("vertex index out of range", int(indexes[out_of_range][0]))
+            resolved.append(indexes)
+        starts, ends = resolved
+        if (ends < starts).any():
+            raise Exception("a range of vertex indexes must not go backwards")
+        counts = ends - starts + 1
+        return np.repeat(starts - np.cumsum(counts) + counts, counts) + np.arange(counts.sum())
+
+    def indexes_of(self, words: "list[str]") -> np.ndarray:
+        """Converts indexes from an input file into zero based indexes, see
+        parse_ranges
+        """
+        return self.resolve_ranges(*parse_ranges(words))
+
+    def clear(self) -> None:
+        self.count = 0
+
+def parse_ranges(words: "list[str]") -> "tuple[list[int], list[int]]":
+    """Reads the vertex indexes of a batch command. Each word is an index like
+    VertexBuffer.index_of takes, or a range first:last that covers every vertex
+    from first to last.
+
+    Returns:
+        tuple[list[int], list[int]]: the first and last index of each word
+    """
+    starts = []
+    ends = []
+    for word in words:
+        first, _, last = word.partition(":")
+        if not last:
+            last = first
+        for index in (first, last):
+            if not index.strip("-").isnumeric():
+                raise Exception("The index of a vertex must be a number", word)
+        starts.append(int(first))
+        ends.append(int(last))
+    return starts, ends
+
 def ndarray_to_vertex(q: np.ndarray, is_rounded: bool = True) -> Vertex:
     if is_rounded:
         return Vertex(
@@ -71,3 +211,49 @@ def parse_xyc(line: "list[str]") -> Vertex:
 def vertex_from_xyc(x: float, y: float, hex: str) -> Vertex:
     c: RGB = convert_hex_to_rgb(hex)
     return Vertex(x, y, c.r, c.g, c.b)
+
+@dataclasses.dataclass
+class Fragments():
+    """A batch of rasterized fragments stored as parallel arrays. x and y are
+    integer pixel coordinates, z is the interpolated depth and r, g, b, a are the
+    interpolated colors in the range 0-1. a is None when every fragment is opaque.
+    """
+    x: np.ndarray
+    y: np.ndarray
+    z: np.ndarray
+    r: np.ndarray
+    g: np.ndarray
+    b: np.ndarray
+    a: "np.ndarray | None" = None
+
+    def __len__(self) -> int:
+        return len(self.x)
+
+    def select(self, mask: np.ndarray) -> "Fragments":
+        """returns the fragments where mask is true (mask may also be an index array)
+        """
+        return Fragments(*(None if field is None else field[mask] for field in self.as_tuple()))
+
+    def as_tuple(self) -> "tuple[np.ndarray | None, ...]":
+        return (self.x, self.y, self.z, self.r, self.g, self.b, self.a)
+
+def empty_fragments() -> Fragments:
+    return Fragments(
+        x=np.empty(0, dtype=np.int64),
+        y=np.empty(0, dtype=np.int64),
+        z=np.empty(0),
+        r=np.empty(0),
+        g=np.empty(0),
+        b=np.empty(0),
+    )
+
+def concatenate_fragments(fragments: "list[Fragments]") -> Fragments:
+    if not fragments:
+        return empty_fragments()
+    if any(f.a is not None for f in fragments):
+        # opaque batches get an alpha of 1 so every batch has one
+        fragments = [f if f.a is not None else dataclasses.replace(f, a=np.ones(len(f))) for f in fragments]
+    return Fragments(*(
+        None if fields[0] is None else np.concatenate(fields)
+        for fields in zip(*(f.as_tuple() for f in fragments))
+    ))
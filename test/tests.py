@@ -1,11 +1,30 @@
+import os
+import subprocess
+import sys
+import tempfile
 import unittest
 
 import numpy as np
+import bench.pipeline as pipeline
+import bench.scenes as scenes
 import src.file_parse as file_parse
+import src.frame_cache as frame_cache
+import src.framebuffer as framebuffer
+import src.hiz as hiz
+import src.image_writer as image_writer
+import src.incremental as incremental
+import src.frames as frames
 import src.lines as lines
+import src.meshes as meshes
+import src.scene_cache as scene_cache
+import src.stats as stats
+import src.streams as streams
+import src.three_d as three_d
+import src.tiles as tiles
 import src.utils as utils
 import src.vertex as vertex
 import src.curves as curves
+import src.depth as depth
 
 
 class TestVertex(unittest.TestCase):
@@ -34,6 +53,61 @@ class TestVertex(unittest.TestCase):
         ll = np.array(l)
         self.assertEqual(ll.all(), v.as_ndarray().all())
 
+class TestVertexBuffer(unittest.TestCase):
+    def test_append_and_grow(self):
+        verts = vertex.VertexBuffer(capacity=1)
+        for i in range(10):
+            verts.append(i, 2 * i, 3 * i, utils.RGBFloat(0.5, 0.25, 0.0))
+        self.assertEqual(len(verts), 10)
+        self.assertGreaterEqual(len(verts.positions), 10)
+        self.assertEqual(verts[3], vertex.Vertex(3, 6, 9, 1, 0.5, 0.25, 0.0, 1.0))
+        self.assertEqual(verts[-1].x, 9)
+
+        verts.extend(np.array([[1, 2, 3], [4, 5, 6]]), utils.RGBFloat(1.0, 1.0, 1.0))
+        self.assertEqual(len(verts), 12)
+        self.assertEqual(verts.positions[11].tolist(), [4, 5, 6, 1])
+        self.assertEqual(verts.colors[11].tolist(), [1, 1, 1, 1])
+
+        verts.clear()
+        self.assertEqual(len(verts), 0)
+
+    def test_colors_keep_their_precision(self):
+        # 255 * 0.3 is 76.49999..., rounding a float32 0.3 would give 77
+        image = framebuffer.make_color_buffer(4, 4)
+        lines = ["color 0.3 0.3 0.3\n", "xyz -1 -1 0\n", "xyz 1 -1 0\n", "xyz -1 1 0\n", "trig 1 2 3\n"]
+        file_parse.parse_lines(lines, [image], utils.DrawData(vertex.VertexBuffer(), 4, 4))
+        drawn = image[image[:, :, 3] > 0]
+        self.assertTrue(len(drawn))
+        self.assertEqual(np.unique(drawn, axis=0).tolist(), [[76, 76, 76, 255]])
+
+    def test_index_of(self):
+        verts = vertex.VertexBuffer()
+        for i in range(5):
+            verts.append(i, 0, 0, utils.RGBFloat(1.0, 1.0, 1.0))
+        self.assertEqual(verts.index_of("1"), 0)
+        self.assertEqual(verts.index_of("5"), 4)
+        self.assertEqual(verts.index_of("-1"), 4)
+        self.assertEqual(verts.index_of("-5"), 0)
+        self.assertEqual(file_parse.get_vertex_by_index(verts, "2").x, 1)
+        with self.assertRaises(IndexError):
+            verts.index_of("6")
+        with self.assertRaises(IndexError):
+            verts.index_of("-6")
+        with self.assertRaises(Exception):
+            verts.index_of("a")
+
+    def test_indexes_of(self):
+        verts = vertex.VertexBuffer()
+        for i in range(5):
+            verts.append(i, 0, 0, utils.RGBFloat(1.0, 1.0, 1.0))
+        self.assertEqual(verts.indexes_of(["2", "1:3", "-2:-1", "4:4"]).tolist(), [1, 0, 1, 2, 3, 4, 3])
+        with self.assertRaises(IndexError):
+            verts.indexes_of(["1:6"])
+        with self.assertRaises(Exception):
+            verts.indexes_of(["3:1"])
+        with self.assertRaises(Exception):
+            verts.indexes_of(["1:a"])
+
 class TestUtils(unittest.TestCase):
     def test_convert_hex_to_rgb(self):
         hex_color = "#aaaaff"
@@ -121,6 +195,12 @@ class TestUtils(unittest.TestCase):
         self.assertEqual(draw_data_orig.model_view.all(), draw_data_updated.model_view.all())
         self.assertEqual(draw_data_orig.projection.all(), draw_data_updated.projection.all())
 
+    def test_parse_args(self):
+        args = utils.parse_args(["main.py", "scene.txt"])
+        self.assertEqual(args, utils.CmdLineArgs(file="scene.txt", jobs=1))
+        args = utils.parse_args(["main.py", "scene.txt", "-j", "4"])
+        self.assertEqual(args.jobs, 4)
+
     def test_draw_data_init(self):
         h = 20
         w = 10
@@ -142,6 +222,203 @@ class TestFileParse(unittest.TestCase):
             out = file_parse.line_to_list(line)
             self.assertEqual(out, expected)
 
+    def test_command_registry(self):
+        calls = []
+        @file_parse.command("testcommand")
+        def parse_test_command(line, image, draw_data):
+            calls.append(line)
+        try:
+            file_parse.parse_line(["testcommand", "1"], None, None)
+            # keywords without a handler are ignored
+            file_parse.parse_line(["notacommand"], None, None)
+        finally:
+            del file_parse.COMMANDS["testcommand"]
+        self.assertEqual(calls, [["testcommand", "1"]])
+
+    def test_parse_lines(self):
+        images = [framebuffer.make_color_buffer(4, 4), framebuffer.make_color_buffer(4, 4)]
+        draw_data = utils.DrawData(vertex.VertexBuffer(), 4, 4)
+        lines = iter([
+            "xyz -1 -1 0\n",
+            "\n",
+            "frame 1\n",
+            "color 1 0 0\n",
+            "xyz -1 -1 0\n",
+            "xyz 1 -1 0\n",
+            "xyz -1 1 0\n",
+            "trif 1 2 3\n",
+        ])
+        stats = file_parse.parse_lines(lines, images, draw_data)
+        self.assertEqual(stats.lines, 8)
+        # the frame keyword cleared the vertex from the first frame
+        self.assertEqual(len(draw_data.vertex_list), 3)
+        self.assertFalse(images[0].any())
+        self.assertEqual(images[1][0, 0].tolist(), [255, 0, 0, 255])
+
+class TestStats(unittest.TestCase):
+    def test_render_stats(self):
+        images = [framebuffer.make_color_buffer(4, 4), framebuffer.make_color_buffer(4, 4)]
+        draw_data = utils.DrawData(vertex.VertexBuffer(), 4, 4)
+        draw_data.stats = stats.RenderStats()
+        lines = iter([
+            "frame 0\n",
+            "xyz -1 -1 0.5\n",
+            "xyz 1 -1 0.5\n",
+            "xyz -1 1 0.5\n",
+            "xyz -1 -1 2\n",
+            "trif 1 2 3\n",
+            # the same z passes the depth test again
+            "trif 1 2 3\n",
+            # partly behind far
+            "trif 4 2 3\n",
+            "xyz -1 -1 2\n",
+            "xyz 1 -1 2\n",
+            "xyz -1 1 2\n",
+            # completely behind far
+            "trif -3 -2 -1\n",
+            "frame 1\n",
+        ])
+        file_parse.parse_lines(lines, images, draw_data)
+        render_stats = draw_data.stats
+        self.assertEqual(render_stats.triangles_submitted, 4)
+        self.assertEqual(render_stats.triangles_culled, 1)
+        self.assertEqual(render_stats.fragments_generated, 30)
+        self.assertEqual(render_stats.pixels_written, 20)
+        self.assertEqual(render_stats.fragments_rejected_near_far + render_stats.fragments_rejected_depth, 10)
+        self.assertGreater(render_stats.fragments_rejected_near_far, 0)
+        # the empty block before "frame 0" is not timed
+        self.assertEqual(len(render_stats.frame_seconds), 2)
+        # parsing is timed without the stages it ran
+        self.assertGreater(render_stats.parse_seconds, 0)
+        self.assertLessEqual(render_stats.parse_seconds + render_stats.stage_seconds, sum(render_stats.frame_seconds) + 1e-3)
+
+        total = stats.RenderStats()
+        total.add(render_stats)
+        total.add(render_stats)
+        self.assertEqual(total.pixels_written, 40)
+        self.assertEqual(len(total.frame_seconds), 4)
+
+class TestSceneCache(unittest.TestCase):
+    lines = [
+        "color 1 0 0\n",
+        "xyz -1 -1 0.5\n",
+        "xyz 1 -1 0.5\n",
+        "color 0 1 0 0.5\n",
+        "xyz -1 1 0.5\n",
+        "notacommand 1 2\n",
+        "trig 1 2 3\n",
+        "lineg 1 3\n",
+        "frame 1\n",
+        "translate 0.5 0 0\n",
+        "scale 1 0.5 1\n",
+        "cull front\n",
+        "xyz -1 -1 0.2\n",
+        "xyz 1 -1 0.2\n",
+        "xyz -1 1 0.2\n",
+        "trif 1 2 3\n",
+        "cull\n",
+        "trif -3 -2 -1\n",
+        "stripf 1 -3:-1\n",
+    ]
+
+    def draw(self, draw):
+        images = [framebuffer.make_color_buffer(8, 8), framebuffer.make_color_buffer(8, 8)]
+        draw(images, utils.DrawData(vertex.VertexBuffer(), 8, 8))
+        return images
+
+    def test_compile_lines(self):
+        scene = scene_cache.compile_lines(self.lines + ["trif 1 2 x\n"])
+        opcodes = scene.commands[:, 0].tolist()
+        self.assertEqual(opcodes[:4], [scene_cache.OP_COLOR, scene_cache.OP_XYZ, scene_cache.OP_COLOR, scene_cache.OP_XYZ])
+        # the first two vertices were added together
+        self.assertEqual(scene.commands[1].tolist(), [scene_cache.OP_XYZ, 0, 2, 0])
+        self.assertEqual(len(scene.positions), 6)
+        self.assertEqual(scene.colors.tolist(), [[1, 0, 0, 1], [0, 1, 0, 0.5]])
+        self.assertEqual(len(scene.matrices), 2)
+        # unknown keywords and lines with errors are kept as text
+        self.assertEqual(scene.text, [["notacommand", "1", "2"], ["trif", "1", "2", "x"]])
+
+    def test_replay_matches_parse_lines(self):
+        expected = self.draw(lambda images, draw_data: file_parse.parse_lines(self.lines, images, draw_data))
+        with tempfile.TemporaryDirectory() as cache_dir:
+            filename = os.path.join(cache_dir, "scene.txt")
+            with open(filename, "w") as file:
+                file.writelines(["pngs 8 8 scene 2\n"] + self.lines)
+            scene = scene_cache.load_or_compile(filename, cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+            self.assertIsInstance(scene.commands, np.memmap)
+            # the second load uses the saved scene
+            scene = scene_cache.load_or_compile(filename, cache_dir)
+            self.assertEqual(len(os.listdir(cache_dir)), 2)
+            images = self.draw(lambda images, draw_data: scene_cache.replay(scene, images, draw_data))
+        for image, expected_image in zip(images, expected):
+            self.assertTrue(image.any())
+            self.assertTrue(np.array_equal(image, expected_image))
+
+class TestFrames(unittest.TestCase):
+    def test_split_frames(self):
+        lines = [
+            "xyz 0 0 0\n",
+            "frame 1\n",
+            "color 1 0 0\n",
+            "\n",
+            "frame 0\n",
+            "trif 1 2 3\n",
+            "frame 1\n",
+        ]
+        expected = {
+            0: [["xyz 0 0 0\n"], ["trif 1 2 3\n"]],
+            1: [["color 1 0 0\n", "\n"], []],
+        }
+        self.assertEqual(frames.split_frames(lines), expected)
+
+class TestFrameCache(unittest.TestCase):
+    def test_frame_key(self):
+        job = frames.FrameJob(filename="out.png", width=4, height=4, blocks=[["xyz 0 0 0\n", "trif 1 1 1\n"]])
+        key = frame_cache.frame_key(job)
+        job.blocks = [["xyz  0 0 0\n", "\n", "trif 1 1 1"]]
+        self.assertEqual(frame_cache.frame_key(job), key)
+        job.blocks = [["xyz 0 0 0\n"], ["trif 1 1 1\n"]]
+        self.assertNotEqual(frame_cache.frame_key(job), key)
+        job.blocks = [[], ["xyz 0 0 0\n", "trif 1 1 1\n"]]
+        self.assertEqual(frame_cache.frame_key(job), key)
+        job.image_format = "ppm"
+        self.assertNotEqual(frame_cache.frame_key(job), key)
+
+    def test_render_cached(self):
+        blocks = "frame 0\nxyz -1 -1 0\nxyz 1 -1 0\nxyz 0 1 0\ncolor 1 0 0\ntrif 1 2 3\nframe 2\n"
+        with tempfile.TemporaryDirectory() as directory:
+            image_info = utils.ImageInfo(filename=os.path.join(directory, "out"), width=8, height=8, is_single_file=False, number_of_images=3)
+            cache = frame_cache.FrameCache(os.path.join(directory, "cache"), 1 << 20)
+            render_stats = frame_cache.render_cached(blocks.splitlines(True), image_info, cache, use_stats=True)
+            # the two empty frames are the same, so only one of them is drawn
+            self.assertEqual(render_stats.frames_cached, 1)
+            expected = []
+            for filename in utils.make_filename_list(image_info):
+                with open(filename, "rb") as file:
+                    expected.append(file.read())
+                os.remove(filename)
+            render_stats = frame_cache.render_cached(blocks.splitlines(True), image_info, cache, use_stats=True)
+            self.assertEqual(render_stats.frames_cached, 3)
+            for filename, data in zip(utils.make_filename_list(image_info), expected):
+                with open(filename, "rb") as file:
+                    self.assertEqual(file.read(), data)
+
+    def test_evict(self):
+        with tempfile.TemporaryDirectory() as directory:
+            source = os.path.join(directory, "frame.png")
+            with open(source, "wb") as file:
+                file.write(b"x" * 10)
+            cache = frame_cache.FrameCache(os.path.join(directory, "cache"), 25)
+            cache.put("a", source)
+            cache.put("b", source)
+            # using a makes b the least recently used frame
+            os.utime(cache.path("b"), ns=(0, 0))
+            self.assertTrue(cache.get("a", os.path.join(directory, "copy.png")))
+            cache.put("c", source)
+            self.assertEqual(sorted(os.listdir(cache.directory)), ["a", "c"])
+            self.assertEqual(cache.size, 20)
+
 class TestLines(unittest.TestCase):
     def test_dda(self):
         # test to enseure that only the smaller endpoint will be included
@@ -204,6 +481,24 @@ class TestLines(unittest.TestCase):
         self.assertEqual(actual, expected)
 
 
+    def test_dda_batch(self):
+        starts = np.array([[0.5, 0, 0, 1, 0, 0, 0, 1], [2, 1.2, 0, 1, 0, 0, 0, 1], [1, 1, 0, 1, 0, 0, 0, 1]])
+        ends = np.array([[4.5, 2, 1, 1, 1, 0, 0, 1], [2.4, 5, 0, 1, 0, 0, 0, 1], [1, 1, 0, 1, 0, 0, 0, 1]])
+        fragments = lines.dda_batch(starts, ends)
+        expected = []
+        for start, end in zip(starts, ends):
+            expected += [(round(q[0]), round(q[1])) for q in lines.dda(start, end)]
+        self.assertEqual(list(zip(fragments.x.tolist(), fragments.y.tolist())), expected)
+        # z and color are interpolated along the first segment
+        self.assertEqual(fragments.z[:4].tolist(), [0.125, 0.375, 0.625, 0.875])
+        self.assertEqual(fragments.r[:4].tolist(), [0.125, 0.375, 0.625, 0.875])
+        # only pixels on the screen are produced
+        self.assertEqual(len(lines.dda_batch(starts, ends, width=3, height=3)), 3)
+        # every pixel is inside of the bounds of its segment
+        x_min, y_min, x_max, y_max = lines.line_bounds(starts[1], ends[1])
+        fragments = lines.dda_batch(starts[1:2], ends[1:2])
+        self.assertTrue(((x_min <= fragments.x) & (fragments.x < x_max) & (y_min <= fragments.y) & (fragments.y < y_max)).all())
+
     def test_triangle_fill(self):
         p1 = vertex.Vertex(1,1)
         p2 = vertex.Vertex(1,3)
@@ -224,6 +519,61 @@ class TestLines(unittest.TestCase):
         expected = []
         self.assertEqual(t_points, expected)
 
+    def test_rasterize_triangle(self):
+        p1 = vertex.Vertex(1,1)
+        p2 = vertex.Vertex(1,3)
+        p3 = vertex.Vertex(3,1)
+        fragments = lines.rasterize_triangle(p1.as_ndarray(), p2.as_ndarray(), p3.as_ndarray())
+        # the same pixels triangle_fill produces
+        self.assertEqual(list(zip(fragments.x, fragments.y)), [(1, 1), (2, 1), (1, 2)])
+        self.assertTrue(np.all(fragments.z == 1))
+
+        # z is interpolated and pixels off of the screen are dropped
+        p1 = vertex.Vertex(-2, 0, z=0)
+        p2 = vertex.Vertex(4, 0, z=1)
+        p3 = vertex.Vertex(-2, 6, z=0)
+        fragments = lines.rasterize_triangle(p1.as_ndarray(), p2.as_ndarray(), p3.as_ndarray(), width=2, height=2)
+        self.assertEqual(list(zip(fragments.x, fragments.y)), [(0, 0), (1, 0), (0, 1), (1, 1)])
+        np.testing.assert_allclose(fragments.z, [2/6, 3/6, 2/6, 3/6])
+
+    def test_rasterize_triangle_with_zeroes(self):
+        p1 = vertex.Vertex(0,0)
+        fragments = lines.rasterize_triangle(p1.as_ndarray(), p1.as_ndarray(), p1.as_ndarray())
+        self.assertEqual(len(fragments), 0)
+
+    def test_rasterize_triangle_perspective_correct(self):
+        # the second point is three times as far away as the others
+        p1 = np.array([0, 0, 0.5, 1, 0, 0, 0, 1])
+        p2 = np.array([4, 0, 0.5, 3, 1, 0, 0, 1])
+        p3 = np.array([0, 4, 0.5, 1, 0, 0, 0, 1])
+        linear = lines.rasterize_triangle(p1, p2, p3)
+        corrected = lines.rasterize_triangle(p1, p2, p3, perspective_correct=True)
+        pixel = list(zip(linear.x, linear.y)).index((2, 1))
+        self.assertAlmostEqual(linear.r[pixel], 0.5)
+        self.assertAlmostEqual(corrected.r[pixel], 0.25)
+        # z was already divided by w, so it stays linear
+        self.assertTrue(np.array_equal(linear.z, corrected.z))
+
+        # with the same w everywhere nothing changes
+        p2[3] = 1
+        linear = lines.rasterize_triangle(p1, p2, p3)
+        corrected = lines.rasterize_triangle(p1, p2, p3, perspective_correct=True)
+        self.assertTrue(np.array_equal(linear.r, corrected.r))
+
+    def test_rasterize_triangles(self):
+        points = np.array([
+            [[1, 1, 0.5, 1, 1, 0, 0, 1], [1, 3, 0.5, 2, 0, 1, 0, 1], [3, 1, 0.5, 1, 0, 0, 1, 1]],
+            # winds the other way
+            [[-2, 0, 0, 1, 0, 0, 0, 1], [-2, 6, 0, 1, 0, 0, 0, 1], [4, 0, 1, 1, 0, 0, 0, 1]],
+            # no area
+            [[0, 0, 0, 1, 0, 0, 0, 1], [0, 0, 0, 1, 0, 0, 0, 1], [0, 0, 0, 1, 0, 0, 0, 1]],
+        ], dtype=float)
+        fragments, triangles = lines.rasterize_triangles(points, 4, 4, perspective_correct=True)
+        expected = [lines.rasterize_triangle(*triangle, width=4, height=4, perspective_correct=True) for triangle in points]
+        self.assertEqual(triangles.tolist(), [0] * len(expected[0]) + [1] * len(expected[1]))
+        for actual, wanted in zip(fragments.as_tuple(), vertex.concatenate_fragments(expected).as_tuple()):
+            self.assertTrue(np.array_equal(actual, wanted))
+
     def test_lerp(self):
         # Testing linear interpolation between np.ndarrays
         p1 = np.array([0,0,0,0])
@@ -243,6 +593,614 @@ class TestLines(unittest.TestCase):
         real = lines.lerp(p1, p2, t)
         self.assertEqual(expected.all(), real.all())
 
+class TestThreeD(unittest.TestCase):
+    def test_transform_vertices(self):
+        draw_data = utils.DrawData(vertex.VertexBuffer(), 10, 20)
+        color = utils.RGBFloat(1.0, 1.0, 1.0)
+        draw_data.vertex_list.append(0, 0, 0.5, color)
+        draw_data.vertex_list.append(-1, 1, 0.25, color)
+        expected = [[10, 5, 0.5, 1], [0, 10, 0.25, 1]]
+        self.assertEqual(three_d.transform_vertices(draw_data).tolist(), expected)
+        self.assertEqual(draw_data.transformed_epoch[:2].tolist(), [draw_data.transform_epoch] * 2)
+
+        # only the new vertex needs to be transformed
+        draw_data.vertex_list.append(1, -1, 0, color)
+        self.assertEqual(three_d.transform_vertices(draw_data, [2]).tolist(), [[20, 0, 0, 1]])
+
+        # changing a matrix makes the cache stale, and only the vertexes that are
+        # used are transformed again
+        translate = np.identity(4)
+        translate[0, 3] = 1
+        draw_data.multiply_model_view(translate)
+        self.assertIsNone(draw_data.mvp)
+        self.assertEqual(three_d.transform_vertices(draw_data, np.array([[2, 0], [0, 2]]))[:, :, 0].tolist(), [[30, 20], [20, 30]])
+        self.assertNotEqual(draw_data.transformed_epoch[1], draw_data.transform_epoch)
+        self.assertEqual(three_d.transform_vertices(draw_data)[:, 0].tolist(), [20, 10, 30])
+
+        projection = np.identity(4)
+        projection[3, 3] = 2
+        draw_data.set_projection(projection)
+        self.assertEqual(three_d.transform_vertices(draw_data)[0].tolist(), [15, 5, 0.25, 2])
+
+    def test_cull_triangle(self):
+        draw_data = utils.DrawData(vertex.VertexBuffer(), 10, 10)
+        # counter-clockwise, so a front face
+        p1, p2, p3 = (np.array([x, y, z, 1, 0, 0, 0, 1.0]) for x, y, z in ((1, 1, 0.5), (8, 1, 0.5), (1, 8, 0.5)))
+        self.assertFalse(three_d.cull_triangle(draw_data, p1, p2, p3))
+        # no area
+        self.assertTrue(three_d.cull_triangle(draw_data, p1, p1, p3))
+        # behind far
+        far = [p + np.array([0, 0, 1, 0, 0, 0, 0, 0]) for p in (p1, p2, p3)]
+        self.assertTrue(three_d.cull_triangle(draw_data, *far))
+        # off of the screen
+        off = [p + np.array([20, 0, 0, 0, 0, 0, 0, 0]) for p in (p1, p2, p3)]
+        self.assertTrue(three_d.cull_triangle(draw_data, *off))
+
+        draw_data.cull_face = "back"
+        self.assertFalse(three_d.cull_triangle(draw_data, p1, p2, p3))
+        self.assertTrue(three_d.cull_triangle(draw_data, p1, p3, p2))
+        draw_data.cull_face = "front"
+        self.assertTrue(three_d.cull_triangle(draw_data, p1, p2, p3))
+        self.assertFalse(three_d.cull_triangle(draw_data, p1, p3, p2))
+
+    def test_point_with_w_of_zero(self):
+        scene = [
+            "xyz -1 -1 0.5\n",
+            "xyz 1 -1 0.5\n",
+            "xyz 0.5 0.5 0\n",
+            # w is z, so the last point divides by 0
+            "loadp 1 0 0 0 0 1 0 0 0 0 1 0 0 0 1 0\n",
+        ]
+        for command in ("trif 1 2 3\n", "trifs 1 2 3\n", "trig 1 2 3\n", "line 1 3\n", "lineg 2 3\n"):
+            for renderer in (None, incremental.IncrementalRenderer(8, 8)):
+                image = framebuffer.make_color_buffer(8, 8)
+                draw_data = utils.DrawData(vertex.VertexBuffer(), 8, 8)
+                if renderer is not None:
+                    draw_data.display_list = []
+                with np.errstate(divide="ignore", invalid="ignore"):
+                    file_parse.parse_lines(scene + [command], [image], draw_data)
+                    if renderer is not None:
+                        renderer.render(image, draw_data)
+                # nothing is drawn, like before the triangle was culled
+                self.assertFalse(image.any())
+        p1, p2 = np.array([1, 1, 0.5, 1, 0, 0, 0, 1.0]), np.array([8, 1, 0.5, 1, 0, 0, 0, 1.0])
+        p3 = np.array([np.inf, np.inf, np.nan, 0, 0, 0, 0, 1.0])
+        self.assertTrue(three_d.cull_triangle(utils.DrawData(vertex.VertexBuffer(), 10, 10), p1, p2, p3))
+        self.assertIsNone(lines.triangle_bounds(p1, p2, p3))
+        self.assertTrue(three_d.cull_line(utils.DrawData(vertex.VertexBuffer(), 10, 10), p1, p3))
+        self.assertIsNone(lines.line_bounds(p1, p3))
+
+    def test_cull_command(self):
+        image = framebuffer.make_color_buffer(4, 4)
+        draw_data = utils.DrawData(vertex.VertexBuffer(), 4, 4)
+        lines = iter([
+            "xyz -1 -1 0\n",
+            "xyz -1 1 0\n",
+            "xyz 1 -1 0\n",
+            "cull\n",
+            "trif 1 2 3\n",
+        ])
+        file_parse.parse_lines(lines, [image], draw_data)
+        self.assertEqual(draw_data.cull_face, "back")
+        # the triangle winds clockwise, so it was thrown away
+        self.assertFalse(image.any())
+        with self.assertRaises(Exception):
+            file_parse.parse_line(["cull", "sideways"], image, draw_data)
+
+    def test_line_command(self):
+        image = framebuffer.make_color_buffer(8, 8)
+        draw_data = utils.DrawData(vertex.VertexBuffer(), 8, 8)
+        draw_data.stats = stats.RenderStats()
+        scene = [
+            "xyz -1 -1 0.5", "xyz 1 -1 0.5", "xyz -1 1 0.5", "trif 1 2 3",
+            "color 1 0 0",
+            # along the top row, behind the triangle
+            "xyz -1 -1 0.75", "xyz 1 -1 0.75", "line 4 5",
+            # along the bottom row, in front of everything
+            "xyz -1 0.75 0.25", "xyz 1 0.75 0.25", "line 6 7",
+            # behind far
+            "xyz -1 0 2", "xyz 1 0 2", "line 8 9",
+        ]
+        file_parse.parse_lines(scene, [image], draw_data)
+        # the white triangle hides the first line
+        self.assertEqual(image[0].tolist(), [[255, 255, 255, 255]] * 8)
+        self.assertEqual(image[7].tolist(), [[255, 0, 0, 255]] * 8)
+        self.assertEqual(draw_data.depth_buffer[7, 0], 0.25)
+        self.assertEqual(draw_data.stats.lines_submitted, 3)
+        self.assertEqual(draw_data.stats.lines_culled, 1)
+
+    def test_strip_and_fan_triangles(self):
+        indexes = np.arange(5)
+        self.assertEqual(three_d.strip_triangles(indexes).tolist(), [[0, 1, 2], [2, 1, 3], [2, 3, 4]])
+        self.assertEqual(three_d.fan_triangles(indexes).tolist(), [[0, 1, 2], [0, 2, 3], [0, 3, 4]])
+
+    def test_batches_match_single_triangles(self):
+        vertexes = [
+            "xyz -1 -1 0.5", "xyz 1 -1 0.25", "xyz -1 1 0.75", "xyz 1 1 0.5",
+            "color 1 0 0", "xyz 0 -1 0.1", "xyz 0.5 0.5 0.9", "cull back",
+        ]
+        batches = {
+            "trifs 1:3 2 4 3": ["trif 1 2 3", "trif 2 4 3"],
+            "stripg 1:4": ["trig 1 2 3", "trig 3 2 4"],
+            "fanf 5 -1 1:2 4": ["trif 5 -1 1", "trif 5 1 2", "trif 5 2 4"],
+        }
+        for batch, singles in batches.items():
+            images = []
+            for scene in ([batch], singles):
+                image = framebuffer.make_color_buffer(12, 10)
+                draw_data = utils.DrawData(vertex.VertexBuffer(), 10, 12)
+                draw_data.stats = stats.RenderStats()
+                file_parse.parse_lines(vertexes + scene, [image], draw_data)
+                images.append((image, draw_data.depth_buffer, draw_data.stats.triangles_culled))
+            self.assertTrue(images[0][0].any())
+            np.testing.assert_array_equal(images[0][0], images[1][0])
+            np.testing.assert_array_equal(images[0][1], images[1][1])
+            self.assertEqual(images[0][2], images[1][2])
+        with self.assertRaises(Exception):
+            file_parse.parse_lines(vertexes + ["trifs 1 2"], [image], draw_data)
+
+class TestTiles(unittest.TestCase):
+    def make_scene(self):
+        lines = [
+            "xyz -1 -1 0.5", "xyz 1 -1 0.5", "xyz -1 1 0.5", "trif 1 2 3",
+            "color 1 0 0",
+            "xyz -0.5 -0.9 0.5", "xyz 0.9 0.2 0.5", "xyz -0.2 0.9 0.5", "trif 4 5 6",
+            "color 0 1 0",
+            "xyz -1 1 0.2", "xyz 1 1 0.9", "xyz 1 -1 0.2", "trig 7 8 9",
+            "line 1 8", "lineg 7 9",
+        ]
+        return lines
+
+    def test_bin_triangles(self):
+        points = np.zeros((2, 3, 8))
+        points[0, :, :2] = [[0, 0], [10, 0], [0, 10]]
+        points[1, :, :2] = [[12, 12], [15, 12], [12, 15]]
+        bins = tiles.bin_triangles(points, 16, 16, 8)
+        self.assertEqual([region for region, _ in bins], [(0, 0, 8, 8), (8, 0, 16, 8), (0, 8, 8, 16), (8, 8, 16, 16)])
+        self.assertEqual([indexes.tolist() for _, indexes in bins], [[0], [0], [0], [0, 1]])
+
+    def test_tile_renderer_matches_serial(self):
+        width, height = 37, 29
+        serial_image = framebuffer.make_color_buffer(width, height)
+        serial_data = utils.DrawData(vertex.VertexBuffer(), height, width)
+        file_parse.parse_lines(self.make_scene(), [serial_image], serial_data)
+
+        tiled_image = framebuffer.make_color_buffer(width, height)
+        tiled_data = utils.DrawData(vertex.VertexBuffer(), height, width)
+        tiled_data.display_list = []
+        with tiles.TileRenderer(width, height, tiled_data.depth_buffer.dtype, workers=2, tile_size=8) as renderer:
+            file_parse.parse_lines(self.make_scene(), [tiled_image], tiled_data, end_frame=renderer.render)
+        self.assertTrue(serial_image.any())
+        np.testing.assert_array_equal(serial_image, tiled_image)
+        np.testing.assert_array_equal(serial_data.depth_buffer, tiled_data.depth_buffer)
+        self.assertEqual(tiled_data.display_list, [])
+
+class TestHiZ(unittest.TestCase):
+    def test_pyramid(self):
+        depth_buffer = np.ones((20, 30))
+        pyramid = hiz.HierarchicalZ(depth_buffer, block_size=8)
+        self.assertEqual([level.shape for level in pyramid.levels], [(3, 4), (2, 2), (1, 1)])
+        depth_buffer[0:16, 0:8] = 0.25
+        depth_buffer[3, 3] = 0.5
+        pyramid.update((0, 0, 8, 16))
+        self.assertEqual(pyramid.levels[0][:, 0].tolist(), [0.5, 0.25, 1])
+        self.assertEqual(pyramid.max_depth((0, 8, 8, 16)), 0.25)
+        self.assertEqual(pyramid.max_depth((0, 0, 30, 20)), 1)
+
+    def test_visible_regions(self):
+        depth_buffer = np.ones((16, 16))
+        depth_buffer[:, :8] = 0.25
+        pyramid = hiz.HierarchicalZ(depth_buffer, block_size=8)
+        # hidden in the left blocks only
+        self.assertEqual(pyramid.visible_regions(0.5, (2, 3, 14, 12)), [(8, 3, 14, 8), (8, 8, 14, 12)])
+        self.assertEqual(pyramid.stats.blocks_rejected, 2)
+        # completely hidden
+        self.assertEqual(pyramid.visible_regions(0.5, (0, 0, 8, 16)), [])
+        self.assertEqual(pyramid.stats.triangles_rejected, 1)
+        # in front of everything
+        self.assertEqual(pyramid.visible_regions(0.1, (2, 3, 14, 12)), [(2, 3, 14, 12)])
+
+    def test_drawing_with_hiz_matches(self):
+        scene = [
+            "xyz -1 -1 0.2", "xyz 1 -1 0.2", "xyz -1 1 0.2", "trif 1 2 3",
+            "color 1 0 0",
+            "xyz -1 -1 0.5", "xyz 1 -1 0.5", "xyz 1 1 0.5", "trif 4 5 6",
+            "color 0 1 0",
+            "xyz -1 1 0.1", "xyz 1 1 0.9", "xyz 1 -1 0.1", "trig 7 8 9",
+        ]
+        images = []
+        for use_hiz in (False, True):
+            image = framebuffer.make_color_buffer(40, 30)
+            draw_data = utils.DrawData(vertex.VertexBuffer(), 30, 40)
+            if use_hiz:
+                draw_data.hiz = hiz.HierarchicalZ(draw_data.depth_buffer, block_size=4)
+            file_parse.parse_lines(scene, [image], draw_data)
+            images.append(image)
+        np.testing.assert_array_equal(images[0], images[1])
+        self.assertGreater(draw_data.hiz.stats.blocks_rejected, 0)
+
+class TestIncremental(unittest.TestCase):
+    def test_matches_full_redraw(self):
+        lines = []
+        for frame in range(3):
+            lines.append(f"frame {frame}\n")
+            # a still triangle and one that moves to the right every frame
+            lines += ["color 1 0 0\n", "xyz -1 -1 0.5\n", "xyz 0 -1 0.5\n", "xyz -1 0 0.5\n", "trif -3 -2 -1\n"]
+            x = -0.75 + frame * 0.25
+            lines += ["color 0 0 1\n", f"xyz {x} -0.75 0.25\n", f"xyz {x + 0.5} -0.75 0.25\n", f"xyz {x} 0.5 0.75\n", "trig -3 -2 -1\n"]
+            lines += ["xyz -1 0.75 0.1\n", f"xyz {x} 1 0.1\n", "lineg -2 -1\n"]
+        # draws on top of the first frame, which can not be reused
+        lines += ["frame 0\n", "xyz -1 -1 0.1\n", "xyz 1 -1 0.1\n", "xyz -1 1 0.1\n", "trif 1 2 3\n"]
+
+        expected = [framebuffer.make_color_buffer(64, 48) for _ in range(3)]
+        file_parse.parse_lines(lines, expected, utils.DrawData(vertex.VertexBuffer(), 48, 64))
+
+        images = [framebuffer.make_color_buffer(64, 48) for _ in range(3)]
+        draw_data = utils.DrawData(vertex.VertexBuffer(), 48, 64)
+        draw_data.display_list = []
+        renderer = incremental.IncrementalRenderer(64, 48, block_size=8)
+        file_parse.parse_lines(lines, images, draw_data, end_frame=renderer.render)
+        self.assertEqual(renderer.reused_frames, 2)
+        self.assertLess(renderer.redrawn_pixels, 2 * 64 * 48)
+        for image, expected_image in zip(images, expected):
+            self.assertTrue(np.array_equal(image, expected_image))
+
+class TestMeshes(unittest.TestCase):
+    positions = [[-1, -1, 0.5], [1, -1, 0.25], [1, 1, 0.5], [-1, 1, 0.75], [0, 0, 0.1]]
+
+    def write_ply(self, filename, data_format):
+        byte_order = ">" if data_format == "binary_big_endian" else "<"
+        header = (
+            f"ply\nformat {data_format} 1.0\ncomment made for a test\n"
+            "element vertex 5\nproperty float x\nproperty float y\nproperty double z\n"
+            "property uchar red\nproperty uchar green\nproperty uchar blue\n"
+            "element face 2\nproperty list uchar int vertex_indices\nend_header\n"
+        )
+        colors = [[255, 0, 0], [0, 255, 0], [0, 0, 255], [255, 255, 0], [0, 0, 0]]
+        with open(filename, "wb") as file:
+            file.write(header.encode())
+            if data_format == "ascii":
+                for position, color in zip(self.positions, colors):
+                    file.write(" ".join(map(str, position + color)).encode() + b"\n")
+                file.write(b"4 0 1 2 3\n3 0 1 4\n")
+                return
+            vertexes = np.zeros(5, dtype=[("x", byte_order + "f4"), ("y", byte_order + "f4"), ("z", byte_order + "f8"), ("red", "u1"), ("green", "u1"), ("blue", "u1")])
+            for column, name in enumerate(("x", "y", "z")):
+                vertexes[name] = [position[column] for position in self.positions]
+            for column, name in enumerate(("red", "green", "blue")):
+                vertexes[name] = [color[column] for color in colors]
+            file.write(vertexes.tobytes())
+            for face in ([0, 1, 2, 3], [0, 1, 4]):
+                file.write(bytes([len(face)]) + np.array(face, dtype=byte_order + "i4").tobytes())
+
+    def test_read_obj(self):
+        mesh = meshes.read_obj(
+            "# a square and a triangle\n"
+            "v -1 -1 0.5\nv 1 -1 0.25\nvt 0 0\nvn 0 0 1\nv 1 1 0.5\nv -1 1 0.75\n"
+            "f 1/1/1 2/1/1 3//1 4\n"
+            "v 0 0 0.1\n"
+            "f -5 -4 -1\n"
+        )
+        self.assertEqual(mesh.positions.tolist(), self.positions)
+        self.assertEqual(mesh.triangles.tolist(), [[0, 1, 2], [0, 2, 3], [0, 1, 4]])
+        self.assertIsNone(mesh.colors)
+        with self.assertRaises(IndexError):
+            meshes.read_obj("v 0 0 0\nv 1 0 0\nv 0 1 0\nf 1 2 4\n")
+
+    def test_load_ply(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for data_format in ("ascii", "binary_little_endian", "binary_big_endian"):
+                filename = os.path.join(directory, data_format + ".ply")
+                self.write_ply(filename, data_format)
+                mesh = meshes.load_ply(filename)
+                self.assertEqual(mesh.positions.tolist(), self.positions)
+                self.assertEqual(mesh.triangles.tolist(), [[0, 1, 2], [0, 2, 3], [0, 1, 4]])
+                self.assertEqual(mesh.colors[:2].tolist(), [[1, 0, 0], [0, 1, 0]])
+                # the same precision as the colors of the vertex list
+                self.assertEqual(mesh.colors.dtype, np.float64)
+
+    def test_mesh_commands_match_triangles(self):
+        vertexes = [f"xyz {x} {y} {z}" for x, y, z in self.positions]
+        expected = framebuffer.make_color_buffer(12, 10)
+        file_parse.parse_lines(["color 1 0 1", "rotatez 30"] + vertexes + ["trifs 1 2 3 1 3 4 1 2 5"], [expected], utils.DrawData(vertex.VertexBuffer(), 10, 12))
+        with tempfile.TemporaryDirectory() as directory:
+            obj = os.path.join(directory, "mesh.obj")
+            with open(obj, "w") as file:
+                file.writelines(["v %s %s %s\n" % tuple(position) for position in self.positions] + ["f 1 2 3 4\n", "f 1 2 5\n"])
+            ply = os.path.join(directory, "mesh.ply")
+            self.write_ply(ply, "binary_little_endian")
+            for command in (f"obj {obj}", f"ply {ply}", f"ply {ply} flat"):
+                image = framebuffer.make_color_buffer(12, 10)
+                draw_data = utils.DrawData(vertex.VertexBuffer(), 10, 12)
+                file_parse.parse_lines(["color 1 0 1", "rotatez 30", command], [image], draw_data)
+                self.assertEqual(len(draw_data.vertex_list), 5)
+                np.testing.assert_array_equal(image, expected)
+            # gouraud shading uses the colors of the PLY vertexes
+            file_parse.parse_lines(["color 1 0 1", f"ply {ply} gouraud"], [image], draw_data)
+            self.assertEqual(draw_data.vertex_list.colors[5].tolist(), [1, 0, 0, 1])
+
+class TestFramebuffer(unittest.TestCase):
+    def test_write_fragments(self):
+        color_buffer = framebuffer.make_color_buffer(3, 2)
+        depth_buffer = np.ones((2, 3))
+        depth_buffer[0, 1] = 0.25
+        fragments = vertex.Fragments(
+            x=np.array([0, 1, 2]),
+            y=np.array([0, 0, 1]),
+            z=np.array([0.5, 0.5, 1.0]),
+            r=np.array([1.0, 1.0, 0.0]),
+            g=np.array([0.0, 0.0, 0.5]),
+            b=np.array([0.0, 0.0, 1.0]),
+        )
+        framebuffer.write_fragments(color_buffer, depth_buffer, fragments)
+        # (1, 0) is behind what is already in the depth buffer
+        self.assertEqual(color_buffer[0, 0].tolist(), [255, 0, 0, 255])
+        self.assertEqual(color_buffer[0, 1].tolist(), [0, 0, 0, 0])
+        # fragments with a z equal to the depth buffer are kept
+        self.assertEqual(color_buffer[1, 2].tolist(), [0, 128, 255, 255])
+        self.assertEqual(depth_buffer.tolist(), [[0.5, 0.25, 1.0], [1.0, 1.0, 1.0]])
+
+        # a flat color replaces the colors of the fragments
+        framebuffer.write_fragments(color_buffer, depth_buffer, fragments, utils.RGB(1, 2, 3))
+        self.assertEqual(color_buffer[0, 0].tolist(), [1, 2, 3, 255])
+
+    def test_write_fragments_in_order(self):
+        color_buffer = framebuffer.make_color_buffer(2, 1)
+        depth_buffer = np.array([[0.5, 1.0]])
+        # three fragments at (0, 0) and three at (1, 0)
+        fragments = vertex.Fragments(
+            x=np.array([0, 1, 0, 1, 0, 1]),
+            y=np.zeros(6, dtype=np.int64),
+            z=np.array([0.75, 0.5, 0.25, 0.75, 0.25, 0.5]),
+            r=np.array([0.0, 0.0, 0.2, 0.4, 0.6, 0.8]),
+            g=np.zeros(6),
+            b=np.zeros(6),
+        )
+        written = framebuffer.write_fragments_in_order(color_buffer, depth_buffer, fragments)
+        # the first fragment at (0, 0) is behind the depth buffer, the last one of
+        # each pixel ties with the one before it and wins
+        self.assertEqual(written, 4)
+        self.assertEqual(color_buffer[0, :, 0].tolist(), [153, 204])
+        self.assertEqual(depth_buffer.tolist(), [[0.25, 0.5]])
+
+    def test_write_fragments_unorm(self):
+        color_buffer = framebuffer.make_color_buffer(2, 1)
+        depth_buffer = depth.make_depth_buffer(2, 1, "unorm16")
+        self.assertEqual(depth_buffer.tolist(), [[65535, 65535]])
+        depth_buffer[0, 1] = depth.to_depth(0.5, depth_buffer.dtype)
+        fragments = vertex.Fragments(
+            x=np.array([0, 1]),
+            y=np.zeros(2, dtype=np.int64),
+            z=np.array([0.25, 0.5 + 1e-7]),
+            r=np.ones(2),
+            g=np.zeros(2),
+            b=np.zeros(2),
+        )
+        # at 16 bits the second fragment ties with the depth buffer and passes
+        self.assertEqual(framebuffer.write_fragments(color_buffer, depth_buffer, fragments), 2)
+        self.assertEqual(depth_buffer.tolist(), [[16384, 32768]])
+
+    def test_blend_over(self):
+        random = np.random.default_rng(5)
+        over = random.integers(0, 256, (200, 4))
+        under = random.integers(0, 256, (200, 4))
+        under[:10, 3] = 0
+        over[:5, 3] = 0
+        color_buffer = under.astype(np.uint8).reshape(1, 200, 4)
+        framebuffer.blend_over(color_buffer, np.zeros(200, dtype=np.int64), np.arange(200), over)
+        expected = []
+        for a, b in zip(over.tolist(), under.tolist()):
+            if a[3] == b[3] == 0:
+                # add_pixel_colors divides by the alpha of the result
+                expected.append([0, 0, 0, 0])
+                continue
+            result = utils.add_pixel_colors(utils.RGB(*a), utils.RGB(*b))
+            expected.append([result.r, result.g, result.b, result.a])
+        self.assertEqual(color_buffer[0].tolist(), expected)
+
+        # premultiplied colors give the same image up to rounding once they are divided again
+        straight = framebuffer.make_color_buffer(2, 1)
+        premultiplied = framebuffer.make_color_buffer(2, 1)
+        for color in ((255, 0, 0, 128), (0, 0, 255, 64), (10, 200, 30, 255), (0, 255, 0, 100)):
+            framebuffer.blend_over(straight, np.array([0, 0]), np.array([0, 1]), color)
+            framebuffer.blend_over(premultiplied, np.array([0, 0]), np.array([0, 1]), color, premultiplied=True)
+        framebuffer.unpremultiply(premultiplied)
+        self.assertLessEqual(np.abs(straight.astype(int) - premultiplied).max(), 1)
+
+    def test_write_fragments_blend(self):
+        color_buffer = framebuffer.make_color_buffer(2, 1)
+        color_buffer[0, 0] = (0, 0, 255, 255)
+        depth_buffer = np.array([[0.5, 1.0]])
+        fragments = vertex.Fragments(
+            x=np.array([0, 1]),
+            y=np.zeros(2, dtype=np.int64),
+            z=np.array([0.25, 0.25]),
+            r=np.ones(2),
+            g=np.zeros(2),
+            b=np.zeros(2),
+            a=np.array([0.5, 1.0]),
+        )
+        replaced = color_buffer.copy()
+        framebuffer.write_fragments(replaced, depth_buffer.copy(), fragments)
+        self.assertEqual(replaced[0].tolist(), [[255, 0, 0, 128], [255, 0, 0, 255]])
+        framebuffer.write_fragments(color_buffer, depth_buffer, fragments, blend="over")
+        self.assertEqual(color_buffer[0].tolist(), [[128, 0, 127, 255], [255, 0, 0, 255]])
+        # translucent fragments still write their depth
+        self.assertEqual(depth_buffer.tolist(), [[0.25, 0.25]])
+        with self.assertRaises(Exception):
+            framebuffer.write_fragments(color_buffer, depth_buffer, fragments, utils.RGB(1, 2, 3, 4), blend="add")
+
+    def test_write_fragments_in_order_blend(self):
+        random = np.random.default_rng(2)
+        n = 300
+        fragments = vertex.Fragments(
+            x=random.integers(0, 4, n),
+            y=random.integers(0, 3, n),
+            z=random.random(n),
+            r=random.random(n),
+            g=random.random(n),
+            b=random.random(n),
+            a=random.random(n),
+        )
+        for blend in ("over", "premultiplied"):
+            for color in (None, utils.RGB(200, 100, 0, 90)):
+                expected_colors = framebuffer.make_color_buffer(4, 3)
+                expected_depth = np.full((3, 4), 0.9)
+                expected_written = sum(
+                    framebuffer.write_fragments(expected_colors, expected_depth, fragments.select([i]), color, blend)
+                    for i in range(n)
+                )
+                color_buffer = framebuffer.make_color_buffer(4, 3)
+                depth_buffer = np.full((3, 4), 0.9)
+                written = framebuffer.write_fragments_in_order(color_buffer, depth_buffer, fragments, color, blend)
+                self.assertEqual(written, expected_written)
+                self.assertTrue(np.array_equal(color_buffer, expected_colors))
+                self.assertTrue(np.array_equal(depth_buffer, expected_depth))
+
+    def test_buffer_pool(self):
+        pool = framebuffer.BufferPool(max_free=1)
+        buffer = pool.take((2, 3), np.uint16)
+        pool.give(buffer)
+        pool.give(np.empty((2, 3), dtype=np.uint16))
+        self.assertIs(pool.take((2, 3), np.uint16), buffer)
+        self.assertIsNot(pool.take((2, 3), np.uint16), buffer)
+        self.assertEqual(pool.take((2, 3), np.float32).dtype, np.float32)
+
+    def test_encode_image(self):
+        color_buffer = framebuffer.make_color_buffer(2, 1)
+        color_buffer[0, 1] = [1, 2, 3, 4]
+        self.assertEqual(framebuffer.encode_image(color_buffer, "ppm"), b"P6\n2 1\n255\n\0\0\0\1\2\3")
+        # the compression level changes the size of a png but not its pixels
+        png = framebuffer.encode_image(color_buffer, "png", compress_level=0)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "image.png")
+            framebuffer.save_image(color_buffer, filename, "png", compress_level=9)
+            with open(filename, "rb") as file:
+                self.assertNotEqual(file.read(), png)
+            self.assertEqual(np.asarray(framebuffer.Image.open(filename)).tolist(), color_buffer.tolist())
+        self.assertEqual(framebuffer.image_filename("out001.png", "ppm"), "out001.ppm")
+        self.assertEqual(framebuffer.image_filename("out001.png", "png"), "out001.png")
+        with self.assertRaises(Exception):
+            framebuffer.encode_image(color_buffer, "gif")
+
+class TestDepth(unittest.TestCase):
+    def test_to_depth(self):
+        z = np.array([-0.5, 0.0, 0.25, 0.2500001, 1.0, 2.0])
+        self.assertIs(depth.to_depth(z, np.float64), z)
+        self.assertEqual(depth.to_depth(z, np.uint16).tolist(), [0, 0, 16384, 16384, 65535, 65535])
+        self.assertEqual(depth.to_depth(1.0, np.uint32), (1 << 24) - 1)
+        for dtype in depth.FORMATS.values():
+            # converting never reorders two z values
+            values = depth.to_depth(np.sort(np.random.default_rng(0).uniform(0, 1, 100)), dtype)
+            self.assertTrue((np.diff(values.astype(np.float64)) >= 0).all())
+
+    def test_clear(self):
+        draw_data = utils.DrawData(vertex.VertexBuffer(), 2, 3, depth_format="unorm24")
+        self.assertEqual(draw_data.depth_buffer.dtype, np.uint32)
+        draw_data.depth_buffer[:] = 5
+        draw_data.clear()
+        self.assertTrue((draw_data.depth_buffer == (1 << 24) - 1).all())
+        # a reused buffer is cleared
+        reused = np.zeros((2, 3), dtype=np.float32)
+        draw_data = utils.DrawData(vertex.VertexBuffer(), 2, 3, depth_format="float32", depth_buffer=reused)
+        self.assertIs(draw_data.depth_buffer, reused)
+        self.assertTrue((reused == 1).all())
+        with self.assertRaises(Exception):
+            depth.make_depth_buffer(2, 2, "float16")
+
+class TestImageWriter(unittest.TestCase):
+    def test_frame_writer(self):
+        with tempfile.TemporaryDirectory() as directory:
+            filenames = [os.path.join(directory, f"out{i}.ppm") for i in range(4)]
+            # image 1 is drawn by the second and the fourth block, image 3 by none
+            blocks = [0, 1, 2, 1]
+            with image_writer.FrameWriter(filenames, 2, 1, blocks, image_format="ppm", workers=2) as writer:
+                expected = []
+                for index, value in zip(blocks, (10, 20, 30, 40)):
+                    image = writer[index]
+                    image[0, 0, 0] += value
+                    writer.end_frame(image, None)
+                    expected.append(image.copy())
+                    # an image is let go of after the last block that draws into it
+                    self.assertEqual(index in writer.images, index == 1 and value == 20)
+                with self.assertRaises(Exception):
+                    writer[0]
+            expected = [expected[0], expected[3], expected[2], framebuffer.make_color_buffer(2, 1)]
+            for image, filename in zip(expected, filenames):
+                with open(filename, "rb") as file:
+                    self.assertEqual(file.read(), framebuffer.encode_image(image, "ppm"))
+            self.assertEqual(expected[1][0, 0, 0], 60)
+
+    def test_block_images(self):
+        lines = ["xyz 0 0 0\n", "frame 2\n", "# frame 5\n", "frame 0\n", "trif 1 1 1\n"]
+        self.assertEqual(frames.block_images(lines), [0, 2, 0])
+        self.assertEqual(scene_cache.block_images(scene_cache.compile_lines(lines[:2] + lines[3:])), [0, 2, 0])
+
+class TestStreams(unittest.TestCase):
+    def test_apng_writer(self):
+        frames = [np.zeros((3, 4, 4), dtype=np.uint8) for _ in range(3)]
+        frames[0][:, :, 3] = 255
+        frames[1][:] = frames[0]
+        frames[1][1, 2] = [10, 20, 30, 255]
+        frames[2][:] = frames[1]
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "out.png")
+            with open(filename, "wb") as file:
+                writer = streams.ApngWriter(file, 4, 3, len(frames), fps=10)
+                for frame in frames:
+                    writer.write_frame(frame)
+                writer.close()
+            with framebuffer.Image.open(filename) as image:
+                self.assertEqual(image.n_frames, 3)
+                for index, frame in enumerate(frames):
+                    image.seek(index)
+                    self.assertEqual(np.asarray(image.convert("RGBA")).tolist(), frame.tolist())
+
+    def test_frame_stream(self):
+        image_info = utils.ImageInfo(filename="out", width=2, height=1, is_single_file=False, number_of_images=4)
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "out.rgba")
+            with streams.FrameStream(filename, "rgba", image_info) as stream:
+                stream[0][0, 0] = 1
+                # drawing into the same frame again keeps what was drawn
+                stream[0][0, 1] = 2
+                stream[2][0, 0] = 3
+                with self.assertRaises(Exception):
+                    stream[1]
+            frames = np.fromfile(filename, dtype=np.uint8).reshape(4, 1, 2, 4)
+        # frames that were never drawn into are written empty
+        self.assertEqual(frames[:, 0, :, 0].tolist(), [[1, 2], [0, 0], [3, 0], [0, 0]])
+
+    def test_rgba_stdout_only_has_frames(self):
+        # stdout is the stream, so nothing else may be printed to it
+        main = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "main.py")
+        with tempfile.TemporaryDirectory() as directory:
+            filename = os.path.join(directory, "scene.txt")
+            with open(filename, "w") as file:
+                file.write("pngs 4 4 out 2\nrotate 30 0 0 1\nxyz -1 -1 0\nxyz 1 -1 0\nxyz -1 1 0\ntrif 1 2 3\nframe 1\n")
+            output = subprocess.run([sys.executable, main, filename, "--format", "rgba"], cwd=directory, stdout=subprocess.PIPE, check=True).stdout
+        self.assertEqual(len(output), 2 * 4 * 4 * 4)
+
+class TestBench(unittest.TestCase):
+    def test_generate_scene(self):
+        config = scenes.SceneConfig(triangles=5, overdraw=2, frames=3, gouraud=True)
+        lines = scenes.generate_scene(config, "out")
+        self.assertEqual(lines[0], "pngs 256 256 out 3\n")
+        self.assertEqual(sum(line.startswith("trig") for line in lines), 15)
+        self.assertEqual(sum(line.startswith("frame") for line in lines), 3)
+
+    def test_stages_match_end_to_end(self):
+        config = scenes.SceneConfig(triangles=20, triangle_size=12, overdraw=2, width=32, height=24, frames=2, gouraud=True)
+        lines = scenes.generate_scene(config)
+        with tempfile.TemporaryDirectory() as staged, tempfile.TemporaryDirectory() as end_to_end:
+            result = pipeline.run_stages(lines, staged)
+            pipeline.run_end_to_end(lines, end_to_end)
+            self.assertEqual(result.triangles, 40)
+            self.assertGreater(result.pixels_written, 0)
+            for name in ("bench000.png", "bench001.png"):
+                with open(os.path.join(staged, name), "rb") as a, open(os.path.join(end_to_end, name), "rb") as b:
+                    self.assertEqual(a.read(), b.read())
+
 class TestCurves(unittest.TestCase):
     def test_draw_bezier_point(self):
         p1 = vertex.Vertex(0,0)
@@ -253,3 +1211,56 @@ class TestCurves(unittest.TestCase):
         result = curves.draw_bezier_point(vertex_list, .5)
         expected = vertex.Vertex(3.0, 2.25)
         self.assertEqual(result,expected)
+
+    def test_draw_circle(self):
+        color = utils.RGB(10, 20, 30)
+        # the points of a radius 2 circle, in the order of the midpoint loop
+        points = [(v.x, v.y) for v in curves.draw_circle(5, 5, 2, color)]
+        self.assertEqual(points[:8], [(3, 5), (3, 5), (7, 5), (7, 5), (5, 3), (5, 7), (5, 3), (5, 7)])
+        self.assertEqual(len(points), 16)
+        self.assertEqual(set(points[8:]), {(4, 4), (4, 6), (6, 4), (6, 6)})
+
+        # the shared pixels are only produced once, and x = 7 is off of the screen
+        fragments = curves.circle_fragments(5, 5, 2, color, width=6, height=10)
+        self.assertEqual(len(fragments), 5)
+
+    def test_fill_circle(self):
+        color = utils.RGB(10, 20, 30)
+        color_buffer = framebuffer.make_color_buffer(8, 6)
+        curves.fill_circle(color_buffer, 2, 2, 2, color)
+        # the outline of a radius 2 circle is a diamond
+        expected = [
+            [0, 0, 1, 0, 0, 0, 0, 0],
+            [0, 1, 1, 1, 0, 0, 0, 0],
+            [1, 1, 1, 1, 1, 0, 0, 0],
+            [0, 1, 1, 1, 0, 0, 0, 0],
+            [0, 0, 1, 0, 0, 0, 0, 0],
+            [0, 0, 0, 0, 0, 0, 0, 0],
+        ]
+        self.assertEqual((color_buffer[:, :, 3] == 255).astype(int).tolist(), expected)
+        self.assertEqual(color_buffer[2, 2].tolist(), [10, 20, 30, 255])
+        # spans are clipped to the screen
+        rows, starts, ends = curves.disk_spans(0, 0, 2, 8, 6)
+        self.assertEqual(rows.tolist(), [0, 1, 2])
+        self.assertEqual(starts.tolist(), [0, 0, 0])
+        self.assertEqual(ends.tolist(), [3, 2, 1])
+
+    def test_draw_bezier_curve(self):
+        # a curve with its control points on a line is drawn as one segment
+        straight = [vertex.Vertex(0, 0), vertex.Vertex(3, 1), vertex.Vertex(6, 2), vertex.Vertex(9, 3)]
+        control_points = np.stack([point.as_ndarray() for point in straight])
+        self.assertEqual(curves.flattening_divisions(control_points), 1)
+        fragments = curves.draw_bezier_curve(straight)
+        self.assertEqual(fragments.x.tolist(), list(range(9)))
+
+        # a tighter tolerance needs more segments
+        bent = [vertex.Vertex(0, 0), vertex.Vertex(20, 40), vertex.Vertex(60, -10), vertex.Vertex(80, 30)]
+        control_points = np.stack([point.as_ndarray() for point in bent])
+        self.assertLess(curves.flattening_divisions(control_points, 1), curves.flattening_divisions(control_points, 0.1))
+        fragments = curves.draw_bezier_curve(bent)
+        self.assertEqual((fragments.x[0], fragments.y[0]), (0, 0))
+        # every pixel touches the one before it
+        self.assertTrue((np.abs(np.diff(fragments.x)) <= 1).all())
+        self.assertTrue((np.abs(np.diff(fragments.y)) <= 1).all())
+        # no pixel is repeated right after itself
+        self.assertTrue(((np.diff(fragments.x) != 0) | (np.diff(fragments.y) != 0)).all())